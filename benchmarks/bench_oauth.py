@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# See LICENSE.txt for details
+
+"""
+Microbenchmark of OAuth request signing.
+
+Compares building and signing an L{oauth.OAuthRequest} per request, as
+C{Twitter} did before, with L{signing.OAuthSigner}.
+
+Usage: python benchmarks/bench_oauth.py [requests]
+"""
+
+import sys
+import timeit
+
+from oauth import oauth
+
+from twittytwister import signing
+
+consumer = oauth.OAuthConsumer('cChZNFj6T5R0TigYB9yd1w',
+                               'L8qq9PZyRg6ieKGEKhZolGC0vJWLw8iEJ88DRdyOg')
+token = oauth.OAuthToken('7588892-kagSNqWge8gB1WwE3plnFsJHAZVfxWD7Vb57p0b4',
+                         'PbKfYqSryyeKDWz4ebtY3o5ogNLG11WJuZBc9fQrQo')
+method = oauth.OAuthSignatureMethod_HMAC_SHA1()
+signer = signing.OAuthSigner(consumer, token)
+
+url = 'https://api.twitter.com/1/statuses/user_timeline.xml'
+params = {'screen_name': 'ralphm', 'count': '200', 'since_id': '1234567890'}
+
+def oldPath():
+    request = oauth.OAuthRequest.from_consumer_and_token(consumer,
+        token=token, http_method='GET', http_url=url, parameters=params)
+    request.sign_request(method, consumer, token)
+    return request.to_header()
+
+def newPath():
+    return signer.makeHeader('GET', url, params)
+
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    results = []
+    for name, fn in (('OAuthRequest', oldPath), ('OAuthSigner', newPath)):
+        elapsed = min(timeit.repeat(fn, number=number, repeat=3))
+        results.append(elapsed)
+        print '%-14s %8.1f us/request %10.0f requests/s' % (
+            name, elapsed / number * 1e6, number / elapsed)
+    print 'speedup: %.2fx' % (results[0] / results[1])
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# See LICENSE.txt for details
+
+"""
+Benchmark of parsing REST timelines as XML and as JSON.
+
+Parses the same timeline of statuses, with their users, through
+L{txml.Statuses} and through L{tjson.Statuses}, fed in chunks as they would
+arrive from the network.
+
+Usage: python benchmarks/bench_parsers.py [statuses]
+"""
+
+import sys
+import timeit
+
+import simplejson as json
+
+from twittytwister import tjson, txml
+
+from fixtures import makeStatuses, toXML
+
+CHUNK_SIZE = 4096
+
+def parse(factory, data):
+    statuses = []
+    parser = factory(statuses.append)
+    for i in xrange(0, len(data), CHUNK_SIZE):
+        parser.write(data[i:i + CHUNK_SIZE])
+    parser.close()
+    return statuses
+
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    statuses = makeStatuses(count)
+    def suxStatuses(delegate):
+        return txml.Statuses(delegate, parser=txml.SuxParser)
+
+    documents = (('txml (sux)', suxStatuses, toXML(statuses)),
+                 ('tjson', tjson.Statuses, json.dumps(statuses)))
+
+    results = []
+    for name, factory, data in documents:
+        parsed = parse(factory, data)
+        assert len(parsed) == count
+        assert parsed[-1].user.screen_name == statuses[-1]['user']['screen_name']
+        number = max(1, 2000 // count)
+        elapsed = min(timeit.repeat(lambda: parse(factory, data),
+                                    number=number, repeat=3)) / number
+        results.append(elapsed)
+        print '%-12s %7d bytes %8.2f ms/timeline %10.0f statuses/s' % (
+            name, len(data), elapsed * 1e3, count / elapsed)
+    print 'speedup: %.1fx' % (results[0] / results[1])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# See LICENSE.txt for details
+
+"""
+Benchmark REST calls per second against a local stand-in server.
+
+Compares a new connection per call, as the REST client used to make, with
+L{twitter.Twitter.show_user} over the persistent connection pool. Every call
+asks for another user, so that identical GET requests are not coalesced and
+the pool figures measure connection reuse.
+
+Usage: python benchmarks/bench_rest_pool.py [calls] [concurrency]
+"""
+
+import itertools
+import sys
+import time
+
+from twisted.internet import defer, reactor, task
+from twisted.web import client, resource, server
+
+from twittytwister import twitter, txml
+
+USER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<user>
+  <id>70393696</id>
+  <name>ikDisplay</name>
+  <screen_name>ikdisplay</screen_name>
+  <followers_count>1</followers_count>
+</user>
+"""
+
+class StandIn(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'application/xml')
+        request.setHeader('X-RateLimit-Limit', '350')
+        request.setHeader('X-RateLimit-Remaining', '349')
+        request.setHeader('X-RateLimit-Reset', '1277485629')
+        return USER_XML
+
+
+
+class CountingSite(server.Site):
+    connections = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        return server.Site.buildProtocol(self, addr)
+
+
+
+def runConcurrently(call, calls, concurrency):
+    work = (call() for i in xrange(calls))
+    coop = task.Cooperator()
+    return defer.DeferredList([coop.coiterate(work)
+                               for i in xrange(concurrency)])
+
+
+
+@defer.inlineCallbacks
+def main(calls, concurrency):
+    site = CountingSite(StandIn())
+    port = reactor.listenTCP(0, site, interface='127.0.0.1')
+    baseURL = 'http://127.0.0.1:%d/1' % port.getHost().port
+    api = twitter.Twitter(base_url=baseURL)
+    counter = itertools.count()
+    oneShot = client.Agent(reactor,
+                           pool=client.HTTPConnectionPool(reactor,
+                                                          persistent=False))
+
+    def oldCall():
+        url = baseURL + '/users/show/user%d.xml' % counter.next()
+        def parse(body):
+            parser = txml.Users(lambda user: None)
+            parser.write(body)
+            parser.close()
+
+        d = oneShot.request('GET', url)
+        d.addCallback(client.readBody)
+        d.addCallback(parse)
+        return d
+
+    def newCall():
+        return api.show_user('user%d' % counter.next())
+
+    for name, call in (('connection per call', oldCall),
+                       ('connection pool', newCall)):
+        for c in (1, concurrency):
+            site.connections = 0
+            start = time.time()
+            yield runConcurrently(call, calls, c)
+            elapsed = time.time() - start
+            print ('%-20s concurrency %3d: %8.1f calls/s, %5d connections' %
+                   (name, c, calls / elapsed, site.connections))
+
+    # Should be 0, or the pool figures include coalesced calls.
+    print 'coalesced GET requests: %d' % api.coalesced
+
+    yield api.pool.closeCachedConnections()
+    yield port.stopListening()
+
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    d = main(calls, concurrency)
+    d.addErrback(lambda f: f.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
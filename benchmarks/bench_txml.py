@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# See LICENSE.txt for details
+
+"""
+Throughput benchmark of the txml parser backends.
+
+Parses a large status list and a large page of users with
+L{txml.SuxParser} and L{txml.ExpatParser}, fed in chunks as they would
+arrive from the network, and reports the memory retained by the parsed
+objects.
+
+Usage: python benchmarks/bench_txml.py [items]
+"""
+
+import gc
+import sys
+import timeit
+import types
+
+from twittytwister import txml
+
+from bench_parsers import CHUNK_SIZE
+from fixtures import statusList, userListPage
+
+def parseStatuses(data, backend):
+    items = []
+    parser = txml.Statuses(items.append, parser=backend)
+    feed(parser, data)
+    return items
+
+
+def parseUserListPage(data, backend):
+    items = []
+    parser = txml.PagedUserList.pagingParser(items.append, lambda page: None,
+                                             parser=backend)
+    feed(parser, data)
+    return items
+
+
+def retained(objects):
+    """
+    Return the number of objects, and the number of bytes they take, among
+    the given objects and everything they refer to, except for classes,
+    functions and modules.
+    """
+    shared = (type, types.ClassType, types.FunctionType, types.ModuleType)
+    seen = set()
+    size = 0
+    pending = list(objects)
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, shared):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        pending.extend(gc.get_referents(o))
+    return len(seen), size
+
+
+def feed(parser, data):
+    for i in xrange(0, len(data), CHUNK_SIZE):
+        parser.write(data[i:i + CHUNK_SIZE])
+    parser.close()
+
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    documents = (('StatusList', parseStatuses, statusList(count)),
+                 ('UserListPage', parseUserListPage, userListPage(count)))
+
+    for name, parse, data in documents:
+        results = []
+        for backend in (txml.SuxParser, txml.ExpatParser):
+            assert len(parse(data, backend)) == count
+            elapsed = min(timeit.repeat(lambda: parse(data, backend),
+                                        number=1, repeat=3))
+            results.append(elapsed)
+            print '%-12s %-12s %8.1f ms %8.2f MB/s %9.0f items/s' % (
+                name, backend.__name__, elapsed * 1e3,
+                len(data) / elapsed / 1e6, count / elapsed)
+        print '%-12s speedup: %.1fx' % (name, results[0] / results[1])
+        print '%-12s retained: %.0f bytes/item' % (
+            name, float(retained(parse(data, backend))[1]) / count)
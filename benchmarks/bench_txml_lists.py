@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# See LICENSE.txt for details
+
+"""
+Benchmark suite of the txml parsers for every list type.
+
+Generates a document for each list type in L{txml} at several sizes, see
+L{fixtures}, and feeds it through the matching parser factory in chunks
+the size of TCP segments and TLS records. For each document, this reports:
+
+ - the throughput, in items and megabytes per second, best of three runs;
+ - the objects and bytes retained by the parsed items, as found by
+   walking their references, which counts the objects that a parse
+   allocates and keeps;
+ - the growth of the peak resident set size while parsing, measured in a
+   fresh process.
+
+Usage: python benchmarks/bench_txml_lists.py [size ...]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from twittytwister import txml
+
+import fixtures
+from bench_txml import retained
+
+SIZES = (20, 200, 2000)
+
+# TCP segments of a single and a few packets, and full TLS records
+CHUNK_SIZES = (1448, 2896, 4344, 16384)
+
+def pagingParser(pager):
+    def create(delegate):
+        return pager.pagingParser(delegate, lambda page: None)
+    return create
+
+
+CASES = (('EntryList', fixtures.entryList, txml.Feed),
+         ('UserList', fixtures.userList, txml.Users),
+         ('DirectMessageList', fixtures.directMessageList, txml.Direct),
+         ('StatusList', fixtures.statusList, txml.Statuses),
+         ('IDListPage', fixtures.idListPage, pagingParser(txml.PagedIDList)),
+         ('UserListPage', fixtures.userListPage,
+          pagingParser(txml.PagedUserList)))
+
+def parse(factory, data):
+    items = []
+    parser = factory(items.append)
+    offset = 0
+    i = 0
+    while offset < len(data):
+        size = CHUNK_SIZES[i % len(CHUNK_SIZES)]
+        parser.write(data[offset:offset + size])
+        offset += size
+        i += 1
+    parser.close()
+    return items
+
+
+def peakSize():
+    """
+    Return the peak resident set size of this process in kilobytes, or
+    C{None} if it is not available.
+    """
+    try:
+        # On Linux, ru_maxrss also covers the process image before exec,
+        # so use the peak of the current image.
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    except IOError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # in bytes instead of kilobytes
+        peak //= 1024
+    return peak
+
+
+def resetPeak():
+    """
+    Reset the peak resident set size to the current size, if possible.
+    """
+    try:
+        f = open('/proc/self/clear_refs', 'w')
+        f.write('5')
+        f.close()
+    except IOError:
+        pass
+
+
+def peakGrowth(name, data):
+    """
+    Return the growth of the peak resident set size while parsing a
+    document, in kilobytes, or C{None} if it cannot be measured.
+
+    The document is parsed in a fresh process, so that memory freed earlier
+    in this process does not hide the growth.
+    """
+    fd, path = tempfile.mkstemp()
+    try:
+        os.write(fd, data)
+        os.close(fd)
+        child = subprocess.Popen([sys.executable, __file__, '--peak', name,
+                                  path], stdout=subprocess.PIPE)
+        output = child.communicate()[0].strip()
+    finally:
+        os.remove(path)
+    if output == 'None':
+        return None
+    return int(output)
+
+
+def measurePeak(name, path):
+    """
+    Parse a document from a file, in the child process of L{peakGrowth}.
+    """
+    factory = dict([(case[0], case[2]) for case in CASES])[name]
+    data = open(path, 'rb').read()
+    # Importing reaches a higher peak than some of the parses.
+    resetPeak()
+    before = peakSize()
+    parse(factory, data)
+    after = peakSize()
+    if before is None:
+        return None
+    return after - before
+
+
+def run(name, makeDocument, factory, count):
+    data = makeDocument(count)
+    items = parse(factory, data)
+    assert len(items) == count, (name, len(items))
+    objects, size = retained(items)
+    del items
+
+    peak = peakGrowth(name, data)
+    number = max(1, 2000 // count)
+    elapsed = min(timeit.repeat(lambda: parse(factory, data),
+                                number=number, repeat=3)) / number
+
+    print '%-18s %6d %9d %9.2f %9.0f %7.2f %8.1f %8.0f %9s' % (
+        name, count, len(data), elapsed * 1e3, count / elapsed,
+        len(data) / elapsed / 1e6, float(objects) / count,
+        float(size) / count, peak is None and '-' or peak)
+
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--peak']:
+        print measurePeak(*sys.argv[2:4])
+        sys.exit()
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    print 'parser: %s' % (txml.Parser.__name__,)
+    print '%-18s %6s %9s %9s %9s %7s %8s %8s %9s' % (
+        'document', 'items', 'bytes', 'ms', 'items/s', 'MB/s',
+        'obj/item', 'B/item', 'peak KiB')
+    for name, makeDocument, factory in CASES:
+        for count in sizes:
+            run(name, makeDocument, factory, count)
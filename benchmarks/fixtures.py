@@ -0,0 +1,194 @@
+# See LICENSE.txt for details
+
+"""
+Generated REST responses for the benchmarks.
+
+The documents follow the layout of the XML responses of the REST API, with
+realistic field values, including markup and non-ASCII text. Each document
+function takes the number of items and returns the document as a UTF-8
+encoded string.
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+TEXTS = [u'Status %d with some text, a #hashtag, a link http://t.co/abc '
+         u'and \u2603',
+         u'@ralphm Short reply %d',
+         u'Status %d that goes on for a while, to fill up most of the '
+         u'characters allowed & quoting "somebody" <here>. #xmpp #twisted']
+
+def makeUser(i):
+    return {'id': 1000 + i,
+            'name': u'User \xe9 %d' % i,
+            'screen_name': 'user%d' % i,
+            'location': 'Enschede, The Netherlands',
+            'description': 'Tweets about <things> & "stuff"',
+            'profile_image_url': 'http://a0.twimg.com/profile_images/1/a.png',
+            'url': 'http://example.org/',
+            'protected': False,
+            'followers_count': 1234,
+            'friends_count': 321,
+            'created_at': 'Wed Mar 03 19:37:35 +0000 2010',
+            'favourites_count': 5,
+            'utc_offset': 3600,
+            'time_zone': 'Amsterdam',
+            'statuses_count': 9876,
+            'verified': False}
+
+
+def makeStatus(i, user=None):
+    status = {'id': 30000000000 + i,
+              'created_at': 'Thu Oct 11 12:00:00 +0000 2012',
+              'text': TEXTS[i % len(TEXTS)] % i,
+              'source': '<a href="http://example.org">web</a>',
+              'truncated': False,
+              'in_reply_to_status_id': None,
+              'in_reply_to_user_id': None,
+              'in_reply_to_screen_name': None,
+              'favorited': False}
+    if user is not None:
+        status['user'] = user
+    return status
+
+
+def makeStatuses(count):
+    """
+    Make statuses by 50 different users, each with their user.
+    """
+    return [makeStatus(i, makeUser(i % 50)) for i in xrange(count)]
+
+
+def makeUsers(count):
+    """
+    Make distinct users, each with their latest status.
+    """
+    users = []
+    for i in xrange(count):
+        user = makeUser(i)
+        user['status'] = makeStatus(i)
+        users.append(user)
+    return users
+
+
+def makeDirectMessages(count):
+    messages = []
+    for i in xrange(count):
+        sender = makeUser(i % 50)
+        recipient = makeUser(50)
+        messages.append({'id': 4000000 + i,
+                         'sender_id': sender['id'],
+                         'text': TEXTS[i % len(TEXTS)] % i,
+                         'recipient_id': recipient['id'],
+                         'created_at': 'Thu Oct 11 12:00:00 +0000 2012',
+                         'sender_screen_name': sender['screen_name'],
+                         'recipient_screen_name': recipient['screen_name'],
+                         'sender': sender,
+                         'recipient': recipient})
+    return messages
+
+
+def element(name, value):
+    """
+    Serialize a value as an element. Dictionaries become nested elements.
+    """
+    if isinstance(value, dict):
+        return u'<%s>%s</%s>' % (name, u''.join([element(k, v) for k, v
+                                                 in value.iteritems()]), name)
+    if value is None:
+        value = ''
+    elif isinstance(value, bool):
+        value = str(value).lower()
+    elif not isinstance(value, basestring):
+        value = str(value)
+    return u'<%s>%s</%s>' % (name, escape(value), name)
+
+
+def document(root, itemTag, items):
+    """
+    Serialize a list of items as an array document.
+    """
+    parts = [u'<?xml version="1.0" encoding="UTF-8"?>\n'
+             u'<%s type="array">' % root]
+    parts.extend([element(itemTag, item) for item in items])
+    parts.append(u'</%s>' % root)
+    return u'\n'.join(parts).encode('utf-8')
+
+
+def toXML(statuses):
+    """
+    Serialize statuses as returned by the timeline resources.
+    """
+    return document('statuses', 'status', statuses)
+
+
+def statusList(count):
+    return toXML(makeStatuses(count))
+
+
+def userList(count):
+    return document('users', 'user', makeUsers(count))
+
+
+def directMessageList(count):
+    return document('direct-messages', 'direct_message',
+                    makeDirectMessages(count))
+
+
+def _cursors():
+    return ('<next_cursor>1300794057949944903</next_cursor>'
+            '<previous_cursor>0</previous_cursor>')
+
+
+def userListPage(count):
+    """
+    Serialize a page of users, as returned by the cursored user resources.
+    """
+    declaration, users = document('users', 'user',
+                                  makeUsers(count)).split('\n', 1)
+    return '%s\n<users_list>%s%s</users_list>' % (declaration, users,
+                                                  _cursors())
+
+
+def idListPage(count):
+    ids = u''.join([u'<id>%d</id>' % (1000 + i * 7) for i in xrange(count)])
+    return (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+            u'<id_list><ids>%s</ids>%s</id_list>' % (ids, _cursors())
+            ).encode('utf-8')
+
+
+def entryList(count):
+    """
+    Serialize an Atom feed of search results.
+    """
+    entries = []
+    for i in xrange(count):
+        user = makeUser(i % 50)
+        url = 'http://twitter.com/%s/statuses/%d' % (user['screen_name'],
+                                                    30000000000 + i)
+        text = escape(TEXTS[i % len(TEXTS)] % i)
+        entries.append(
+            u'<entry>'
+            u'<id>tag:search.twitter.com,2005:%d</id>'
+            u'<published>2012-10-11T12:00:00Z</published>'
+            u'<link type="text/html" href=%s rel="alternate"/>'
+            u'<title>%s</title>'
+            u'<content type="html">%s</content>'
+            u'<updated>2012-10-11T12:00:00Z</updated>'
+            u'<link type="image/png" href=%s rel="image"/>'
+            u'<twitter:source>%s</twitter:source>'
+            u'<twitter:lang>en</twitter:lang>'
+            u'<author><name>%s (%s)</name><uri>http://twitter.com/%s</uri>'
+            u'</author>'
+            u'</entry>' % (30000000000 + i, quoteattr(url), text,
+                           escape(text),
+                           quoteattr(user['profile_image_url']),
+                           escape('<a href="http://example.org">web</a>'),
+                           user['screen_name'], user['name'],
+                           user['screen_name']))
+    return (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+            u'<feed xmlns:google="http://base.google.com/ns/1.0" '
+            u'xmlns="http://www.w3.org/2005/Atom" '
+            u'xmlns:twitter="http://api.twitter.com/">'
+            u'<id>tag:search.twitter.com,2005:search/xmpp</id>'
+            u'<title>xmpp - Twitter Search</title>'
+            u'%s</feed>' % u'\n'.join(entries)).encode('utf-8')
@@ -12,8 +12,8 @@ import sys
 from oauth import oauth
 
 from twisted.python import log
-from twisted.internet import reactor
-from twittytwister import twitter
+from twisted.internet import reactor, task
+from twittytwister import trends, twitter
 
 class Application(cyclone.web.Application):
     def __init__(self):
@@ -28,34 +28,78 @@ class Application(cyclone.web.Application):
         handlers = [
             (r"/", MainHandler),
             (r"/tweetbox", TweetSocketHandler),
+            (r"/trends", TrendsHandler),
+            (r"/trendbox", TrendSocketHandler),
             (r"/(.*)", cyclone.web.StaticFileHandler,
                 dict(path=settings['static_path'])),
         ]
         cyclone.web.Application.__init__(self, handlers, **settings)
 
-class MainHandler(cyclone.web.RequestHandler):
-    def get(self):
-        self.render("index.html")
+        # hashtags and terms from all tracked tweets, pushed to the
+        # trendbox sockets every few seconds
+        self.trends = trends.TrendingAggregator()
+        self.trendSockets = set()
+        self.trendPusher = task.LoopingCall(self.pushTrends)
+        self.trendPusher.start(5, now=False)
 
-class TweetSocketHandler(cyclone.websocket.WebSocketHandler):
-    def connectionMade(self, *args, **kwargs):
-        log.msg("ws opened")
+        # one stream for the whole application, so that every tweet is
+        # counted once, however many tweetbox sockets are open
+        self.tweetSockets = set()
 
         # create a auth.py with 2 vars: 
         # consumer(oauth.OAuthConsumer) and token(oauth.OAuthToken)
         auth = __import__("auth")
-        twitter.TwitterFeed(
-            consumer=auth.consumer, 
-            token=auth.token) \
-        .track(self.tweetReceived, set(["locaweb", "techtalk"])) \
-        .addErrback(log.err)
+        feed = twitter.TwitterFeed(consumer=auth.consumer, token=auth.token)
+        self.monitor = twitter.TwitterMonitor(
+            feed.filter, self.tweetReceived,
+            {"track": "locaweb,techtalk"})
+        self.monitor.startService()
 
     def tweetReceived(self, tweet):
         log.msg("tweet received", tweet.text)
-        self.sendMessage(tweet.text)
+        self.trends.statusReceived(tweet)
+        for socket in self.tweetSockets:
+            socket.sendMessage(tweet.text)
+
+    def pushTrends(self):
+        if not self.trendSockets:
+            return
+        message = cyclone.escape.json_encode({"trends": self.trends.top()})
+        for socket in self.trendSockets:
+            socket.sendMessage(message)
+
+class MainHandler(cyclone.web.RequestHandler):
+    def get(self):
+        self.render("index.html")
+
+class TrendsHandler(cyclone.web.RequestHandler):
+    def get(self):
+        try:
+            n = int(self.get_argument("n", 20))
+            window = int(self.get_argument("window", 300))
+        except ValueError:
+            raise cyclone.web.HTTPError(400, "n and window must be integers")
+        try:
+            top = self.application.trends.top(n, window)
+        except ValueError, e:
+            raise cyclone.web.HTTPError(400, str(e))
+        self.write({"window": window, "trends": top})
+
+class TrendSocketHandler(cyclone.websocket.WebSocketHandler):
+    def connectionMade(self, *args, **kwargs):
+        self.application.trendSockets.add(self)
+
+    def connectionLost(self, reason):
+        self.application.trendSockets.discard(self)
+
+class TweetSocketHandler(cyclone.websocket.WebSocketHandler):
+    def connectionMade(self, *args, **kwargs):
+        log.msg("ws opened")
+        self.application.tweetSockets.add(self)
 
     def connectionLost(self, reason):
         log.msg("ws closed %s" % reason)
+        self.application.tweetSockets.discard(self)
 
     def messageReceived(self, message):
         log.msg("got message %s" % message)
@@ -0,0 +1,167 @@
+# -*- test-case-name: twittytwister.test.test_backfill -*-
+#
+# See LICENSE.txt for details
+
+"""
+Fetching of the statuses missed while a stream was disconnected.
+"""
+
+from twisted.internet import defer
+from twisted.python import log
+
+from twittytwister import tjson
+
+def statusId(entry):
+    """
+    Return the status id of an entry as an integer, or C{None}.
+
+    Statuses from the Streaming API and the JSON REST responses have
+    integer ids, those from XML responses have string ids, and Atom
+    search results have ids like C{'tag:search.twitter.com,2005:1234'}.
+    """
+    id = getattr(entry, 'id', None)
+    if isinstance(id, basestring):
+        try:
+            return int(id.rsplit(':', 1)[-1])
+        except ValueError:
+            return None
+    return id
+
+
+def mergeEntries(*streams):
+    """
+    Merge lists of entries into one list in id order, without duplicates.
+
+    Entries without an id are put last, in their original order.
+    """
+    seen = set()
+    merged = []
+    unknown = []
+    for entries in streams:
+        for entry in entries:
+            id = statusId(entry)
+            if id is None:
+                unknown.append(entry)
+            elif id not in seen:
+                seen.add(id)
+                merged.append((id, entry))
+    merged.sort(key=lambda item: item[0])
+    return [entry for id, entry in merged] + unknown
+
+
+
+class Backfill(object):
+    """
+    Fetch the statuses that match the filter of a stream from the REST API.
+
+    An instance can be used as L{twittytwister.twitter.TwitterMonitor.backfill}.
+    The timelines of followed users are fetched with C{user_timeline}, and
+    the tracked terms are searched for, a few terms per query. Up to
+    L{concurrency} requests are in flight at a time, and each of them is
+    paged back until it reaches the requested id or L{maxPages} pages.
+
+    The client should be in JSON mode, so that the statuses are of the same
+    type as those received from the stream. Tracked terms are only searched
+    for in JSON mode: in XML mode search results are Atom entries instead
+    of statuses, so only the timelines of followed users are fetched.
+
+    @ivar twitter: The REST client.
+    @type twitter: L{twittytwister.twitter.Twitter}
+
+    @ivar concurrency: Maximum number of requests in flight.
+    @type concurrency: C{int}
+
+    @ivar termsPerQuery: Number of tracked terms combined in a search query.
+    @type termsPerQuery: C{int}
+
+    @ivar maxPages: Maximum number of pages fetched per user or query.
+    @type maxPages: C{int}
+    """
+
+    concurrency = 4
+    termsPerQuery = 10
+    maxPages = 5
+    timelineCount = 200
+    searchCount = 100
+
+    def __init__(self, twitter):
+        self.twitter = twitter
+
+
+    def __call__(self, args, sinceId):
+        """
+        Fetch the statuses newer than C{sinceId} that match a filter.
+
+        Failures of single users or queries are logged and skipped.
+        Tracked terms are skipped unless the client is in JSON mode.
+
+        @param args: The arguments of the stream, with comma separated
+            C{'track'} and C{'follow'} values.
+        @return: Deferred that fires with the statuses in id order.
+        """
+        semaphore = defer.DeferredSemaphore(self.concurrency)
+        deferreds = []
+
+        def run(f, *args):
+            d = semaphore.run(f, *args)
+            d.addErrback(log.err, "Backfill request failed")
+            d.addCallback(lambda entries: entries or [])
+            deferreds.append(d)
+
+        for user in _split(args.get('follow')):
+            run(self._pages, self._userTimeline, user, sinceId,
+                self.timelineCount)
+        terms = _split(args.get('track'))
+        if terms and self.twitter.parsers is not tjson:
+            log.msg("Not backfilling tracked terms, "
+                    "search needs a client in JSON mode")
+            terms = []
+        for i in xrange(0, len(terms), self.termsPerQuery):
+            query = ' OR '.join(terms[i:i + self.termsPerQuery])
+            run(self._pages, self._search, query, sinceId, self.searchCount)
+
+        d = defer.gatherResults(deferreds)
+        d.addCallback(lambda results: mergeEntries(*results))
+        return d
+
+
+    @defer.inlineCallbacks
+    def _pages(self, fetch, query, sinceId, count):
+        """
+        Fetch the pages of a timeline or search until C{sinceId}.
+        """
+        entries = []
+        maxId = None
+        for page in xrange(self.maxPages):
+            received = []
+            yield fetch(received.append, query, sinceId, maxId, page + 1)
+            entries.extend(received)
+            ids = [statusId(entry) for entry in received]
+            ids = [id for id in ids if id is not None]
+            if len(received) < count or not ids:
+                break
+            maxId = min(ids) - 1
+        defer.returnValue([entry for entry in entries
+                           if statusId(entry) > sinceId])
+
+
+    def _userTimeline(self, delegate, user, sinceId, maxId, page):
+        # Request arguments are urlencoded as strings.
+        params = {'user_id': str(user), 'since_id': str(sinceId),
+                  'count': str(self.timelineCount)}
+        if maxId is not None:
+            params['max_id'] = str(maxId)
+        return self.twitter.user_timeline(delegate, params=params)
+
+
+    def _search(self, delegate, query, sinceId, maxId, page):
+        params = {'since_id': str(sinceId), 'rpp': str(self.searchCount),
+                  'page': str(page)}
+        return self.twitter.search(query, delegate, params)
+
+
+
+def _split(value):
+    if not value:
+        return []
+    return [item for item in value.split(',') if item]
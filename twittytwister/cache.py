@@ -0,0 +1,192 @@
+# -*- test-case-name: twittytwister.test.test_cache -*-
+#
+# See LICENSE.txt for details
+
+"""
+Response cache for REST GET requests.
+"""
+
+from collections import OrderedDict
+
+class CacheEntry(object):
+    """
+    A cached response.
+
+    Instead of the raw response body, the parsed results are stored, in the
+    order they were delivered, so that a cache hit can skip parsing
+    altogether.
+
+    @ivar events: List of C{(isPage, value)} tuples. For items, C{value} is
+        the parsed object. For paging information, C{value} is a tuple of
+        the next and previous cursor.
+
+    @ivar expires: Time after which the entry needs revalidation.
+
+    @ivar etag: The C{ETag} of the response, if any.
+
+    @ivar lastModified: The C{Last-Modified} date of the response, if any.
+    """
+
+    def __init__(self, events, expires, etag=None, lastModified=None):
+        self.events = events
+        self.expires = expires
+        self.etag = etag
+        self.lastModified = lastModified
+
+
+    def validators(self):
+        """
+        Return the conditional request headers to revalidate this entry.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastModified:
+            headers['If-Modified-Since'] = self.lastModified
+        return headers
+
+
+
+class ResponseCache(object):
+    """
+    Size-bounded LRU cache of parsed REST responses, with per-endpoint TTLs.
+
+    Endpoints are named after the L{twittytwister.twitter.Twitter} method
+    that requests them. Only endpoints with a positive TTL are cached.
+
+    Entries past their TTL are not served directly. If they carry an
+    C{ETag} or C{Last-Modified} validator, they are kept to be revalidated
+    with a conditional request, otherwise they are dropped.
+
+    Note that cached objects are shared between all callers that get them
+    from the cache, so they should not be modified.
+
+    @cvar defaultTTLs: Default TTL in seconds, per endpoint.
+    @type defaultTTLs: C{dict}
+
+    @ivar maxEntries: Maximum number of entries kept.
+    @type maxEntries: C{int}
+
+    @ivar hits: Number of requests served from the cache.
+    @ivar misses: Number of requests that needed a full download.
+    @ivar revalidations: Number of stale entries confirmed by the server.
+    @ivar evictions: Number of entries dropped to make room.
+    """
+
+    defaultTTLs = {
+        'verify_credentials': 300,
+        'show_user': 300,
+        'list_members': 300,
+        'friends': 30,
+        'home_timeline': 30,
+        'mentions': 30,
+        'public_timeline': 30,
+        'user_timeline': 60,
+        'list_timeline': 60,
+        }
+
+    def __init__(self, maxEntries=1000, ttls=None, reactor=None):
+        """
+        @param ttls: TTLs in seconds per endpoint, overriding
+            L{defaultTTLs}. Use 0 to disable caching for an endpoint.
+        @type ttls: C{dict}
+        """
+        self.maxEntries = maxEntries
+        self.ttls = dict(self.defaultTTLs)
+        if ttls:
+            self.ttls.update(ttls)
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def cacheable(self, endpoint):
+        """
+        Return whether responses for C{endpoint} are cached.
+        """
+        return self.ttls.get(endpoint, 0) > 0
+
+
+    def lookup(self, key):
+        """
+        Look up an entry.
+
+        @return: A tuple of a boolean telling whether the entry is fresh,
+            and the entry itself, or C{None}. Stale entries are only
+            returned when they can be revalidated.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        if self.reactor.seconds() < entry.expires:
+            self._entries[key] = entry
+            self.hits += 1
+            return True, entry
+
+        if entry.etag or entry.lastModified:
+            self._entries[key] = entry
+            return False, entry
+
+        self.misses += 1
+        return False, None
+
+
+    def store(self, key, endpoint, events, etag=None, lastModified=None):
+        """
+        Store the parsed results of a response.
+        """
+        expires = self.reactor.seconds() + self.ttls.get(endpoint, 0)
+        self._entries.pop(key, None)
+        self._entries[key] = CacheEntry(events, expires, etag, lastModified)
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def revalidated(self, entry, endpoint):
+        """
+        Mark a stale entry as confirmed by the server.
+        """
+        entry.expires = self.reactor.seconds() + self.ttls.get(endpoint, 0)
+        self.revalidations += 1
+
+
+    def invalidated(self, key):
+        """
+        Drop a stale entry that could not be revalidated.
+        """
+        self._entries.pop(key, None)
+        self.misses += 1
+
+
+    def clear(self):
+        self._entries.clear()
+
+
+    def stats(self):
+        """
+        Return cache statistics.
+        """
+        lookups = self.hits + self.misses + self.revalidations
+        if lookups:
+            hitRate = float(self.hits + self.revalidations) / lookups
+        else:
+            hitRate = 0.0
+        return {'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+                'hitRate': hitRate}
@@ -0,0 +1,184 @@
+# -*- test-case-name: twittytwister.test.test_checkpoint -*-
+#
+# See LICENSE.txt for details
+
+"""
+Durable checkpoints of the state of stream monitors.
+
+A checkpoint store keeps a JSON-serializable dictionary per name, and has
+two methods: C{load(name)}, returning the last saved state or C{None}, and
+C{save(name, state)}. Both are called from the reactor thread and should
+be quick, like the local stores in this module.
+"""
+
+import copy
+import json
+import os
+import sqlite3
+
+from twisted.internet import task
+from twisted.python import log
+
+class FileCheckpointStore(object):
+    """
+    Checkpoint store in a JSON file.
+
+    The file holds the states of all names, and is replaced as a whole on
+    each save, by writing a temporary file and renaming it, so that a crash
+    never leaves a partially written file behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._states = None
+
+
+    def _read(self):
+        if self._states is None:
+            try:
+                f = open(self.path, 'rb')
+            except IOError:
+                self._states = {}
+            else:
+                try:
+                    self._states = json.load(f)
+                finally:
+                    f.close()
+        return self._states
+
+
+    def load(self, name):
+        return self._read().get(name)
+
+
+    def save(self, name, state):
+        states = self._read()
+        states[name] = state
+
+        temporary = self.path + '.tmp'
+        f = open(temporary, 'wb')
+        try:
+            json.dump(states, f)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        try:
+            os.rename(temporary, self.path)
+        except OSError:
+            # Windows does not replace existing files.
+            os.remove(self.path)
+            os.rename(temporary, self.path)
+
+
+
+class SQLiteCheckpointStore(object):
+    """
+    Checkpoint store in an SQLite database.
+
+    Each name is a row, so that saving one state does not rewrite the
+    others.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS checkpoints ("
+                                 "name TEXT PRIMARY KEY, state TEXT)")
+        self._connection.commit()
+
+
+    def load(self, name):
+        row = self._connection.execute(
+            "SELECT state FROM checkpoints WHERE name = ?",
+            (name,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+
+    def save(self, name, state):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO checkpoints (name, state) VALUES (?, ?)",
+            (name, json.dumps(state)))
+        self._connection.commit()
+
+
+    def close(self):
+        self._connection.close()
+
+
+
+class Checkpointer(object):
+    """
+    Periodic saving of a state to a checkpoint store.
+
+    The state is only saved if it changed since it was last saved or
+    loaded.
+
+    @ivar store: The checkpoint store.
+
+    @ivar name: The name the state is saved under.
+
+    @ivar getState: Callable that returns the current state.
+
+    @ivar interval: Seconds between checks for a changed state.
+    @type interval: C{float}
+    """
+
+    def __init__(self, store, name, getState, interval=10, reactor=None):
+        self.store = store
+        self.name = name
+        self.getState = getState
+        self.interval = interval
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._saved = None
+        self._call = None
+
+
+    def load(self):
+        """
+        Return the saved state, or C{None}.
+        """
+        state = self.store.load(self.name)
+        self._saved = state
+        return state
+
+
+    def save(self):
+        """
+        Save the current state, if it changed.
+        """
+        state = self.getState()
+        if state != self._saved:
+            self.store.save(self.name, state)
+            # The state may share mutable values with its owner.
+            self._saved = copy.deepcopy(state)
+
+
+    def _periodicSave(self):
+        try:
+            self.save()
+        except:
+            log.err(None, "Saving checkpoint %r failed" % (self.name,))
+
+
+    def start(self):
+        """
+        Start saving the state every L{interval} seconds.
+        """
+        self._call = task.LoopingCall(self._periodicSave)
+        self._call.clock = self.reactor
+        self._call.start(self.interval, now=False)
+
+
+    def stop(self):
+        """
+        Stop the periodic saves, and save the final state.
+        """
+        if self._call is not None and self._call.running:
+            self._call.stop()
+        self._call = None
+        self.save()
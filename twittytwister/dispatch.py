@@ -0,0 +1,478 @@
+# -*- test-case-name: twittytwister.test.test_dispatch -*-
+#
+# See LICENSE.txt for details
+
+"""
+Dispatching of Twitter entries to worker threads.
+"""
+
+import threading
+import time
+import Queue
+from collections import deque
+
+from twisted.application import service
+from twisted.internet import defer
+from twisted.python import log, threadpool
+
+_STOP = object()
+
+def userKey(entry):
+    """
+    Default shard key: the id of the user that posted the entry.
+    """
+    user = getattr(entry, 'user', None)
+    return getattr(user, 'id', None)
+
+
+
+class ShardStats(object):
+    """
+    Statistics for a single shard of a L{ShardedDispatcher}.
+
+    Latencies are measured from the moment an entry was dispatched until
+    the delegate returned, and are smoothed with an exponentially weighted
+    moving average. The queue latency is the part of that before the
+    delegate was called.
+
+    @ivar dispatched: Number of entries queued for this shard.
+    @ivar processed: Number of entries passed to the delegate.
+    @ivar dropped: Number of entries dropped because the queue was full.
+    @ivar errors: Number of entries for which the delegate raised.
+    @ivar maxQueueDepth: Highest observed queue depth.
+    @ivar latency: Average latency, in seconds.
+    @ivar maxLatency: Highest observed latency, in seconds.
+    @ivar serviceTime: Average time spent in the delegate, in seconds.
+    @ivar queueLatency: Average time spent queued, in seconds.
+    @ivar maxQueueLatency: Highest observed time spent queued, in seconds.
+    """
+
+    alpha = 0.1
+
+    def __init__(self, index):
+        self.index = index
+        self.dispatched = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.maxQueueDepth = 0
+        self.latency = 0.0
+        self.maxLatency = 0.0
+        self.serviceTime = 0.0
+        self.queueLatency = 0.0
+        self.maxQueueLatency = 0.0
+
+
+    def record(self, latency, serviceTime):
+        """
+        Record the timings of one processed entry.
+        """
+        queueLatency = latency - serviceTime
+        if self.processed:
+            self.latency += self.alpha * (latency - self.latency)
+            self.serviceTime += self.alpha * (serviceTime - self.serviceTime)
+            self.queueLatency += self.alpha * (queueLatency -
+                                               self.queueLatency)
+        else:
+            self.latency = latency
+            self.serviceTime = serviceTime
+            self.queueLatency = queueLatency
+        self.maxLatency = max(self.maxLatency, latency)
+        self.maxQueueLatency = max(self.maxQueueLatency, queueLatency)
+        self.processed += 1
+
+
+
+class _Shard(object):
+    """
+    A queue with a single worker thread consuming it in order.
+    """
+
+    def __init__(self, index):
+        self.queue = Queue.Queue()
+        self.stats = ShardStats(index)
+        self.thread = None
+        self.stopped = None
+
+
+
+class ShardedDispatcher(service.Service):
+    """
+    Delegate that spreads entries across worker threads by key.
+
+    Entries with the same key, as returned by C{keyFunction}, always end
+    up in the same shard, and each shard has a single worker thread, so
+    that entries with the same key are processed in the order they were
+    received. An instance can be passed as the delegate to
+    L{twittytwister.twitter.TwitterMonitor} or
+    L{twittytwister.twitter.TwitterFeed} methods. It is a service, so that
+    it can be attached to the same parent as the monitor: the worker
+    threads are started in L{startService} and drained in L{stopService}.
+
+    Queues are bounded by L{maxQueueSize}. When a shard's queue is full,
+    new entries for that shard are dropped and counted, so that a slow
+    delegate never blocks the reactor thread.
+
+    Note that the delegate is called from the worker threads, and not from
+    the reactor thread.
+
+    @ivar delegate: The consumer of entries, called in a worker thread.
+
+    @ivar keyFunction: Callable that returns the shard key for an entry.
+        Defaults to L{userKey}.
+
+    @ivar maxQueueSize: Maximum number of pending entries per shard.
+    @type maxQueueSize: C{int}
+    """
+
+    def __init__(self, delegate, shards=4, keyFunction=userKey,
+                       maxQueueSize=1000, reactor=None):
+        self.delegate = delegate
+        self.keyFunction = keyFunction
+        self.maxQueueSize = maxQueueSize
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._shards = [_Shard(index) for index in xrange(shards)]
+
+
+    def startService(self):
+        """
+        Start a worker thread for each shard.
+        """
+        service.Service.startService(self)
+        for shard in self._shards:
+            shard.stopped = defer.Deferred()
+            shard.thread = threading.Thread(target=self._work, args=(shard,),
+                                            name='ShardedDispatcher-%d' %
+                                                 shard.stats.index)
+            shard.thread.setDaemon(True)
+            shard.thread.start()
+
+
+    def stopService(self):
+        """
+        Stop the worker threads after the queued entries were processed.
+
+        @return: Deferred that fires when all worker threads are done.
+        """
+        service.Service.stopService(self)
+        deferreds = []
+        for shard in self._shards:
+            if shard.thread is None:
+                continue
+            shard.queue.put(_STOP)
+            deferreds.append(shard.stopped)
+        return defer.gatherResults(deferreds)
+
+
+    def shardFor(self, entry):
+        """
+        Return the index of the shard an entry is dispatched to.
+        """
+        return hash(self.keyFunction(entry)) % len(self._shards)
+
+
+    def __call__(self, entry):
+        """
+        Queue an entry for its shard.
+
+        @return: C{True} if the entry was queued, C{False} if it was dropped.
+        """
+        shard = self._shards[self.shardFor(entry)]
+        stats = shard.stats
+        depth = shard.queue.qsize()
+        if depth >= self.maxQueueSize:
+            stats.dropped += 1
+            return False
+
+        shard.queue.put((time.time(), entry))
+        stats.dispatched += 1
+        stats.maxQueueDepth = max(stats.maxQueueDepth, depth + 1)
+        return True
+
+
+    def _work(self, shard):
+        """
+        Worker thread main loop.
+        """
+        queue = shard.queue
+        stats = shard.stats
+        while True:
+            item = queue.get()
+            if item is _STOP:
+                break
+
+            queued, entry = item
+            started = time.time()
+            try:
+                self.delegate(entry)
+            except:
+                stats.errors += 1
+                log.err(None, "Error in delegate of shard %d" % stats.index)
+            finished = time.time()
+            stats.record(finished - queued, finished - started)
+
+        shard.thread = None
+        self.reactor.callFromThread(shard.stopped.callback, None)
+
+
+    def stats(self):
+        """
+        Return a snapshot of the statistics of all shards.
+
+        @return: List of dictionaries, one per shard, with the attributes of
+            L{ShardStats} and the current C{'queueDepth'}.
+        """
+        result = []
+        for shard in self._shards:
+            snapshot = dict(vars(shard.stats))
+            snapshot['queueDepth'] = shard.queue.qsize()
+            result.append(snapshot)
+        return result
+
+
+    def slowestShard(self):
+        """
+        Return the statistics of the shard with the highest average latency.
+        """
+        return max(self.stats(), key=lambda s: (s['latency'], s['queueDepth']))
+
+
+
+class ThreadPoolDelegate(service.Service):
+    """
+    Delegate that runs a blocking delegate in a bounded pool of threads.
+
+    Entries are run in a L{ThreadPool<twisted.python.threadpool.ThreadPool>}
+    of at most L{threads} worker threads. In unordered mode,
+    any worker takes the next entry. In ordered mode, entries with the same
+    key, as returned by C{keyFunction}, are processed one at a time, in the
+    order they were received, while entries with other keys are processed
+    in parallel. Unlike with L{ShardedDispatcher}, a slow key does not hold
+    up the other keys that would hash to the same shard.
+
+    Streams can be registered as producers, see L{registerProducer}. When
+    the number of pending entries reaches L{highWater}, the producers are
+    paused, so that Twitter stops sending until it drops to L{lowWater}.
+    A L{twittytwister.twitter.TwitterMonitor} registers its streams with its
+    delegate, if it has C{registerProducer}. Entries beyond L{maxPending}
+    are dropped and counted.
+
+    All bookkeeping happens in the reactor thread, and only the delegate is
+    called from the worker threads. Like L{ShardedDispatcher}, this is a
+    service: entries received before L{startService} are queued until the
+    thread pool is started, and L{stopService} waits for the pending
+    entries to be processed. Entries received once the service is stopping
+    are dropped, and logged.
+
+    @ivar delegate: The consumer of entries, called in a worker thread.
+
+    @ivar ordered: Whether entries with the same key are processed in
+        order.
+    @type ordered: C{bool}
+
+    @ivar keyFunction: Callable that returns the key for an entry, in
+        ordered mode. Defaults to L{userKey}.
+
+    @ivar highWater: Number of pending entries at which the producers are
+        paused.
+    @type highWater: C{int}
+
+    @ivar lowWater: Number of pending entries at which the producers are
+        resumed.
+    @type lowWater: C{int}
+
+    @ivar maxPending: Maximum number of pending entries.
+    @type maxPending: C{int}
+
+    @ivar pending: Number of entries queued or being processed.
+
+    @ivar paused: Whether the producers are paused.
+
+    @ivar pauses: Number of times the producers were paused.
+    """
+
+    def __init__(self, delegate, threads=4, ordered=False, keyFunction=userKey,
+                       highWater=1000, lowWater=None, maxPending=10000,
+                       reactor=None):
+        self.delegate = delegate
+        self.threads = threads
+        self.ordered = ordered
+        self.keyFunction = keyFunction
+        self.highWater = highWater
+        if lowWater is None:
+            lowWater = highWater // 2
+        self.lowWater = lowWater
+        self.maxPending = maxPending
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+
+        self.pending = 0
+        self.paused = False
+        self.pauses = 0
+        self._stats = ShardStats(0)
+        self._pool = threadpool.ThreadPool(0, threads, 'ThreadPoolDelegate')
+        self._waiting = {}
+        self._producers = set()
+        self._draining = None
+
+
+    def startService(self):
+        """
+        Start the thread pool.
+        """
+        service.Service.startService(self)
+        if self._pool.joined:
+            # A stopped thread pool cannot be restarted.
+            self._pool = threadpool.ThreadPool(0, self.threads,
+                                               'ThreadPoolDelegate')
+        self._pool.start()
+
+
+    def stopService(self):
+        """
+        Stop the thread pool after the pending entries were processed.
+
+        Entries queued before the service was started are processed too,
+        so the thread pool is started to drain them. While the pending
+        entries are drained, stopping again returns the same Deferred.
+
+        @return: Deferred that fires when the thread pool is stopped.
+        """
+        if self._draining is not None:
+            return self._draining
+        service.Service.stopService(self)
+        d = self._draining = defer.Deferred()
+        if not self.pending:
+            self._shutDown()
+        elif not self._pool.started:
+            self._pool.start()
+        return d
+
+
+    def _shutDown(self):
+        # All workers are idle, so joining them does not block for long.
+        self._pool.stop()
+        draining, self._draining = self._draining, None
+        draining.callback(None)
+
+
+    def registerProducer(self, producer):
+        """
+        Register a producer of entries, to be paused when too many entries
+        are pending.
+
+        @param producer: Provider of C{pauseProducing} and
+            C{resumeProducing}, like L{twittytwister.streaming.TwitterStream}.
+        """
+        self._producers.add(producer)
+        if self.paused:
+            producer.pauseProducing()
+
+
+    def unregisterProducer(self, producer):
+        self._producers.discard(producer)
+
+
+    def __call__(self, entry):
+        """
+        Queue an entry.
+
+        @return: C{True} if the entry was queued, C{False} if it was dropped.
+        """
+        stats = self._stats
+        if self._draining is not None or self._pool.joined:
+            stats.dropped += 1
+            log.msg("ThreadPoolDelegate is stopped, dropping entry")
+            return False
+        if self.pending >= self.maxPending:
+            stats.dropped += 1
+            return False
+
+        self.pending += 1
+        stats.dispatched += 1
+        stats.maxQueueDepth = max(stats.maxQueueDepth, self.pending)
+
+        item = (time.time(), entry)
+        if not self.ordered:
+            self._submit(None, item)
+        else:
+            key = self.keyFunction(entry)
+            if key in self._waiting:
+                self._waiting[key].append(item)
+            else:
+                self._waiting[key] = deque()
+                self._submit(key, item)
+
+        if self.pending >= self.highWater and not self.paused:
+            self.paused = True
+            self.pauses += 1
+            for producer in list(self._producers):
+                producer.pauseProducing()
+        return True
+
+
+    def _submit(self, key, item):
+        queued, entry = item
+        self._pool.callInThread(self._work, key, queued, entry)
+
+
+    def _work(self, key, queued, entry):
+        """
+        Process an entry, in a worker thread.
+        """
+        started = time.time()
+        failed = False
+        try:
+            self.delegate(entry)
+        except:
+            failed = True
+            log.err(None, "Error in delegate")
+        finished = time.time()
+        self.reactor.callFromThread(self._done, key, queued, started,
+                                    finished, failed)
+
+
+    def _done(self, key, queued, started, finished, failed):
+        """
+        Called in the reactor thread when an entry was processed.
+        """
+        self.pending -= 1
+        if failed:
+            self._stats.errors += 1
+        self._stats.record(finished - queued, finished - started)
+
+        if self.ordered:
+            waiting = self._waiting[key]
+            if waiting:
+                self._submit(key, waiting.popleft())
+            else:
+                del self._waiting[key]
+
+        if self.paused and self.pending <= self.lowWater:
+            self.paused = False
+            for producer in list(self._producers):
+                producer.resumeProducing()
+
+        if self._draining is not None and not self.pending:
+            self._shutDown()
+
+
+    def stats(self):
+        """
+        Return a snapshot of the statistics.
+
+        @return: Dictionary with the attributes of L{ShardStats}, the
+            current number of C{'pending'} entries, the number of
+            C{'waitingKeys'} in ordered mode, whether the producers are
+            C{'paused'}, and the number of C{'pauses'}.
+        """
+        snapshot = dict(vars(self._stats))
+        del snapshot['index']
+        snapshot.update({'pending': self.pending,
+                         'waitingKeys': len(self._waiting),
+                         'paused': self.paused,
+                         'pauses': self.pauses})
+        return snapshot
@@ -0,0 +1,285 @@
+# -*- test-case-name: twittytwister.test.test_graph -*-
+#
+# See LICENSE.txt for details
+
+"""
+Compact in-memory store of the social graph.
+
+The ids of the friends and followers of each account are kept as sorted
+arrays of 64-bit integers, which take 8 bytes per id instead of a Python
+string in a set. If NumPy is available, the arrays are NumPy arrays, set
+operations are vectorized and saved stores can be memory-mapped.
+"""
+
+import bisect
+import json
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from twisted.internet import defer
+
+for TYPECODE in ('q', 'l'):
+    try:
+        if array(TYPECODE).itemsize == 8:
+            break
+    except ValueError:
+        pass
+else:
+    raise ImportError("No 64-bit integer array type available")
+
+MAGIC = 'TTGRAPH1'
+
+KINDS = {'friends': 'friends_ids',
+         'followers': 'followers_ids'}
+
+def _fromIterable(ids):
+    """
+    Create a sorted array of unique ids.
+    """
+    if numpy is not None:
+        return numpy.unique(numpy.fromiter(ids, dtype=numpy.int64))
+    return array(TYPECODE, sorted(set(ids)))
+
+
+def intersection(a, b):
+    """
+    Return the ids that are in both sorted arrays.
+    """
+    if numpy is not None:
+        return numpy.intersect1d(a, b, assume_unique=True)
+    if len(a) > len(b):
+        a, b = b, a
+    return array(TYPECODE, sorted(set(a).intersection(b)))
+
+
+def difference(a, b):
+    """
+    Return the ids that are in sorted array C{a} but not in C{b}.
+    """
+    if numpy is not None:
+        return numpy.setdiff1d(a, b, assume_unique=True)
+    return array(TYPECODE, sorted(set(a).difference(b)))
+
+
+
+class IdCollector(object):
+    """
+    Delegate that collects ids, as strings or integers, into an array.
+    """
+
+    def __init__(self):
+        self.ids = array(TYPECODE)
+
+
+    def __call__(self, id):
+        self.ids.append(int(id))
+
+
+    def finish(self):
+        """
+        Return the collected ids as a sorted array without duplicates.
+        """
+        if numpy is not None and self.ids:
+            return numpy.unique(numpy.frombuffer(self.ids, dtype=numpy.int64))
+        return _fromIterable(self.ids)
+
+
+
+class GraphStore(object):
+    """
+    Friends and followers of accounts, as sorted arrays of ids.
+
+    The relation kinds are C{'friends'} and C{'followers'}. Each stored
+    relation also records the time of its crawl.
+    """
+
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._edges = {}
+        self._crawled = {}
+
+
+    def __len__(self):
+        return len(self._edges)
+
+
+    def get(self, kind, account):
+        """
+        Return the sorted ids for a relation, or C{None} if not crawled.
+        """
+        return self._edges.get((kind, account))
+
+
+    def update(self, kind, account, ids):
+        """
+        Replace the ids for a relation.
+
+        @param ids: The ids, as an iterable of integers, or as the sorted
+            result of L{IdCollector.finish}.
+        @return: A tuple of the sorted ids added and removed since the
+            previous crawl.
+        """
+        if not (numpy is not None and isinstance(ids, numpy.ndarray) or
+                isinstance(ids, array)):
+            ids = _fromIterable(ids)
+
+        key = (kind, account)
+        previous = self._edges.get(key)
+        if previous is None:
+            previous = _fromIterable(())
+        self._edges[key] = ids
+        self._crawled[key] = self.reactor.seconds()
+        return difference(ids, previous), difference(previous, ids)
+
+
+    def crawl(self, twitter, kind, account, **kwargs):
+        """
+        Fetch a relation of an account and store it.
+
+        All pages are fetched with L{twittytwister.twitter.Twitter.walk_cursor}.
+        The stored relation is only replaced if the crawl completes.
+
+        @param twitter: The REST client.
+        @type twitter: L{twittytwister.twitter.Twitter}
+        @param kwargs: Passed to C{walk_cursor}, like C{maxPages}.
+        @return: Deferred that fires with the result of L{update}.
+        """
+        method = getattr(twitter, KINDS[kind])
+        collector = IdCollector()
+        d = twitter.walk_cursor(method, collector, args=(account,), **kwargs)
+        d.addCallback(lambda _: self.update(kind, account, collector.finish()))
+        return d
+
+
+    def contains(self, kind, account, id):
+        """
+        Return whether C{id} is in a relation of C{account}.
+        """
+        ids = self._edges.get((kind, account))
+        if ids is None or not len(ids):
+            return False
+        if numpy is not None and isinstance(ids, numpy.ndarray):
+            i = numpy.searchsorted(ids, id)
+        else:
+            i = bisect.bisect_left(ids, id)
+        return i < len(ids) and ids[i] == id
+
+
+    def mutuals(self, account):
+        """
+        Return the ids that both follow and are followed by C{account}.
+        """
+        return self.common('friends', account, 'followers', account)
+
+
+    def common(self, kind, account, otherKind, otherAccount):
+        """
+        Return the ids in both of two relations.
+        """
+        return intersection(self._edges.get((kind, account), ()),
+                            self._edges.get((otherKind, otherAccount), ()))
+
+
+    def age(self, kind, account):
+        """
+        Return the time since a relation was crawled, or C{None}.
+        """
+        crawled = self._crawled.get((kind, account))
+        if crawled is None:
+            return None
+        return self.reactor.seconds() - crawled
+
+
+    def stale(self, maxAge):
+        """
+        Return the relations crawled more than C{maxAge} seconds ago.
+
+        @return: List of C{(kind, account)} tuples, oldest first.
+        """
+        now = self.reactor.seconds()
+        return [key for crawled, key
+                in sorted([(crawled, key) for key, crawled
+                           in self._crawled.iteritems()])
+                if now - crawled > maxAge]
+
+
+    def save(self, path):
+        """
+        Save the store to a file.
+
+        The file starts with a JSON index, followed by the ids of all
+        relations as little-endian 64-bit integers.
+        """
+        index = []
+        offset = 0
+        for key in sorted(self._edges):
+            kind, account = key
+            count = len(self._edges[key])
+            index.append([kind, account, offset, count, self._crawled[key]])
+            offset += count
+        header = json.dumps(index)
+        padding = -(len(MAGIC) + 8 + len(header)) % 8
+
+        f = open(path, 'wb')
+        try:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header) + padding))
+            f.write(header + ' ' * padding)
+            for key in sorted(self._edges):
+                ids = self._edges[key]
+                if numpy is not None:
+                    f.write(numpy.asarray(ids, dtype='<i8').tostring())
+                else:
+                    ids = array(TYPECODE, ids)
+                    if sys.byteorder == 'big':
+                        ids.byteswap()
+                    ids.tofile(f)
+        finally:
+            f.close()
+
+
+    @classmethod
+    def load(klass, path, mmap=True, reactor=None):
+        """
+        Load a store saved with L{save}.
+
+        @param mmap: Memory-map the ids instead of reading them, if NumPy
+            is available. Memory-mapped relations are read-only, but can
+            be replaced.
+        """
+        store = klass(reactor)
+        f = open(path, 'rb')
+        try:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Not a graph store: %r" % (path,))
+            headerSize, = struct.unpack('<Q', f.read(8))
+            index = json.loads(f.read(headerSize))
+            dataOffset = len(MAGIC) + 8 + headerSize
+            total = sum([entry[3] for entry in index])
+
+            if numpy is not None and mmap and total:
+                data = numpy.memmap(path, dtype='<i8', mode='r',
+                                    offset=dataOffset, shape=(total,))
+            elif numpy is not None:
+                data = numpy.fromfile(f, dtype='<i8', count=total)
+            else:
+                data = array(TYPECODE)
+                data.fromfile(f, total)
+                if sys.byteorder == 'big':
+                    data.byteswap()
+        finally:
+            f.close()
+
+        for kind, account, offset, count, crawled in index:
+            key = (kind, account)
+            store._edges[key] = data[offset:offset + count]
+            store._crawled[key] = crawled
+        return store
@@ -0,0 +1,143 @@
+# -*- test-case-name: twittytwister.test.test_metrics -*-
+#
+# See LICENSE.txt for details
+
+"""
+Instrumentation of the connection state of stream monitors.
+"""
+
+# Upper bounds of the histogram buckets, in seconds.
+SECONDS_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+class Histogram(object):
+    """
+    Histogram of observed values in fixed buckets.
+
+    @ivar bounds: Upper bounds of the buckets, in increasing order. A last
+        bucket holds the values above the highest bound.
+
+    @ivar counts: Number of values per bucket.
+
+    @ivar count: Total number of values.
+
+    @ivar sum: Sum of all values.
+    """
+
+    def __init__(self, bounds=SECONDS_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+    def snapshot(self):
+        """
+        Return the histogram as a dictionary.
+
+        @return: Dictionary with the C{'count'} and C{'sum'} of the values,
+            and the C{'buckets'} as a list of C{(bound, count)} tuples with
+            cumulative counts, the last one with bound C{float('inf')}.
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+
+class MonitorMetrics(object):
+    """
+    Reconnect metrics of a L{twittytwister.twitter.TwitterMonitor}.
+
+    The time to connect is measured from the moment the monitor leaves the
+    C{'connected'} state, or starts connecting from C{'idle'}, until it is
+    connected again. Stopping the monitor discards the measurement.
+
+    @ivar stateTimes: Seconds spent in each state, not counting the time in
+        the current state.
+    @type stateTimes: C{dict}
+
+    @ivar stateEntries: Number of transitions to each state.
+    @type stateEntries: C{dict}
+
+    @ivar errorStates: Number of reconnects per error state, with clean
+        disconnects under C{'clean'}.
+    @type errorStates: C{dict}
+
+    @ivar connectLatency: Times to connect, in seconds.
+    @type connectLatency: L{Histogram}
+
+    @ivar backOffDelays: Delays chosen before reconnecting, in seconds.
+    @type backOffDelays: L{Histogram}
+    """
+
+    def __init__(self, now):
+        self.stateTimes = {}
+        self.stateEntries = {}
+        self.errorStates = {}
+        self.connectLatency = Histogram()
+        self.backOffDelays = Histogram()
+        self._state = None
+        self._since = now
+        self._outageStarted = None
+
+
+    def stateChanged(self, state, now):
+        """
+        Record a transition to a new state.
+        """
+        if self._state is not None:
+            self.stateTimes[self._state] = (self.stateTimes.get(self._state, 0)
+                                            + now - self._since)
+        self.stateEntries[state] = self.stateEntries.get(state, 0) + 1
+        self._state = state
+        self._since = now
+
+        if state == 'connected':
+            if self._outageStarted is not None:
+                self.connectLatency.observe(now - self._outageStarted)
+                self._outageStarted = None
+        elif state in ('stopped', 'idle'):
+            self._outageStarted = None
+        elif self._outageStarted is None:
+            self._outageStarted = now
+
+
+    def reconnecting(self, errorState, delay):
+        """
+        Record a reconnect after an error or disconnect.
+        """
+        key = errorState or 'clean'
+        self.errorStates[key] = self.errorStates.get(key, 0) + 1
+        self.backOffDelays.observe(delay)
+
+
+    def snapshot(self, now):
+        """
+        Return the metrics as a dictionary, for metrics consumers.
+
+        The state times include the time in the current state so far.
+        """
+        stateTimes = dict(self.stateTimes)
+        if self._state is not None:
+            stateTimes[self._state] = (stateTimes.get(self._state, 0) +
+                                       now - self._since)
+        return {'state': self._state,
+                'stateTimes': stateTimes,
+                'stateEntries': dict(self.stateEntries),
+                'errorStates': dict(self.errorStates),
+                'connectLatency': self.connectLatency.snapshot(),
+                'backOffDelays': self.backOffDelays.snapshot()}
@@ -0,0 +1,158 @@
+# -*- test-case-name: twittytwister.test.test_multipart -*-
+#
+# See LICENSE.txt for details
+
+"""
+Streaming C{multipart/form-data} request bodies.
+"""
+
+import mimetools
+import mimetypes
+import os
+
+from zope.interface import implementer
+
+from twisted.internet import defer, task
+from twisted.web.iweb import IBodyProducer
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _fileLength(f):
+    """
+    Return the number of bytes left to read from a file object.
+    """
+    try:
+        return os.fstat(f.fileno()).st_size - f.tell()
+    except (AttributeError, EnvironmentError, ValueError):
+        position = f.tell()
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        f.seek(position)
+        return end - position
+
+
+def getContentType(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+
+@implementer(IBodyProducer)
+class MultipartProducer(object):
+    """
+    Body producer for a C{multipart/form-data} request.
+
+    File contents are read in chunks of L{readSize} bytes as the transport
+    asks for more data, so the body is never held in memory as a whole.
+    The length of the body is computed up front, from the sizes of the
+    files.
+
+    @ivar boundary: The boundary between the parts.
+    @type boundary: C{str}
+
+    @ivar contentType: The value of the C{Content-Type} request header.
+    @type contentType: C{str}
+    """
+
+    readSize = 2 ** 16
+
+    def __init__(self, fields=(), files=(), boundary=None, cooperator=task):
+        """
+        @param fields: Sequence of C{(name, value)} tuples for regular form
+            fields. C{unicode} values are encoded as UTF-8.
+        @param files: Sequence of C{(name, filename, value)} tuples for
+            files. The value is either a file object, with a C{read}
+            method, that is read from its current position and closed when
+            done, or the raw contents, encoded like the values of fields.
+        """
+        if boundary is None:
+            boundary = mimetools.choose_boundary()
+        self.boundary = boundary
+        self.contentType = 'multipart/form-data; boundary=%s' % boundary
+        self._cooperate = cooperator.cooperate
+        self._task = None
+
+        parts = []
+        for name, value in fields:
+            parts.append('--%s\r\n'
+                         'Content-Disposition: form-data; name="%s"\r\n'
+                         '\r\n' % (boundary, _utf8(name)))
+            parts.append(_utf8(value))
+            parts.append('\r\n')
+        for name, filename, value in files:
+            parts.append('--%s\r\n'
+                         'Content-Disposition: form-data; name="%s"; '
+                         'filename="%s"\r\n'
+                         'Content-Type: %s\r\n'
+                         '\r\n' % (boundary, _utf8(name), _utf8(filename),
+                                   getContentType(filename)))
+            if not hasattr(value, 'read'):
+                value = _utf8(value)
+            parts.append(value)
+            parts.append('\r\n')
+        parts.append('--%s--\r\n' % boundary)
+
+        # Merge adjacent strings into fewer writes.
+        self._parts = []
+        self.length = 0
+        for part in parts:
+            if isinstance(part, str):
+                self.length += len(part)
+                if self._parts and isinstance(self._parts[-1], str):
+                    self._parts[-1] += part
+                    continue
+            else:
+                self.length += _fileLength(part)
+            self._parts.append(part)
+
+
+    def _writeloop(self, consumer):
+        for part in self._parts:
+            if isinstance(part, str):
+                consumer.write(part)
+                yield None
+                continue
+
+            while True:
+                data = part.read(self.readSize)
+                if not data:
+                    part.close()
+                    break
+                consumer.write(data)
+                yield None
+
+
+    def startProducing(self, consumer):
+        self._task = self._cooperate(self._writeloop(consumer))
+        d = self._task.whenDone()
+        def maybeStopped(reason):
+            # Like FileBodyProducer, never fire once stopped.
+            reason.trap(task.TaskStopped)
+            return defer.Deferred()
+        d.addCallbacks(lambda ignored: None, maybeStopped)
+        return d
+
+
+    def pauseProducing(self):
+        self._task.pause()
+
+
+    def resumeProducing(self):
+        self._task.resume()
+
+
+    def stopProducing(self):
+        self.close()
+        self._task.stop()
+
+
+    def close(self):
+        """
+        Close all files of this body.
+        """
+        for part in self._parts:
+            if not isinstance(part, str):
+                part.close()
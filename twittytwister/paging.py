@@ -0,0 +1,160 @@
+# -*- test-case-name: twittytwister.test.test_paging -*-
+#
+# See LICENSE.txt for details
+
+"""
+Walking all pages of cursored REST resources.
+"""
+
+from collections import deque
+
+from twisted.internet import defer
+from twisted.python import failure
+
+_PAGE_END = object()
+
+class CursorWalker(object):
+    """
+    Fetch all pages of a cursored resource and deliver their items in order.
+
+    The next page is requested as soon as the cursor to it has been parsed,
+    while the items of earlier pages are still being delivered. If the
+    delegate returns a L{defer.Deferred}, delivery of the next item waits
+    for it, and pages are fetched ahead up to the prefetch depth.
+
+    Cursors are opaque and only known once the previous page has been
+    parsed, so at most one page is requested at a time.
+
+    @ivar prefetch: Number of pages that may be fetched ahead of the page
+        whose items are being delivered.
+    @type prefetch: C{int}
+
+    @ivar maxPages: Maximum number of pages to fetch, or C{None} to fetch
+        all of them.
+    @type maxPages: C{int}
+
+    @ivar pages: Number of pages fetched so far.
+    @type pages: C{int}
+
+    @ivar items: Number of items delivered so far.
+    @type items: C{int}
+    """
+
+    def __init__(self, fetchPage, delegate, prefetch=1, maxPages=None):
+        """
+        @param fetchPage: Callable that takes a cursor, an item callback and
+            a page callback, the latter taking the next and previous cursor,
+            and returns a Deferred that fires when the page is done.
+        @param delegate: Called with each item.
+        """
+        self.fetchPage = fetchPage
+        self.delegate = delegate
+        self.prefetch = prefetch
+        self.maxPages = maxPages
+        self.pages = 0
+        self.items = 0
+
+        self._queue = deque()
+        self._pagesAhead = 0
+        self._cursor = '-1'
+        self._fetching = False
+        self._delivering = False
+        self._finished = None
+
+
+    def start(self):
+        """
+        Start walking the pages.
+
+        @return: Deferred that fires with the number of items delivered,
+            once all pages are done.
+        """
+        self._finished = defer.Deferred()
+        self._maybeFetch()
+        return self._finished
+
+
+    def _maybeFetch(self):
+        if (self._fetching or self._finished.called or
+            self._cursor in (None, '0') or
+            (self.maxPages is not None and self.pages >= self.maxPages) or
+            self._pagesAhead > self.prefetch):
+            return
+
+        cursor, self._cursor = self._cursor, None
+        self._fetching = True
+        self._pagesAhead += 1
+        self.pages += 1
+
+        paged = []
+        def gotPage(next_cursor, previous_cursor):
+            paged.append(True)
+            self._cursor = next_cursor
+            self._queue.append(_PAGE_END)
+            self._fetching = False
+            self._maybeFetch()
+            self._deliver()
+
+        def done(result):
+            if not paged:
+                # The page did not carry cursors, so it is the only one.
+                self._queue.append(_PAGE_END)
+                self._fetching = False
+            self._deliver()
+
+        d = self.fetchPage(cursor, self._gotItem, gotPage)
+        d.addCallbacks(done, self._fail)
+
+
+    def _gotItem(self, item):
+        self._queue.append(item)
+        self._deliver()
+
+
+    def _deliver(self):
+        if self._delivering or self._finished.called:
+            return
+
+        self._delivering = True
+        while self._queue:
+            item = self._queue.popleft()
+            if item is _PAGE_END:
+                self._pagesAhead -= 1
+                self._maybeFetch()
+                continue
+
+            self.items += 1
+            try:
+                result = self.delegate(item)
+            except:
+                self._fail(failure.Failure())
+                return
+            if isinstance(result, defer.Deferred):
+                outcome = []
+                def record(result):
+                    outcome.append(result)
+                    return result
+                result.addBoth(record)
+                if not outcome:
+                    result.addCallbacks(self._resume, self._fail)
+                    return
+                if isinstance(outcome[0], failure.Failure):
+                    result.addErrback(lambda _: None)
+                    self._fail(outcome[0])
+                    return
+        self._delivering = False
+
+        if (not self._fetching and self._pagesAhead == 0 and
+            not self._finished.called):
+            self._finished.callback(self.items)
+
+
+    def _resume(self, _):
+        self._delivering = False
+        self._deliver()
+
+
+    def _fail(self, reason):
+        self._queue.clear()
+        if not self._finished.called:
+            self._finished.errback(reason)
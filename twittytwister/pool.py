@@ -0,0 +1,404 @@
+# -*- test-case-name: twittytwister.test.test_pool -*-
+#
+# See LICENSE.txt for details
+
+"""
+Filter streams spread over several connections.
+"""
+
+from collections import deque
+
+from twisted.application import service
+from twisted.python import log
+
+from twittytwister import checkpoint, twitter
+from twittytwister.backfill import statusId
+
+KINDS = ('track', 'follow')
+
+LIMITS = {'track': 400,
+          'follow': 5000}
+
+def _values(values):
+    """
+    Return a set of filter values, with user ids as strings.
+    """
+    return set([isinstance(value, (int, long)) and str(value) or value
+                for value in values])
+
+
+
+class Shard(object):
+    """
+    One connection of a L{MonitorPool}.
+
+    @ivar index: Number of the shard, unique within its pool.
+
+    @ivar api: The API endpoint of the shard, like the C{filter} method of
+        a L{twittytwister.twitter.TwitterFeed}.
+
+    @ivar monitor: The monitor that keeps the connection of this shard.
+    @type monitor: L{twittytwister.twitter.TwitterMonitor}
+
+    @ivar values: The values of each filter predicate handled by this
+        shard, as a dictionary of sets keyed by C{'track'} and C{'follow'}.
+
+    @ivar received: Number of entries received on this shard.
+
+    @ivar duplicates: Number of entries received on this shard that were
+        already delivered from another shard.
+
+    @ivar reconnects: Number of times the filter of this shard changed
+        while it was running.
+    """
+
+    def __init__(self, index, api):
+        self.index = index
+        self.api = api
+        self.monitor = None
+        self.values = dict([(kind, set()) for kind in KINDS])
+        self.received = 0
+        self.duplicates = 0
+        self.reconnects = 0
+
+
+    def count(self, kind):
+        return len(self.values[kind])
+
+
+    def isEmpty(self):
+        for values in self.values.itervalues():
+            if values:
+                return False
+        return True
+
+
+    def args(self):
+        """
+        Return the arguments to the API for the filter of this shard.
+        """
+        args = {}
+        for kind in KINDS:
+            if self.values[kind]:
+                args[kind] = ','.join(sorted(self.values[kind]))
+        return args
+
+
+
+class MonitorPool(service.MultiService):
+    """
+    Reconnecting filter stream for more terms or users than one connection
+    allows.
+
+    The C{track} terms and C{follow} user ids are partitioned over shards of
+    at most L{limits} values each. Every shard has its own
+    L{twittytwister.twitter.TwitterMonitor}, and thus its own connection,
+    using the next unused API endpoint. As the Streaming API allows a single
+    filter stream per account, pass the C{filter} method of a
+    L{twittytwister.twitter.TwitterFeed} for each account.
+
+    Values stay on their shard. Added values fill up the shards with the
+    most room first, and shards that have no values left are stopped, so
+    that a change only reconnects the shards that it affects. The monitors
+    hand over to the new connection, see
+    L{twittytwister.twitter.TwitterMonitor.handover}.
+
+    The entries of all shards are passed to a single delegate. An entry
+    that matches values on several shards is received more than once, so
+    entries with an id that was recently delivered are dropped.
+
+    @ivar delegate: The consumer of entries from all shards.
+
+    @ivar limits: Maximum number of values per shard, by predicate.
+    @type limits: C{dict}
+
+    @ivar dedupSize: Number of recent entry ids kept to drop duplicates.
+    @type dedupSize: C{int}
+
+    @ivar shards: The active shards.
+    @type shards: C{list} of L{Shard}
+
+    @ivar lastId: The highest status id passed to the delegate, as an
+        integer. The shards that start with the service backfill from it.
+
+    @ivar backfill: Optional backfill for the monitors of the shards, see
+        L{twittytwister.twitter.TwitterMonitor.backfill}.
+
+    @ivar checkpointStore: Optional store to save the state of the pool in,
+        see L{twittytwister.checkpoint}. The state holds the filter, the
+        recent ids and L{lastId}, under the name of the service, or
+        C{'pool'}. If no filter was set when the service starts, the saved
+        filter is used.
+
+    @ivar checkpointInterval: Seconds between checkpoints.
+    @type checkpointInterval: C{float}
+    """
+
+    dedupSize = 10000
+
+    lastId = None
+    backfill = None
+
+    checkpointStore = None
+    checkpointInterval = 10
+    _checkpointer = None
+
+    def __init__(self, apis, delegate, limits=None, reactor=None):
+        """
+        @param apis: The API endpoints, one for each possible shard.
+        @param delegate: Called with each entry.
+        @param limits: Overrides of L{LIMITS}.
+
+        @raises ValueError: If a limit is not a positive integer.
+        """
+        service.MultiService.__init__(self)
+        self.delegate = delegate
+        self.limits = dict(LIMITS)
+        if limits:
+            self.limits.update(limits)
+        for kind, limit in self.limits.iteritems():
+            if not isinstance(limit, (int, long)) or limit < 1:
+                raise ValueError("Limit for %s must be a positive integer, "
+                                 "not %r" % (kind, limit))
+        self.reactor = reactor
+        self.shards = []
+        self._freeApis = list(apis)
+        self._nextIndex = 0
+        self._owners = dict([(kind, {}) for kind in KINDS])
+        self._recent = deque()
+        self._recentIds = set()
+
+
+    def startService(self):
+        if self.checkpointStore is not None:
+            self._checkpointer = checkpoint.Checkpointer(
+                self.checkpointStore, self.name or 'pool',
+                self.checkpointState, self.checkpointInterval, self.reactor)
+            state = self._checkpointer.load()
+            if state is not None:
+                self.restoreCheckpoint(state)
+            self._checkpointer.start()
+        service.MultiService.startService(self)
+
+
+    def stopService(self):
+        d = service.MultiService.stopService(self)
+        if self._checkpointer is not None:
+            self._checkpointer.stop()
+            self._checkpointer = None
+        return d
+
+
+    def checkpointState(self):
+        """
+        Return the state to save in a checkpoint.
+        """
+        return {'track': sorted(self._owners['track']),
+                'follow': sorted(self._owners['follow']),
+                'lastId': self.lastId,
+                'recent': list(self._recent)}
+
+
+    def restoreCheckpoint(self, state):
+        """
+        Restore the state from a checkpoint.
+
+        The filter is only restored if none is set.
+        """
+        if self.lastId is None:
+            self.lastId = state.get('lastId')
+            for shard in self.shards:
+                shard.monitor.lastId = self.lastId
+        for id in state.get('recent', ()):
+            if id not in self._recentIds:
+                self._remember(id)
+        if not self.shards:
+            self.setFilters(state.get('track', ()), state.get('follow', ()))
+
+
+    def values(self, kind):
+        """
+        Return the values of a filter predicate over all shards.
+        """
+        return set(self._owners[kind])
+
+
+    def add(self, track=(), follow=()):
+        """
+        Add values to the filter.
+
+        @raises L{twitter.Error}: If there are not enough API endpoints left
+            for the new values. No values are added in that case.
+        """
+        self.setFilters(self.values('track') | _values(track),
+                        self.values('follow') | _values(follow))
+
+
+    def remove(self, track=(), follow=()):
+        """
+        Remove values from the filter.
+        """
+        self.setFilters(self.values('track') - _values(track),
+                        self.values('follow') - _values(follow))
+
+
+    def setFilters(self, track=(), follow=()):
+        """
+        Replace the filter, changing only the shards of the changed values.
+
+        Each affected shard reconnects once.
+
+        @raises L{twitter.Error}: If there are not enough API endpoints left
+            for the new values. Values are removed, but none are added in
+            that case.
+        """
+        wanted = {'track': _values(track), 'follow': _values(follow)}
+        dirty = set()
+        for kind in KINDS:
+            owners = self._owners[kind]
+            for value in set(owners) - wanted[kind]:
+                shard = owners.pop(value)
+                shard.values[kind].discard(value)
+                dirty.add(shard)
+
+        try:
+            self._reserve(wanted)
+            for kind in KINDS:
+                self._add(kind, wanted[kind], dirty)
+        finally:
+            self._reconnect(dirty)
+
+
+    def _reserve(self, wanted):
+        """
+        Check that there are enough API endpoints for new values.
+        """
+        needed = 0
+        for kind in KINDS:
+            values = wanted[kind].difference(self._owners[kind])
+            room = sum([self.limits[kind] - shard.count(kind)
+                        for shard in self.shards])
+            missing = len(values) - room
+            if missing > 0:
+                needed = max(needed, -(-missing // self.limits[kind]))
+        if needed > len(self._freeApis):
+            raise twitter.Error("Need %d more connections, %d available" %
+                                (needed, len(self._freeApis)))
+
+
+    def _add(self, kind, values, dirty):
+        owners = self._owners[kind]
+        limit = self.limits[kind]
+        values = sorted(values.difference(owners))
+        while values:
+            shards = [shard for shard in self.shards
+                      if shard.count(kind) < limit]
+            if shards:
+                shard = min(shards, key=lambda s: (s.count(kind), s.index))
+            else:
+                shard = self._addShard()
+            room = limit - shard.count(kind)
+            for value in values[:room]:
+                shard.values[kind].add(value)
+                owners[value] = shard
+            del values[:room]
+            dirty.add(shard)
+
+
+    def _addShard(self):
+        shard = Shard(self._nextIndex, self._freeApis.pop(0))
+        self._nextIndex += 1
+        self.shards.append(shard)
+        return shard
+
+
+    def _reconnect(self, dirty):
+        """
+        Apply the changed filters of shards.
+        """
+        for shard in sorted(dirty, key=lambda s: s.index):
+            if shard.isEmpty():
+                self._removeShard(shard)
+            elif shard.monitor is None:
+                self._startShard(shard)
+            else:
+                shard.monitor.args = shard.args()
+                if self.running:
+                    shard.reconnects += 1
+                    try:
+                        shard.monitor.connect(forceReconnect=True)
+                    except twitter.ConnectError:
+                        pass
+
+
+    def _startShard(self, shard):
+        def onEntry(entry):
+            self._onEntry(shard, entry)
+
+        monitor = twitter.TwitterMonitor(shard.api, onEntry, shard.args(),
+                                         reactor=self.reactor)
+        monitor.handover = True
+        monitor.backfill = self.backfill
+        if not self.running:
+            # Shards added later only get statuses from then on.
+            monitor.lastId = self.lastId
+        monitor.setName('shard-%d' % shard.index)
+        shard.monitor = monitor
+        monitor.setServiceParent(self)
+
+
+    def _removeShard(self, shard):
+        self.shards.remove(shard)
+        self._freeApis.append(shard.api)
+        if shard.monitor is not None:
+            shard.monitor.disownServiceParent()
+            shard.monitor = None
+
+
+    def _onEntry(self, shard, entry):
+        """
+        Pass an entry to the delegate, unless it was delivered before.
+        """
+        shard.received += 1
+        id = statusId(entry)
+        if id is not None:
+            if id in self._recentIds:
+                shard.duplicates += 1
+                return
+            self._remember(id)
+            if self.lastId is None or id > self.lastId:
+                self.lastId = id
+
+        try:
+            self.delegate(entry)
+        except:
+            log.err()
+
+
+    def _remember(self, id):
+        self._recentIds.add(id)
+        self._recent.append(id)
+        if len(self._recent) > self.dedupSize:
+            self._recentIds.discard(self._recent.popleft())
+
+
+    def stats(self):
+        """
+        Return a snapshot of the volume of all shards.
+
+        @return: List of dictionaries, one per shard, with the attributes
+            C{'index'}, C{'received'}, C{'duplicates'} and C{'reconnects'}
+            of L{Shard}, the number of values of each filter predicate and
+            the C{'state'} of its monitor.
+        """
+        result = []
+        for shard in self.shards:
+            snapshot = {'index': shard.index,
+                        'received': shard.received,
+                        'duplicates': shard.duplicates,
+                        'reconnects': shard.reconnects,
+                        'state': shard.monitor.state}
+            for kind in KINDS:
+                snapshot[kind] = shard.count(kind)
+            result.append(snapshot)
+        return result
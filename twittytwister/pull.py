@@ -0,0 +1,145 @@
+# -*- test-case-name: twittytwister.test.test_pull -*-
+#
+# See LICENSE.txt for details
+
+"""
+Pull interface to streams, with bounded buffering.
+"""
+
+from twisted.internet import defer
+
+_END = object()
+
+class StatusQueue(object):
+    """
+    Buffer of entries from streams, for consumers that pull at their own
+    pace.
+
+    A queue is a delegate for L{twittytwister.twitter.TwitterFeed} methods or
+    a L{twittytwister.twitter.TwitterMonitor}. Entries are taken with
+    L{get}, one at a time, until it fires with C{None}::
+
+        queue = yield feed.pull(feed.track, ['twisted'])
+        while True:
+            entry = yield queue.get()
+            if entry is None:
+                break
+            print entry.text
+
+    Streams are registered as producers, see L{registerProducer}. When
+    L{size} entries are buffered, the producers are paused, so that Twitter
+    stops sending until the consumer has taken the buffer down to
+    L{lowWater}. Entries already read when the streams are paused are still
+    buffered, so the buffer can briefly exceed L{size}.
+
+    @ivar size: Number of buffered entries at which the producers are
+        paused.
+    @type size: C{int}
+
+    @ivar lowWater: Number of buffered entries at which the producers are
+        resumed.
+    @type lowWater: C{int}
+
+    @ivar paused: Whether the producers are paused.
+
+    @ivar pauses: Number of times the producers were paused.
+
+    @ivar closed: Whether the queue was closed, see L{close}.
+    """
+
+    def __init__(self, size=1000, lowWater=None):
+        self.size = size
+        if lowWater is None:
+            lowWater = size // 2
+        self.lowWater = lowWater
+        self.paused = False
+        self.pauses = 0
+        self.closed = False
+        self._reason = None
+        self._queue = defer.DeferredQueue()
+        self._producers = set()
+
+
+    def __len__(self):
+        """
+        Return the number of buffered entries.
+        """
+        return len([entry for entry in self._queue.pending
+                          if entry is not _END])
+
+
+    def registerProducer(self, producer):
+        """
+        Register a producer of entries, to be paused when the buffer is full.
+
+        @param producer: Provider of C{pauseProducing} and
+            C{resumeProducing}, like L{twittytwister.streaming.TwitterStream}.
+        """
+        if self.closed:
+            return
+        self._producers.add(producer)
+        if self.paused:
+            producer.pauseProducing()
+
+
+    def unregisterProducer(self, producer):
+        self._producers.discard(producer)
+
+
+    def __call__(self, entry):
+        """
+        Buffer an entry. Entries received after L{close} are ignored.
+        """
+        if self.closed:
+            return
+        self._queue.put(entry)
+        if not self.paused and len(self._queue.pending) >= self.size:
+            self.paused = True
+            self.pauses += 1
+            for producer in list(self._producers):
+                producer.pauseProducing()
+
+
+    def close(self, reason=None):
+        """
+        End the queue.
+
+        Consumers get the buffered entries first. After that, L{get}
+        fires with C{None}, or fails with C{reason}.
+
+        @param reason: Why the queue ended, if not cleanly.
+        @type reason: L{failure.Failure<twisted.python.failure.Failure>}
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._reason = reason
+        self._producers.clear()
+        self._queue.put(_END)
+
+
+    def get(self):
+        """
+        Take the next entry.
+
+        @return: Deferred that fires with the next entry, once one is
+            available, or with C{None} once the queue is closed.
+        @rtype: L{defer.Deferred}
+        """
+        d = self._queue.get()
+        d.addCallback(self._got)
+        if self.paused and len(self._queue.pending) <= self.lowWater:
+            self.paused = False
+            for producer in list(self._producers):
+                producer.resumeProducing()
+        return d
+
+
+    def _got(self, entry):
+        if entry is not _END:
+            return entry
+
+        # Leave the end marker for the next consumer.
+        self._queue.put(_END)
+        return self._reason
+
@@ -0,0 +1,226 @@
+# -*- test-case-name: twittytwister.test.test_ratelimit -*-
+#
+# See LICENSE.txt for details
+
+"""
+Scheduling of REST requests within the rate limits announced by the server.
+"""
+
+import heapq
+
+from twisted.internet import defer
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+def parseRateLimitHeaders(headers):
+    """
+    Extract the rate limit from response headers.
+
+    Both the C{X-RateLimit-*} and the C{X-Rate-Limit-*} spellings are
+    recognized.
+
+    @param headers: Response headers, with lower case names mapping to a
+        list of values.
+    @return: A tuple of the limit, remaining calls and reset time, or
+        C{None} if the headers are missing or invalid.
+    """
+    values = []
+    for name in ('limit', 'remaining', 'reset'):
+        value = (headers.get('x-ratelimit-' + name) or
+                 headers.get('x-rate-limit-' + name))
+        if not value or not value[0]:
+            return None
+        try:
+            values.append(int(value[0]))
+        except ValueError:
+            return None
+    return tuple(values)
+
+
+
+class _Budget(object):
+    """
+    Rate limit budget and queue of waiting requests for one key.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.inFlight = 0
+        self.nextRelease = 0
+        self.queue = []
+        self.call = None
+
+
+
+class RateLimitScheduler(object):
+    """
+    Release requests within the rate limit of each endpoint family.
+
+    Budgets are kept per key, usually a tuple of the endpoint family and
+    the authenticated user, and are updated from the rate limit headers
+    of each response using L{update}. As long as the budget is unknown, or
+    its window has passed, requests are released immediately.
+
+    While more than C{lowWater} of the limit is left, requests are also
+    released immediately. Below that, requests are queued by priority and
+    released at even intervals over the rest of the window. When nothing
+    is left, the queue waits for the window to be reset.
+
+    @ivar lowWater: Fraction of the limit below which requests are paced.
+    @type lowWater: C{float}
+
+    @ivar maxWait: Upper bound on the time to wait for a reset, in seconds,
+        to guard against bogus reset times and clock skew.
+    @type maxWait: C{int}
+
+    @ivar delayed: Number of requests that had to wait.
+    @type delayed: C{int}
+    """
+
+    lowWater = 0.2
+    maxWait = 900
+
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._budgets = {}
+        self._counter = 0
+        self.delayed = 0
+
+
+    def _getBudget(self, key):
+        try:
+            return self._budgets[key]
+        except KeyError:
+            budget = self._budgets[key] = _Budget()
+            return budget
+
+
+    def schedule(self, key, priority, f, *args, **kwargs):
+        """
+        Call C{f} once the budget for C{key} allows.
+
+        @param priority: Priority of this request, lower values first. See
+            L{PRIORITY_HIGH}, L{PRIORITY_NORMAL} and L{PRIORITY_LOW}.
+
+        @return: Deferred that fires with the result of C{f}.
+        """
+        budget = self._getBudget(key)
+        d = defer.Deferred()
+        self._counter += 1
+        heapq.heappush(budget.queue,
+                       (priority, self._counter, d, f, args, kwargs))
+        self._release(budget)
+        for entry in budget.queue:
+            if entry[2] is d:
+                self.delayed += 1
+                break
+        return d
+
+
+    def update(self, key, limit, remaining, reset):
+        """
+        Update the budget for C{key} from a response.
+
+        @param reset: Time at which the window is reset, in seconds since
+            the epoch.
+        """
+        budget = self._getBudget(key)
+        budget.limit = limit
+        budget.remaining = remaining
+        budget.reset = reset
+        self._release(budget)
+
+
+    def _wait(self, budget, now):
+        """
+        Return the time to wait before the next request may be released.
+        """
+        if budget.remaining is None or now >= budget.reset:
+            return 0
+
+        if budget.reset - now > self.maxWait:
+            budget.reset = now + self.maxWait
+
+        available = budget.remaining - budget.inFlight
+        if available <= 0:
+            return budget.reset - now
+        if available > budget.limit * self.lowWater:
+            return 0
+
+        return max(budget.nextRelease - now, 0)
+
+
+    def _release(self, budget):
+        """
+        Release as many queued requests as the budget allows.
+
+        @return: The number of requests released.
+        """
+        released = 0
+        while budget.queue:
+            now = self.reactor.seconds()
+            wait = self._wait(budget, now)
+            if wait > 0:
+                if budget.call is None:
+                    budget.call = self.reactor.callLater(wait, self._wakeUp,
+                                                         budget)
+                elif budget.call.getTime() > now + wait:
+                    budget.call.reset(wait)
+                break
+
+            if budget.remaining is not None and now < budget.reset:
+                available = budget.remaining - budget.inFlight
+                budget.nextRelease = now + float(budget.reset - now) / available
+            elif budget.remaining is not None:
+                # The window has passed, the next response tells more.
+                budget.remaining = None
+
+            _, _, d, f, args, kwargs = heapq.heappop(budget.queue)
+            budget.inFlight += 1
+            released += 1
+            result = defer.maybeDeferred(f, *args, **kwargs)
+            result.addBoth(self._done, budget)
+            result.chainDeferred(d)
+        return released
+
+
+    def _wakeUp(self, budget):
+        budget.call = None
+        self._release(budget)
+
+
+    def _done(self, result, budget):
+        budget.inFlight -= 1
+        self._release(budget)
+        return result
+
+
+    def stop(self):
+        """
+        Cancel pending timers. Queued requests stay queued.
+        """
+        for budget in self._budgets.itervalues():
+            if budget.call is not None:
+                budget.call.cancel()
+                budget.call = None
+
+
+    def stats(self):
+        """
+        Return scheduler statistics.
+
+        @return: Dictionary with the number of C{'queued'} requests, the
+            number of C{'delayed'} requests so far and the C{'budgets'}, a
+            dictionary mapping each key to its C{(limit, remaining, reset)}.
+        """
+        return {'queued': sum([len(b.queue)
+                               for b in self._budgets.itervalues()]),
+                'delayed': self.delayed,
+                'budgets': dict([(key, (b.limit, b.remaining, b.reset))
+                                 for key, b in self._budgets.iteritems()])}
@@ -272,6 +272,16 @@ Status.COMPLEX_PROPS['user'] = User
 
 
 
+class DirectMessage(TwitterObject):
+    """
+    Twitter Direct Message.
+    """
+    SIMPLE_PROPS = set(['id', 'sender_id', 'text', 'recipient_id',
+        'created_at', 'sender_screen_name', 'recipient_screen_name'])
+    COMPLEX_PROPS = {'sender': User, 'recipient': User}
+
+
+
 class TwitterStream(LengthDelimitedStream, TimeoutMixin):
     """
     Twitter Stream.
@@ -283,8 +293,31 @@ class TwitterStream(LengthDelimitedStream, TimeoutMixin):
     sending data, including the keep-alives that usually result in traffic
     at least every 30 seconds. If not passed using C{timeoutPeriod}, the
     timeout period is set to 60 seconds.
+
+    For L{twittytwister.watchdog.StreamWatchdog}, the protocol counts what it
+    receives.
+
+    @ivar datagrams: Number of datagrams received.
+    @type datagrams: C{int}
+
+    @ivar keepAlives: Number of keep-alives received.
+    @type keepAlives: C{int}
+
+    @ivar lastCreatedAt: The C{created_at} of the last status received.
+    @type lastCreatedAt: C{unicode}
+
+    @ivar paused: Whether reading from the stream was paused with
+        L{pauseProducing}.
+    @type paused: C{bool}
     """
 
+    datagrams = 0
+    keepAlives = 0
+    lastCreatedAt = None
+
+    paused = False
+    _pausedTimeout = None
+
     def __init__(self, callback, timeoutPeriod=60):
         LengthDelimitedStream.__init__(self)
         self.setTimeout(timeoutPeriod)
@@ -307,6 +340,7 @@ class TwitterStream(LengthDelimitedStream, TimeoutMixin):
         """
         Decode the JSON-encoded datagram and call the callback.
         """
+        self.datagrams += 1
         try:
             obj = json.loads(data)
         except ValueError, e:
@@ -315,6 +349,7 @@ class TwitterStream(LengthDelimitedStream, TimeoutMixin):
 
         if u'text' in obj:
             obj = Status.fromDict(obj)
+            self.lastCreatedAt = getattr(obj, 'created_at', None)
         else:
             log.msg('Unsupported object %r' % obj)
             return
@@ -322,6 +357,36 @@ class TwitterStream(LengthDelimitedStream, TimeoutMixin):
         self.callback(obj)
 
 
+    def keepAliveReceived(self):
+        self.keepAlives += 1
+
+
+    def pauseProducing(self):
+        """
+        Stop reading from the stream, for a consumer that falls behind.
+
+        The timeout is suspended while paused, as Twitter cannot send any
+        data, including keep-alives.
+        """
+        if self.paused:
+            return
+        self.paused = True
+        self._pausedTimeout = self.timeOut
+        self.setTimeout(None)
+        self.transport.pauseProducing()
+
+
+    def resumeProducing(self):
+        """
+        Resume reading from the stream.
+        """
+        if not self.paused:
+            return
+        self.paused = False
+        self.transport.resumeProducing()
+        self.setTimeout(self._pausedTimeout)
+
+
     def connectionLost(self, reason):
         """
         Called when the body is complete or the connection was lost.
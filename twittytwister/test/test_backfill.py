@@ -0,0 +1,222 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.backfill}.
+"""
+
+import urlparse
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from twittytwister import backfill, streaming, tjson, twitter, txml
+from twittytwister.test.test_twitter import FakeAgent
+
+def makeStatus(id):
+    return streaming.Status.fromDict({'id': id, 'text': u'Hello'})
+
+
+
+class FakeTwitter(object):
+    """
+    REST client that answers from canned statuses.
+
+    @ivar timelines: Statuses by user id, newest first.
+    @ivar results: Search results by query, newest first.
+    """
+
+    parsers = tjson
+
+    def __init__(self, timelines=None, results=None):
+        self.timelines = timelines or {}
+        self.results = results or {}
+        self.calls = []
+        self.pending = []
+
+
+    def user_timeline(self, delegate, user=None, params={}, extra_args=None):
+        self.calls.append(('user_timeline', dict(params)))
+        statuses = [status for status in self.timelines[params['user_id']]
+                    if status.id > int(params['since_id']) and
+                       status.id <= int(params.get('max_id', status.id))]
+        for status in statuses[:int(params['count'])]:
+            delegate(status)
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+
+    def search(self, query, delegate, args=None, extra_args=None):
+        self.calls.append(('search', query, dict(args)))
+        if query not in self.results:
+            return defer.fail(ValueError(query))
+        page, rpp = int(args['page']), int(args['rpp'])
+        start = (page - 1) * rpp
+        for entry in self.results[query][start:start + rpp]:
+            delegate(entry)
+        return defer.succeed(None)
+
+
+    def finish(self):
+        while self.pending:
+            self.pending.pop(0).callback(None)
+
+
+
+class StatusIdTest(unittest.TestCase):
+    """
+    Tests for L{backfill.statusId}.
+    """
+
+    def test_integer(self):
+        self.assertEqual(12, backfill.statusId(makeStatus(12)))
+
+
+    def test_string(self):
+        status = txml.Status('status')
+        status.id = '12'
+        self.assertEqual(12, backfill.statusId(status))
+
+
+    def test_searchEntry(self):
+        entry = txml.Entry('entry')
+        entry.id = 'tag:search.twitter.com,2005:12'
+        self.assertEqual(12, backfill.statusId(entry))
+
+
+    def test_unknown(self):
+        entry = txml.Entry('entry')
+        entry.id = 'tag:search.twitter.com,2005:search/xmpp'
+        self.assertIdentical(None, backfill.statusId(entry))
+        self.assertIdentical(None, backfill.statusId(object()))
+
+
+
+class MergeEntriesTest(unittest.TestCase):
+    """
+    Tests for L{backfill.mergeEntries}.
+    """
+
+    def test_merge(self):
+        """
+        Entries are merged in id order, with entries without id last.
+        """
+        other = object()
+        first, second, third = makeStatus(1), makeStatus(2), makeStatus(3)
+        merged = backfill.mergeEntries([third, first], [other, makeStatus(1),
+                                                        second])
+        self.assertEqual([first, second, third, other], merged)
+
+
+
+class BackfillTest(unittest.TestCase):
+    """
+    Tests for L{backfill.Backfill}.
+    """
+
+    def test_follow(self):
+        """
+        The timelines of followed users are fetched concurrently, paged
+        back to the requested id.
+        """
+        twitter = FakeTwitter({'1': [makeStatus(i) for i in (9, 7, 5, 3)],
+                               '2': [makeStatus(i) for i in (8, 2)]})
+        fetcher = backfill.Backfill(twitter)
+        fetcher.timelineCount = 2
+        fetcher.concurrency = 2
+        result = []
+        fetcher({'follow': '1,2'}, 4).addCallback(result.extend)
+
+        self.assertEqual([('user_timeline', {'user_id': '1', 'since_id': '4',
+                                             'count': '2'}),
+                          ('user_timeline', {'user_id': '2', 'since_id': '4',
+                                             'count': '2'})],
+                         twitter.calls)
+        twitter.finish()
+        self.assertEqual(('user_timeline', {'user_id': '1', 'since_id': '4',
+                                            'count': '2', 'max_id': '6'}),
+                         twitter.calls[-1])
+        twitter.finish()
+        self.assertEqual([5, 7, 8, 9], [status.id for status in result])
+
+
+    def test_concurrency(self):
+        """
+        No more than L{backfill.Backfill.concurrency} requests are in
+        flight.
+        """
+        twitter = FakeTwitter(dict([(str(i), []) for i in xrange(5)]))
+        fetcher = backfill.Backfill(twitter)
+        fetcher.concurrency = 2
+        fetcher({'follow': '0,1,2,3,4'}, 1)
+        self.assertEqual(2, len(twitter.calls))
+
+
+    def test_track(self):
+        """
+        Tracked terms are combined into search queries, and failed queries
+        are skipped.
+        """
+        status = makeStatus(12)
+        twitter = FakeTwitter(results={'a OR b': [status]})
+        fetcher = backfill.Backfill(twitter)
+        fetcher.termsPerQuery = 2
+        result = []
+        fetcher({'track': 'a,b,c'}, 4).addCallback(result.extend)
+
+        self.assertEqual([status], result)
+        self.assertEqual([('search', 'a OR b',
+                           {'since_id': '4', 'rpp': '100', 'page': '1'}),
+                          ('search', 'c',
+                           {'since_id': '4', 'rpp': '100', 'page': '1'})],
+                         twitter.calls)
+        self.assertEqual(1, len(self.flushLoggedErrors(ValueError)))
+
+
+    def test_trackXML(self):
+        """
+        Tracked terms are not searched for with a client in XML mode, as the
+        results would not be statuses.
+        """
+        twitter = FakeTwitter({'1': [makeStatus(5)]})
+        twitter.parsers = txml
+        fetcher = backfill.Backfill(twitter)
+        result = []
+        fetcher({'follow': '1', 'track': 'a'}, 4).addCallback(result.extend)
+        twitter.finish()
+
+        self.assertEqual([5], [status.id for status in result])
+        self.assertEqual(['user_timeline'],
+                         [call[0] for call in twitter.calls])
+
+
+    def test_requests(self):
+        """
+        The requests of a real client carry the arguments as strings.
+        """
+        agent = FakeAgent()
+        client = twitter.Twitter(base_url='http://api.example.org/1',
+                                 search_url='http://search.example.org/s.atom',
+                                 restFormat='json')
+        client.restAgent = agent
+        fetcher = backfill.Backfill(client)
+        fetcher.maxPages = 1
+        result = []
+        fetcher({'follow': '1', 'track': 'a'}, 4).addCallback(result.extend)
+
+        uris = [urlparse.urlsplit(request[1]) for request in agent.requests]
+        self.assertEqual(['/1/statuses/user_timeline.json', '/s.json'],
+                         [uri.path for uri in uris])
+        self.assertEqual({'user_id': ['1'], 'since_id': ['4'],
+                          'count': ['200']},
+                         urlparse.parse_qs(uris[0].query))
+        self.assertEqual({'q': ['a'], 'since_id': ['4'], 'rpp': ['100'],
+                          'page': ['1']},
+                         urlparse.parse_qs(uris[1].query))
+
+        agent.respond('[{"id": 5, "text": "Hello"}]')
+        agent.respond('{"results": [{"id": 6, "text": "Hello a",'
+                      ' "from_user": "ralphm", "from_user_id": 2}]}')
+        self.assertEqual([5, 6], [status.id for status in result])
+        self.assertIsInstance(result[1], streaming.Status)
+        self.assertEqual('ralphm', result[1].user.screen_name)
@@ -0,0 +1,114 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.cache}.
+"""
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from twittytwister import cache
+
+class CacheEntryTest(unittest.TestCase):
+    """
+    Tests for L{cache.CacheEntry}.
+    """
+
+    def test_validators(self):
+        entry = cache.CacheEntry([], 0, '"abc"', 'Mon, 01 Oct 2012 10:00:00 GMT')
+        self.assertEqual({'If-None-Match': '"abc"',
+                          'If-Modified-Since': 'Mon, 01 Oct 2012 10:00:00 GMT'},
+                         entry.validators())
+
+
+    def test_noValidators(self):
+        self.assertEqual({}, cache.CacheEntry([], 0).validators())
+
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """
+    Tests for L{cache.ResponseCache}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = cache.ResponseCache(maxEntries=2, reactor=self.clock)
+
+
+    def test_cacheable(self):
+        """
+        Only endpoints with a positive TTL are cached.
+        """
+        responseCache = cache.ResponseCache(ttls={'show_user': 0,
+                                                  'friends_ids': 10})
+        self.assertFalse(responseCache.cacheable('show_user'))
+        self.assertTrue(responseCache.cacheable('friends_ids'))
+        self.assertTrue(responseCache.cacheable('home_timeline'))
+        self.assertFalse(responseCache.cacheable('update'))
+
+
+    def test_miss(self):
+        self.assertEqual((False, None), self.cache.lookup('key'))
+        self.assertEqual(1, self.cache.misses)
+
+
+    def test_hit(self):
+        events = [(False, 'item')]
+        self.cache.store('key', 'show_user', events)
+        fresh, entry = self.cache.lookup('key')
+        self.assertTrue(fresh)
+        self.assertIdentical(events, entry.events)
+        self.assertEqual(1, self.cache.hits)
+
+
+    def test_expired(self):
+        """
+        Expired entries without validators are dropped.
+        """
+        self.cache.store('key', 'friends', [])
+        self.clock.advance(30)
+        self.assertEqual((False, None), self.cache.lookup('key'))
+        self.assertEqual(0, len(self.cache))
+
+
+    def test_expiredWithValidators(self):
+        """
+        Expired entries with validators are kept for revalidation.
+        """
+        self.cache.store('key', 'friends', [], etag='"abc"')
+        self.clock.advance(30)
+        fresh, entry = self.cache.lookup('key')
+        self.assertFalse(fresh)
+        self.assertEqual('"abc"', entry.etag)
+
+        self.cache.revalidated(entry, 'friends')
+        self.assertEqual((True, entry), self.cache.lookup('key'))
+        self.assertEqual(1, self.cache.revalidations)
+
+
+    def test_invalidated(self):
+        self.cache.store('key', 'friends', [], etag='"abc"')
+        self.cache.invalidated('key')
+        self.assertEqual(0, len(self.cache))
+
+
+    def test_evictLeastRecentlyUsed(self):
+        self.cache.store('a', 'show_user', [])
+        self.cache.store('b', 'show_user', [])
+        self.cache.lookup('a')
+        self.cache.store('c', 'show_user', [])
+        self.assertEqual((False, None), self.cache.lookup('b'))
+        self.assertTrue(self.cache.lookup('a')[0])
+        self.assertTrue(self.cache.lookup('c')[0])
+        self.assertEqual(1, self.cache.evictions)
+
+
+    def test_stats(self):
+        self.cache.store('a', 'show_user', [])
+        self.cache.lookup('a')
+        self.cache.lookup('b')
+        self.assertEqual({'entries': 1, 'hits': 1, 'misses': 1,
+                          'revalidations': 0, 'evictions': 0,
+                          'hitRate': 0.5},
+                         self.cache.stats())
@@ -0,0 +1,175 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.checkpoint}.
+"""
+
+import os
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from twittytwister import checkpoint
+
+STATE = {'lastId': 2 ** 60, 'args': {'track': u'caf\xe9'}, 'delay': None}
+
+class StoreTestsMixin(object):
+    """
+    Tests for checkpoint stores.
+    """
+
+    def test_loadUnknown(self):
+        self.assertIdentical(None, self.createStore().load('monitor'))
+
+
+    def test_save(self):
+        store = self.createStore()
+        store.save('monitor', STATE)
+        store.save('other', {'lastId': 1})
+        self.assertEqual(STATE, store.load('monitor'))
+
+
+    def test_durable(self):
+        """
+        Saved states survive the store.
+        """
+        self.createStore().save('monitor', STATE)
+        self.createStore().save('other', {'lastId': 1})
+        store = self.createStore()
+        self.assertEqual(STATE, store.load('monitor'))
+        self.assertEqual({'lastId': 1}, store.load('other'))
+
+
+    def test_replace(self):
+        store = self.createStore()
+        store.save('monitor', STATE)
+        store.save('monitor', {'lastId': 1})
+        self.assertEqual({'lastId': 1}, self.createStore().load('monitor'))
+
+
+
+class FileCheckpointStoreTest(StoreTestsMixin, unittest.TestCase):
+    """
+    Tests for L{checkpoint.FileCheckpointStore}.
+    """
+
+    def setUp(self):
+        self.path = self.mktemp()
+
+
+    def createStore(self):
+        return checkpoint.FileCheckpointStore(self.path)
+
+
+    def test_noTemporaryFile(self):
+        self.createStore().save('monitor', STATE)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+
+
+class SQLiteCheckpointStoreTest(StoreTestsMixin, unittest.TestCase):
+    """
+    Tests for L{checkpoint.SQLiteCheckpointStore}.
+    """
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.stores = []
+
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+
+
+    def createStore(self):
+        store = checkpoint.SQLiteCheckpointStore(self.path)
+        self.stores.append(store)
+        return store
+
+
+
+class MemoryStore(object):
+
+    def __init__(self):
+        self.states = {}
+        self.saves = 0
+
+
+    def load(self, name):
+        return self.states.get(name)
+
+
+    def save(self, name, state):
+        self.saves += 1
+        self.states[name] = state
+
+
+
+class CheckpointerTest(unittest.TestCase):
+    """
+    Tests for L{checkpoint.Checkpointer}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.store = MemoryStore()
+        self.state = {'lastId': None, 'args': {}}
+        self.checkpointer = checkpoint.Checkpointer(
+            self.store, 'monitor', lambda: self.state, 10, self.clock)
+
+
+    def test_periodic(self):
+        """
+        The state is saved periodically, only if it changed.
+        """
+        self.checkpointer.start()
+        self.clock.advance(10)
+        self.assertEqual(1, self.store.saves)
+
+        self.clock.advance(10)
+        self.assertEqual(1, self.store.saves)
+
+        self.state['args']['track'] = 'foo'
+        self.clock.advance(10)
+        self.assertEqual(2, self.store.saves)
+        self.assertEqual({'lastId': None, 'args': {'track': 'foo'}},
+                         self.store.states['monitor'])
+        self.checkpointer.stop()
+
+
+    def test_loaded(self):
+        """
+        A loaded state is not saved again.
+        """
+        self.store.states['monitor'] = {'lastId': None, 'args': {}}
+        self.assertEqual(self.state, self.checkpointer.load())
+        self.checkpointer.save()
+        self.assertEqual(0, self.store.saves)
+
+
+    def test_stop(self):
+        """
+        Stopping saves the last state.
+        """
+        self.checkpointer.start()
+        self.state['lastId'] = 3
+        self.checkpointer.stop()
+        self.assertEqual(3, self.store.states['monitor']['lastId'])
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
+    def test_saveFailed(self):
+        """
+        Failed periodic saves are logged, and retried.
+        """
+        def save(name, state):
+            raise IOError()
+        self.store.save = save
+        self.checkpointer.start()
+        self.clock.advance(10)
+        self.clock.advance(10)
+        self.assertEqual(2, len(self.flushLoggedErrors(IOError)))
+        del self.store.save
+        self.checkpointer.stop()
+        self.assertEqual(1, self.store.saves)
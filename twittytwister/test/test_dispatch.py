@@ -0,0 +1,385 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.dispatch}.
+"""
+
+import threading
+
+from twisted.python import log
+from twisted.trial import unittest
+
+from twittytwister import dispatch, streaming
+
+def makeStatus(statusID, userID):
+    return streaming.Status.fromDict({'id': statusID, 'text': u'Hello',
+                                      'user': {'id': userID}})
+
+
+
+class ShardedDispatcherTest(unittest.TestCase):
+    """
+    Tests for L{dispatch.ShardedDispatcher}.
+    """
+
+    def setUp(self):
+        self.received = []
+        self.threads = set()
+        self.dispatcher = dispatch.ShardedDispatcher(self.onEntry, shards=3)
+
+
+    def tearDown(self):
+        if self.dispatcher.running:
+            return self.dispatcher.stopService()
+
+
+    def onEntry(self, entry):
+        self.threads.add(threading.currentThread().getName())
+        self.received.append(entry)
+
+
+    def test_userKey(self):
+        self.assertEqual(42, dispatch.userKey(makeStatus(1, 42)))
+        self.assertIdentical(None, dispatch.userKey(object()))
+
+
+    def test_shardFor(self):
+        """
+        Entries of the same user go to the same shard.
+        """
+        first = self.dispatcher.shardFor(makeStatus(1, 42))
+        second = self.dispatcher.shardFor(makeStatus(2, 42))
+        self.assertEqual(first, second)
+
+
+    def test_orderWithinShard(self):
+        """
+        Entries with the same key are processed in dispatch order.
+        """
+        self.dispatcher.startService()
+        statuses = [makeStatus(i, i % 5) for i in xrange(100)]
+        for status in statuses:
+            self.assertTrue(self.dispatcher(status))
+
+        def check(_):
+            self.assertEqual(100, len(self.received))
+            for userID in xrange(5):
+                expected = [s.id for s in statuses if s.user.id == userID]
+                got = [s.id for s in self.received if s.user.id == userID]
+                self.assertEqual(expected, got)
+            self.assertNotIn(threading.currentThread().getName(),
+                             self.threads)
+
+        d = self.dispatcher.stopService()
+        d.addCallback(check)
+        return d
+
+
+    def test_stats(self):
+        """
+        Per-shard statistics count processed entries.
+        """
+        self.dispatcher.startService()
+        for i in xrange(10):
+            self.dispatcher(makeStatus(i, i))
+
+        def check(_):
+            stats = self.dispatcher.stats()
+            self.assertEqual(3, len(stats))
+            self.assertEqual(10, sum([s['processed'] for s in stats]))
+            self.assertEqual(10, sum([s['dispatched'] for s in stats]))
+            for s in stats:
+                self.assertEqual(0, s['queueDepth'])
+                self.assertTrue(s['maxLatency'] >= s['latency'] >= 0)
+
+        d = self.dispatcher.stopService()
+        d.addCallback(check)
+        return d
+
+
+    def test_queueFull(self):
+        """
+        When a shard's queue is full, entries are dropped and counted.
+        """
+        self.dispatcher.maxQueueSize = 2
+        status = makeStatus(1, 42)
+        self.assertTrue(self.dispatcher(status))
+        self.assertTrue(self.dispatcher(status))
+        self.assertFalse(self.dispatcher(status))
+
+        stats = self.dispatcher.stats()[self.dispatcher.shardFor(status)]
+        self.assertEqual(1, stats['dropped'])
+        self.assertEqual(2, stats['queueDepth'])
+        self.assertEqual(2, stats['maxQueueDepth'])
+
+
+    def test_slowestShard(self):
+        """
+        The shard with the highest queue depth is the slowest when idle.
+        """
+        status = makeStatus(1, 42)
+        self.dispatcher(status)
+        slowest = self.dispatcher.slowestShard()
+        self.assertEqual(self.dispatcher.shardFor(status), slowest['index'])
+
+
+    def test_delegateError(self):
+        """
+        Errors in the delegate are logged and counted.
+        """
+        class Error(Exception):
+            pass
+
+        def onEntry(entry):
+            raise Error()
+
+        self.dispatcher.delegate = onEntry
+        self.dispatcher.startService()
+        self.dispatcher(makeStatus(1, 42))
+
+        def check(_):
+            self.assertEqual(1, len(self.flushLoggedErrors(Error)))
+            self.assertEqual(1, sum([s['errors']
+                                     for s in self.dispatcher.stats()]))
+
+        d = self.dispatcher.stopService()
+        d.addCallback(check)
+        return d
+
+
+
+class FakeProducer(object):
+
+    def __init__(self):
+        self.events = []
+
+
+    def pauseProducing(self):
+        self.events.append('pause')
+
+
+    def resumeProducing(self):
+        self.events.append('resume')
+
+
+
+class ThreadPoolDelegateTest(unittest.TestCase):
+    """
+    Tests for L{dispatch.ThreadPoolDelegate}.
+    """
+
+    def setUp(self):
+        self.received = []
+        self.threads = set()
+        self.pool = dispatch.ThreadPoolDelegate(self.onEntry, threads=3)
+
+
+    def tearDown(self):
+        if self.pool.running:
+            return self.pool.stopService()
+
+
+    def onEntry(self, entry):
+        self.threads.add(threading.currentThread().getName())
+        self.received.append(entry)
+
+
+    def test_unordered(self):
+        """
+        All entries are passed to the delegate, in worker threads.
+        """
+        self.pool.startService()
+        statuses = [makeStatus(i, i % 5) for i in xrange(100)]
+        for status in statuses:
+            self.assertTrue(self.pool(status))
+
+        def check(_):
+            self.assertEqual(sorted([s.id for s in statuses]),
+                             sorted([s.id for s in self.received]))
+            self.assertNotIn(threading.currentThread().getName(),
+                             self.threads)
+            stats = self.pool.stats()
+            self.assertEqual(100, stats['processed'])
+            self.assertEqual(0, stats['pending'])
+            self.assertTrue(stats['maxQueueLatency'] >=
+                            stats['queueLatency'] >= 0)
+
+        d = self.pool.stopService()
+        d.addCallback(check)
+        return d
+
+
+    def test_ordered(self):
+        """
+        In ordered mode, entries with the same key are processed in order.
+        """
+        self.pool.ordered = True
+        self.pool.startService()
+        statuses = [makeStatus(i, i % 5) for i in xrange(100)]
+        for status in statuses:
+            self.pool(status)
+        self.assertEqual(5, self.pool.stats()['waitingKeys'])
+
+        def check(_):
+            self.assertEqual(100, len(self.received))
+            for userID in xrange(5):
+                expected = [s.id for s in statuses if s.user.id == userID]
+                got = [s.id for s in self.received if s.user.id == userID]
+                self.assertEqual(expected, got)
+            self.assertEqual(0, self.pool.stats()['waitingKeys'])
+
+        d = self.pool.stopService()
+        d.addCallback(check)
+        return d
+
+
+    def test_backpressure(self):
+        """
+        Producers are paused at the high water mark, and resumed at the low
+        water mark.
+        """
+        release = threading.Event()
+        self.pool.delegate = lambda entry: release.wait()
+        self.pool.highWater = 4
+        self.pool.lowWater = 1
+        producer = FakeProducer()
+        self.pool.registerProducer(producer)
+        self.pool.startService()
+
+        for i in xrange(3):
+            self.pool(makeStatus(i, i))
+        self.assertEqual([], producer.events)
+        self.pool(makeStatus(3, 3))
+        self.assertEqual(['pause'], producer.events)
+        self.assertTrue(self.pool.paused)
+
+        late = FakeProducer()
+        self.pool.registerProducer(late)
+        self.assertEqual(['pause'], late.events)
+
+        def check(_):
+            self.assertEqual(['pause', 'resume'], producer.events)
+            self.assertEqual(1, self.pool.stats()['pauses'])
+
+        release.set()
+        d = self.pool.stopService()
+        d.addCallback(check)
+        return d
+
+
+    def test_maxPending(self):
+        """
+        Entries beyond the maximum are dropped and counted.
+        """
+        self.pool.maxPending = 1
+        release = threading.Event()
+        self.pool.delegate = lambda entry: release.wait()
+        self.pool.startService()
+        self.assertTrue(self.pool(makeStatus(1, 1)))
+        self.assertFalse(self.pool(makeStatus(2, 1)))
+        self.assertEqual(1, self.pool.stats()['dropped'])
+        release.set()
+
+
+    def test_beforeStart(self):
+        """
+        Entries received before the service is started are queued, and
+        processed once it is started.
+        """
+        status = makeStatus(1, 1)
+        self.assertTrue(self.pool(status))
+        self.assertEqual([], self.received)
+        self.pool.startService()
+
+        def check(_):
+            self.assertEqual([status], self.received)
+
+        d = self.pool.stopService()
+        d.addCallback(check)
+        return d
+
+
+    def test_stopBeforeStart(self):
+        """
+        Stopping a service that was not started processes the entries
+        queued so far, and then stops the thread pool.
+        """
+        status = makeStatus(1, 1)
+        self.pool(status)
+        d = self.pool.stopService()
+
+        def check(_):
+            self.assertEqual([status], self.received)
+            self.assertEqual(0, self.pool.stats()['pending'])
+            self.assertTrue(self.pool._pool.joined)
+
+        d.addCallback(check)
+        return d
+
+
+    def test_stopTwice(self):
+        """
+        Stopping again while the pending entries are drained returns the
+        same Deferred.
+        """
+        release = threading.Event()
+        self.pool.delegate = lambda entry: release.wait()
+        self.pool.startService()
+        self.pool(makeStatus(1, 1))
+        d = self.pool.stopService()
+        self.assertIdentical(d, self.pool.stopService())
+        self.assertFalse(d.called)
+        release.set()
+        return d
+
+
+    def test_afterStop(self):
+        """
+        Entries received once the service is stopping are dropped, and
+        logged. The service can be started again.
+        """
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+
+        self.pool.startService()
+        d = self.pool.stopService()
+        self.assertFalse(self.pool(makeStatus(1, 1)))
+        self.assertEqual(1, self.pool.stats()['dropped'])
+        self.assertIn(("ThreadPoolDelegate is stopped, dropping entry",),
+                      [message['message'] for message in messages])
+
+        def restart(_):
+            self.pool.startService()
+            self.assertTrue(self.pool(makeStatus(2, 1)))
+            return self.pool.stopService()
+
+        def check(_):
+            self.assertEqual([2], [entry.id for entry in self.received])
+
+        d.addCallback(restart)
+        d.addCallback(check)
+        return d
+
+
+    def test_delegateError(self):
+        """
+        Errors in the delegate are logged and counted.
+        """
+        class Error(Exception):
+            pass
+
+        def onEntry(entry):
+            raise Error()
+
+        self.pool.delegate = onEntry
+        self.pool.startService()
+        self.pool(makeStatus(1, 42))
+
+        def check(_):
+            self.assertEqual(1, len(self.flushLoggedErrors(Error)))
+            self.assertEqual(1, self.pool.stats()['errors'])
+
+        d = self.pool.stopService()
+        d.addCallback(check)
+        return d
@@ -0,0 +1,150 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.graph}.
+"""
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from twittytwister import graph
+
+class FakeTwitter(object):
+    """
+    Paging methods that deliver fixed ids in one page.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+
+    def walk_cursor(self, method, delegate, args=(), **kwargs):
+        for id in method(*args):
+            delegate(id)
+        return defer.succeed(len(self.ids))
+
+
+    def friends_ids(self, user):
+        return self.ids
+
+
+    def followers_ids(self, user):
+        return ['9']
+
+
+
+class GraphStoreTestMixin(object):
+    """
+    Tests for L{graph.GraphStore}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.store = graph.GraphStore(reactor=self.clock)
+
+
+    def assertIds(self, expected, ids):
+        self.assertEqual(expected, [int(id) for id in ids])
+
+
+    def test_collector(self):
+        collector = graph.IdCollector()
+        for id in [u'3', u'1', u'2', u'3', 12345678901234]:
+            collector(id)
+        self.assertIds([1, 2, 3, 12345678901234], collector.finish())
+
+
+    def test_update(self):
+        """
+        Updates return the ids added and removed since the previous crawl.
+        """
+        added, removed = self.store.update('friends', 'ralphm', [3, 1, 2])
+        self.assertIds([1, 2, 3], added)
+        self.assertIds([], removed)
+        added, removed = self.store.update('friends', 'ralphm', [4, 2, 3])
+        self.assertIds([4], added)
+        self.assertIds([1], removed)
+        self.assertIds([2, 3, 4], self.store.get('friends', 'ralphm'))
+
+
+    def test_contains(self):
+        self.store.update('followers', 'ralphm', [5, 10, 15])
+        self.assertTrue(self.store.contains('followers', 'ralphm', 10))
+        self.assertFalse(self.store.contains('followers', 'ralphm', 11))
+        self.assertFalse(self.store.contains('followers', 'ralphm', 20))
+        self.assertFalse(self.store.contains('friends', 'ralphm', 10))
+
+
+    def test_mutuals(self):
+        self.store.update('friends', 'ralphm', [1, 2, 3, 4])
+        self.store.update('followers', 'ralphm', [3, 4, 5])
+        self.assertIds([3, 4], self.store.mutuals('ralphm'))
+        self.assertIds([], self.store.mutuals('other'))
+
+
+    def test_common(self):
+        self.store.update('followers', 'a', [1, 2, 3])
+        self.store.update('followers', 'b', [2, 3, 4])
+        self.assertIds([2, 3], self.store.common('followers', 'a',
+                                                 'followers', 'b'))
+
+
+    def test_freshness(self):
+        self.store.update('friends', 'a', [1])
+        self.clock.advance(10)
+        self.store.update('friends', 'b', [1])
+        self.clock.advance(10)
+        self.assertEqual(20, self.store.age('friends', 'a'))
+        self.assertIdentical(None, self.store.age('friends', 'c'))
+        self.assertEqual([('friends', 'a')], self.store.stale(15))
+        self.assertEqual([('friends', 'a'), ('friends', 'b')],
+                         self.store.stale(5))
+
+
+    def test_crawl(self):
+        twitter = FakeTwitter(['20', '10', '30'])
+        d = self.store.crawl(twitter, 'friends', 'ralphm')
+        added, removed = self.successResultOf(d)
+        self.assertIds([10, 20, 30], added)
+        self.assertIds([10, 20, 30], self.store.get('friends', 'ralphm'))
+
+
+    def test_saveLoad(self):
+        self.store.update('friends', 'ralphm', [1, 2, 3])
+        self.store.update('followers', 'ralphm', [2 ** 40, -1, 2])
+        self.store.update('followers', 'nobody', [])
+        self.clock.advance(5)
+        path = self.mktemp()
+        self.store.save(path)
+
+        for mmap in (True, False):
+            loaded = graph.GraphStore.load(path, mmap=mmap, reactor=self.clock)
+            self.assertEqual(3, len(loaded))
+            self.assertIds([1, 2, 3], loaded.get('friends', 'ralphm'))
+            self.assertIds([-1, 2, 2 ** 40], loaded.get('followers', 'ralphm'))
+            self.assertIds([], loaded.get('followers', 'nobody'))
+            self.assertEqual(5, loaded.age('friends', 'ralphm'))
+            self.assertIds([2], loaded.mutuals('ralphm'))
+
+
+    def test_loadInvalid(self):
+        path = self.mktemp()
+        open(path, 'wb').write('garbage')
+        self.assertRaises(ValueError, graph.GraphStore.load, path)
+
+
+
+class GraphStoreTest(GraphStoreTestMixin, unittest.TestCase):
+    if graph.numpy is None:
+        skip = "NumPy is not available"
+
+
+
+class GraphStoreArrayTest(GraphStoreTestMixin, unittest.TestCase):
+    """
+    Tests for L{graph.GraphStore} without NumPy.
+    """
+
+    def setUp(self):
+        self.patch(graph, 'numpy', None)
+        GraphStoreTestMixin.setUp(self)
@@ -0,0 +1,81 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.metrics}.
+"""
+
+from twisted.trial import unittest
+
+from twittytwister import metrics
+
+class HistogramTest(unittest.TestCase):
+    """
+    Tests for L{metrics.Histogram}.
+    """
+
+    def test_observe(self):
+        histogram = metrics.Histogram((1, 10))
+        for value in (0.5, 1, 5, 20):
+            histogram.observe(value)
+        self.assertEqual([2, 1, 1], histogram.counts)
+        self.assertEqual({'count': 4, 'sum': 26.5,
+                          'buckets': [(1, 2), (10, 3), (float('inf'), 4)]},
+                         histogram.snapshot())
+
+
+
+class MonitorMetricsTest(unittest.TestCase):
+    """
+    Tests for L{metrics.MonitorMetrics}.
+    """
+
+    def setUp(self):
+        self.metrics = metrics.MonitorMetrics(0)
+        self.metrics.stateChanged('stopped', 0)
+
+
+    def changes(self, *changes):
+        for state, now in changes:
+            self.metrics.stateChanged(state, now)
+
+
+    def test_stateTimes(self):
+        """
+        The time spent in each state is summed.
+        """
+        self.changes(('idle', 1), ('connecting', 1), ('connected', 3),
+                     ('disconnecting', 10), ('disconnected', 11),
+                     ('connecting', 11), ('connected', 12))
+        snapshot = self.metrics.snapshot(20)
+        self.assertEqual({'stopped': 1, 'idle': 0, 'connecting': 3,
+                          'connected': 15, 'disconnecting': 1,
+                          'disconnected': 0}, snapshot['stateTimes'])
+        self.assertEqual(2, snapshot['stateEntries']['connected'])
+        self.assertEqual('connected', snapshot['state'])
+
+
+    def test_connectLatency(self):
+        """
+        The time to connect is measured from leaving the connected state.
+        """
+        self.changes(('idle', 1), ('connecting', 1), ('connected', 3),
+                     ('disconnected', 10), ('error', 10), ('waiting', 10),
+                     ('connecting', 30), ('connected', 31))
+        histogram = self.metrics.connectLatency
+        self.assertEqual(2, histogram.count)
+        self.assertEqual(23, histogram.sum)
+
+
+    def test_stopDiscards(self):
+        self.changes(('idle', 1), ('connecting', 1), ('stopped', 5),
+                     ('idle', 6), ('connecting', 6), ('connected', 7))
+        self.assertEqual(1, self.metrics.connectLatency.sum)
+
+
+    def test_reconnecting(self):
+        self.metrics.reconnecting(None, 5)
+        self.metrics.reconnecting('http', 10)
+        self.metrics.reconnecting('http', 20)
+        snapshot = self.metrics.snapshot(0)
+        self.assertEqual({'clean': 1, 'http': 2}, snapshot['errorStates'])
+        self.assertEqual(35, snapshot['backOffDelays']['sum'])
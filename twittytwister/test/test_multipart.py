@@ -0,0 +1,150 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.multipart}.
+"""
+
+from cStringIO import StringIO
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from twittytwister import multipart
+
+class Consumer(object):
+    def __init__(self):
+        self.written = []
+
+
+    def write(self, data):
+        self.written.append(data)
+
+
+    def value(self):
+        return ''.join(self.written)
+
+
+
+class MultipartProducerTest(unittest.TestCase):
+    """
+    Tests for L{multipart.MultipartProducer}.
+    """
+
+    def setUp(self):
+        self._scheduled = []
+        self.cooperator = task.Cooperator(
+            terminationPredicateFactory=lambda: lambda: True,
+            scheduler=self._scheduled.append)
+
+
+
+    def produce(self, producer):
+        consumer = Consumer()
+        d = producer.startProducing(consumer)
+        while self._scheduled:
+            self._scheduled.pop(0)()
+        self.successResultOf(d)
+        return consumer
+
+
+    def test_body(self):
+        """
+        The body has the fields and files as parts, and its length.
+        """
+        image = StringIO('\x89PNG' + 'x' * 100)
+        producer = multipart.MultipartProducer(
+            fields=[('name', u'Ralph M\xe9ijer')],
+            files=[('image', 'me.png', image)],
+            boundary='BOUNDARY', cooperator=self.cooperator)
+        expected = ('--BOUNDARY\r\n'
+                    'Content-Disposition: form-data; name="name"\r\n'
+                    '\r\n'
+                    'Ralph M\xc3\xa9ijer\r\n'
+                    '--BOUNDARY\r\n'
+                    'Content-Disposition: form-data; name="image"; '
+                    'filename="me.png"\r\n'
+                    'Content-Type: image/png\r\n'
+                    '\r\n'
+                    '\x89PNG' + 'x' * 100 + '\r\n'
+                    '--BOUNDARY--\r\n')
+        self.assertEqual(len(expected), producer.length)
+        self.assertEqual(expected, self.produce(producer).value())
+        self.assertEqual('multipart/form-data; boundary=BOUNDARY',
+                         producer.contentType)
+        self.assertTrue(image.closed)
+
+
+    def test_rawData(self):
+        producer = multipart.MultipartProducer(
+            files=[('image', 'me.gif', 'GIF89a')], boundary='B',
+            cooperator=self.cooperator)
+        body = self.produce(producer).value()
+        self.assertIn('Content-Type: image/gif\r\n\r\nGIF89a\r\n', body)
+        self.assertEqual(len(body), producer.length)
+
+
+    def test_unicode(self):
+        """
+        Unicode values of fields and raw file contents are encoded as
+        UTF-8.
+        """
+        producer = multipart.MultipartProducer(
+            fields=[('status', u'Caf\xe9')],
+            files=[('description', 'about.txt', u'Na\xefve')],
+            boundary='B', cooperator=self.cooperator)
+        body = self.produce(producer).value()
+        self.assertIn('\r\n\r\nCaf\xc3\xa9\r\n', body)
+        self.assertIn('Content-Type: text/plain\r\n\r\nNa\xc3\xafve\r\n',
+                      body)
+        self.assertEqual(len(body), producer.length)
+
+
+    def test_chunks(self):
+        """
+        Files are read in chunks, from their current position.
+        """
+        path = self.mktemp()
+        open(path, 'wb').write('0123456789' * 10)
+        f = open(path, 'rb')
+        f.read(50)
+        producer = multipart.MultipartProducer(
+            files=[('image', 'data', f)], boundary='B',
+            cooperator=self.cooperator)
+        producer.readSize = 20
+        consumer = self.produce(producer)
+        self.assertEqual(['0123456789' * 2] * 2 + ['0123456789'],
+                         consumer.written[1:4])
+        self.assertEqual(len(consumer.value()), producer.length)
+        self.assertTrue(f.closed)
+
+
+    def test_pauseResume(self):
+        producer = multipart.MultipartProducer(
+            files=[('image', 'data', StringIO('x' * 100))], boundary='B',
+            cooperator=self.cooperator)
+        producer.readSize = 10
+        consumer = Consumer()
+        producer.startProducing(consumer)
+        self._scheduled.pop(0)()
+        producer.pauseProducing()
+        written = len(consumer.written)
+        while self._scheduled:
+            self._scheduled.pop(0)()
+        self.assertEqual(written, len(consumer.written))
+        producer.resumeProducing()
+        self._scheduled.pop(0)()
+        self.assertTrue(len(consumer.written) > written)
+
+
+    def test_stop(self):
+        """
+        Stopping closes the files and never fires the result.
+        """
+        f = StringIO('x' * 100)
+        producer = multipart.MultipartProducer(
+            files=[('image', 'data', f)], boundary='B',
+            cooperator=self.cooperator)
+        d = producer.startProducing(Consumer())
+        producer.stopProducing()
+        self.assertTrue(f.closed)
+        self.assertNoResult(d)
@@ -0,0 +1,145 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.paging}.
+"""
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from twittytwister import paging
+
+class FakePages(object):
+    """
+    Pages of a cursored resource, answered using L{respond}.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+
+    def __call__(self, cursor, onItem, onPage):
+        d = defer.Deferred()
+        self.requests.append((cursor, onItem, onPage, d))
+        return d
+
+
+    def respond(self):
+        cursor, onItem, onPage, d = self.requests.pop(0)
+        items, nextCursor = self.pages[cursor]
+        for item in items:
+            onItem(item)
+        onPage(nextCursor, '0')
+        d.callback(None)
+
+
+
+class CursorWalkerTest(unittest.TestCase):
+    """
+    Tests for L{paging.CursorWalker}.
+    """
+
+    def setUp(self):
+        self.fetchPage = FakePages({'-1': ([1, 2], '10'),
+                                    '10': ([3, 4], '20'),
+                                    '20': ([5], '0')})
+        self.items = []
+
+
+    def test_allPages(self):
+        walker = paging.CursorWalker(self.fetchPage, self.items.append)
+        d = walker.start()
+        while self.fetchPage.requests:
+            self.fetchPage.respond()
+        self.assertEqual(5, self.successResultOf(d))
+        self.assertEqual([1, 2, 3, 4, 5], self.items)
+        self.assertEqual(3, walker.pages)
+
+
+    def test_maxPages(self):
+        walker = paging.CursorWalker(self.fetchPage, self.items.append,
+                                     maxPages=2)
+        d = walker.start()
+        while self.fetchPage.requests:
+            self.fetchPage.respond()
+        self.assertEqual(4, self.successResultOf(d))
+
+
+    def test_prefetch(self):
+        """
+        Pages are fetched ahead while a slow delegate works on earlier items.
+        """
+        waiting = []
+        def delegate(item):
+            self.items.append(item)
+            waiting.append(defer.Deferred())
+            return waiting[-1]
+
+        walker = paging.CursorWalker(self.fetchPage, delegate, prefetch=1)
+        d = walker.start()
+        self.fetchPage.respond()
+        self.assertEqual([1], self.items)
+        self.assertEqual(['10'], [r[0] for r in self.fetchPage.requests])
+
+        self.fetchPage.respond()
+        self.assertEqual([], self.fetchPage.requests)
+
+        waiting.pop(0).callback(None)
+        self.assertEqual([1, 2], self.items)
+        self.assertEqual([], self.fetchPage.requests)
+
+        waiting.pop(0).callback(None)
+        self.assertEqual([1, 2, 3], self.items)
+        self.assertEqual(['20'], [r[0] for r in self.fetchPage.requests])
+
+        self.fetchPage.respond()
+        while waiting:
+            waiting.pop(0).callback(None)
+        self.assertEqual(5, self.successResultOf(d))
+
+
+    def test_noPrefetch(self):
+        waiting = []
+        def delegate(item):
+            waiting.append(defer.Deferred())
+            return waiting[-1]
+
+        walker = paging.CursorWalker(self.fetchPage, delegate, prefetch=0)
+        walker.start()
+        self.fetchPage.respond()
+        self.assertEqual([], self.fetchPage.requests)
+        waiting.pop(0).callback(None)
+        waiting.pop(0).callback(None)
+        self.assertEqual(['10'], [r[0] for r in self.fetchPage.requests])
+
+
+    def test_synchronousDeferreds(self):
+        """
+        Delegates returning fired Deferreds do not recurse.
+        """
+        pages = {'-1': (range(5000), '0')}
+        fetchPage = FakePages(pages)
+        walker = paging.CursorWalker(fetchPage, defer.succeed)
+        d = walker.start()
+        fetchPage.respond()
+        self.assertEqual(5000, self.successResultOf(d))
+
+
+    def test_fetchError(self):
+        walker = paging.CursorWalker(self.fetchPage, self.items.append)
+        d = walker.start()
+        self.fetchPage.respond()
+        self.fetchPage.requests[0][3].errback(RuntimeError())
+        self.failureResultOf(d, RuntimeError)
+        self.assertEqual([1, 2], self.items)
+
+
+    def test_delegateError(self):
+        def delegate(item):
+            raise ValueError()
+
+        walker = paging.CursorWalker(self.fetchPage, delegate)
+        d = walker.start()
+        self.fetchPage.respond()
+        self.failureResultOf(d, ValueError)
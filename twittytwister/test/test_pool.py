@@ -0,0 +1,212 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.pool}.
+"""
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from twittytwister import checkpoint, pool, streaming, twitter
+from twittytwister.test.test_twitter import FakeTwitterAPI
+
+def makeStatus(id):
+    return streaming.Status.fromDict({'id': id, 'text': u'Hello'})
+
+
+
+class MonitorPoolTest(unittest.TestCase):
+    """
+    Tests for L{pool.MonitorPool}.
+    """
+
+    def setUp(self):
+        self.entries = []
+        self.clock = task.Clock()
+        self.apis = [FakeTwitterAPI() for i in xrange(3)]
+        self.pool = pool.MonitorPool([api.filter for api in self.apis],
+                                     self.entries.append,
+                                     limits={'track': 2, 'follow': 3},
+                                     reactor=self.clock)
+
+
+    def tearDown(self):
+        if self.pool.running:
+            self.pool.stopService()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
+    def connectAll(self):
+        for api in self.apis:
+            if api.deferred is not None and not api.deferred.called:
+                api.connected()
+
+
+    def test_partition(self):
+        """
+        Values are spread over shards of at most the limit each.
+        """
+        self.pool.setFilters(track=['a', 'b', 'c'], follow=[1, 2])
+        self.pool.startService()
+        self.assertEqual([{'track': 'a,b', 'follow': '1,2'}],
+                         self.apis[0].filterCalls)
+        self.assertEqual([{'track': 'c'}], self.apis[1].filterCalls)
+        self.assertEqual([], self.apis[2].filterCalls)
+        self.assertEqual(set(['a', 'b', 'c']), self.pool.values('track'))
+
+
+    def test_notEnoughConnections(self):
+        """
+        Adding more values than the connections allow fails without adding
+        any of them.
+        """
+        self.assertRaises(twitter.Error, self.pool.add,
+                          track=['a', 'b', 'c', 'd', 'e', 'f', 'g'])
+        self.assertEqual(set(), self.pool.values('track'))
+        self.assertEqual([], self.pool.shards)
+
+
+    def test_invalidLimits(self):
+        """
+        Limits that are not positive integers are rejected.
+        """
+        for limit in (0, -1, 1.5, None):
+            self.assertRaises(ValueError, pool.MonitorPool, [], None,
+                              limits={'track': limit})
+
+
+    def test_stats(self):
+        """
+        The stats hold the counts and the monitor state of each shard.
+        """
+        self.pool.setFilters(track=['a', 'b', 'c'], follow=[1])
+        self.pool.startService()
+        self.apis[0].connected()
+        self.apis[0].delegate(makeStatus(1))
+        self.assertEqual(
+            [{'index': 0, 'received': 1, 'duplicates': 0, 'reconnects': 0,
+              'state': 'connected', 'track': 2, 'follow': 1},
+             {'index': 1, 'received': 0, 'duplicates': 0, 'reconnects': 0,
+              'state': 'connecting', 'track': 1, 'follow': 0}],
+            self.pool.stats())
+
+
+    def test_addReconnectsAffectedShard(self):
+        """
+        Adding a value only reconnects the shard it is added to.
+        """
+        self.pool.add(track=['a', 'b', 'c'])
+        self.pool.startService()
+        self.connectAll()
+
+        self.pool.add(track=['d'])
+        self.assertEqual(1, len(self.apis[0].filterCalls))
+        self.assertEqual([{'track': 'c'}, {'track': 'c,d'}],
+                         self.apis[1].filterCalls)
+        self.assertEqual([0, 1], [s['reconnects']
+                                  for s in self.pool.stats()])
+
+
+    def test_removeStopsEmptyShard(self):
+        """
+        A shard without values is stopped, and its API can be reused.
+        """
+        self.pool.add(track=['a', 'b', 'c'])
+        self.pool.startService()
+        self.connectAll()
+        protocol = self.apis[1].protocol
+
+        self.pool.remove(track=['c'])
+        self.assertTrue(protocol.stopCalled)
+        self.assertEqual(1, len(self.pool.shards))
+        self.assertEqual(1, len(self.apis[0].filterCalls))
+
+        self.pool.add(follow=['1', '2', '3', '4'])
+        self.assertEqual([{'track': 'a,b', 'follow': '1,2,3'}],
+                         self.apis[0].filterCalls[1:])
+        self.assertEqual([{'follow': '4'}], self.apis[2].filterCalls)
+
+
+    def test_setFilters(self):
+        """
+        Replacing the filter reconnects a shard once, and reuses the room of
+        removed values.
+        """
+        self.pool.setFilters(track=['a', 'b', 'c'])
+        self.pool.startService()
+        self.connectAll()
+
+        self.pool.setFilters(track=['a', 'c', 'x'])
+        self.assertEqual({'track': 'a,x'}, self.apis[0].filterCalls[-1])
+        self.assertEqual(2, len(self.apis[0].filterCalls))
+        self.assertEqual(1, len(self.apis[1].filterCalls))
+
+
+    def test_merge(self):
+        """
+        Entries of all shards go to the delegate, once per id.
+        """
+        self.pool.add(track=['a', 'b', 'c'])
+        self.pool.startService()
+        self.connectAll()
+
+        first, second = makeStatus(1), makeStatus(2)
+        self.apis[0].delegate(first)
+        self.apis[1].delegate(makeStatus(1))
+        self.apis[1].delegate(second)
+        self.assertEqual([first, second], self.entries)
+
+        stats = self.pool.stats()
+        self.assertEqual([1, 2], [s['received'] for s in stats])
+        self.assertEqual([0, 1], [s['duplicates'] for s in stats])
+        self.assertEqual([2, 1], [s['track'] for s in stats])
+        self.assertEqual(['connected', 'connected'],
+                         [s['state'] for s in stats])
+
+
+    def test_dedupSize(self):
+        """
+        Only recent ids are remembered.
+        """
+        self.pool.dedupSize = 1
+        self.pool.add(track=['a'])
+        self.pool.startService()
+        self.connectAll()
+
+        for id in (1, 2, 1):
+            self.apis[0].delegate(makeStatus(id))
+        self.assertEqual([1, 2, 1], [entry.id for entry in self.entries])
+
+
+    def test_checkpoint(self):
+        """
+        The filter, recent ids and last id are saved, and restored on start
+        if no filter was set.
+        """
+        store = checkpoint.FileCheckpointStore(self.mktemp())
+        self.pool.checkpointStore = store
+        self.pool.add(track=['a', 'b', 'c'])
+        self.pool.startService()
+        self.connectAll()
+        self.apis[0].delegate(makeStatus(1))
+        self.apis[1].delegate(makeStatus(2))
+        self.pool.stopService()
+        self.assertEqual({'track': ['a', 'b', 'c'], 'follow': [],
+                          'lastId': 2, 'recent': [1, 2]},
+                         store.load('pool'))
+
+        apis = [FakeTwitterAPI() for i in xrange(2)]
+        restored = pool.MonitorPool([api.filter for api in apis],
+                                    self.entries.append,
+                                    limits={'track': 2}, reactor=self.clock)
+        restored.checkpointStore = store
+        restored.startService()
+        self.assertEqual([{'track': 'a,b'}], apis[0].filterCalls)
+        self.assertEqual([2, 2], [shard.monitor.lastId
+                                  for shard in restored.shards])
+
+        for api in apis:
+            api.connected()
+        apis[1].delegate(makeStatus(2))
+        self.assertEqual(2, len(self.entries))
+        restored.stopService()
@@ -0,0 +1,126 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.pull}.
+"""
+
+from twisted.python import failure
+from twisted.trial import unittest
+
+from twittytwister import pull, streaming
+
+def makeStatus(id):
+    return streaming.Status.fromDict({'id': id, 'text': u'Hello'})
+
+
+
+class FakeProducer(object):
+
+    def __init__(self):
+        self.events = []
+
+
+    def pauseProducing(self):
+        self.events.append('pause')
+
+
+    def resumeProducing(self):
+        self.events.append('resume')
+
+
+
+class StatusQueueTest(unittest.TestCase):
+    """
+    Tests for L{pull.StatusQueue}.
+    """
+
+    def setUp(self):
+        self.queue = pull.StatusQueue(size=4, lowWater=1)
+        self.producer = FakeProducer()
+        self.queue.registerProducer(self.producer)
+
+
+    def test_get(self):
+        """
+        Entries are taken in order, also by consumers that wait.
+        """
+        d = self.queue.get()
+        self.assertNoResult(d)
+        first, second = makeStatus(1), makeStatus(2)
+        self.queue(first)
+        self.queue(second)
+        self.assertIdentical(first, self.successResultOf(d))
+        self.assertIdentical(second, self.successResultOf(self.queue.get()))
+
+
+    def test_backpressure(self):
+        """
+        Producers are paused when the buffer is full, and resumed when it
+        was taken down to the low water mark.
+        """
+        for id in xrange(3):
+            self.queue(makeStatus(id))
+        self.assertEqual([], self.producer.events)
+        self.queue(makeStatus(3))
+        self.queue(makeStatus(4))
+        self.assertEqual(['pause'], self.producer.events)
+        self.assertEqual(5, len(self.queue))
+
+        late = FakeProducer()
+        self.queue.registerProducer(late)
+        self.assertEqual(['pause'], late.events)
+
+        for id in xrange(3):
+            self.queue.get()
+        self.assertEqual(['pause'], self.producer.events)
+        self.queue.get()
+        self.assertEqual(['pause', 'resume'], self.producer.events)
+        self.assertEqual(['pause', 'resume'], late.events)
+        self.assertFalse(self.queue.paused)
+        self.assertEqual(1, self.queue.pauses)
+
+
+    def test_close(self):
+        """
+        After the buffered entries, consumers get C{None} once closed.
+        """
+        status = makeStatus(1)
+        self.queue(status)
+        self.queue.close()
+        self.queue(makeStatus(2))
+        self.assertEqual(1, len(self.queue))
+        self.assertIdentical(status, self.successResultOf(self.queue.get()))
+        for i in xrange(2):
+            self.assertIdentical(None, self.successResultOf(self.queue.get()))
+
+
+    def test_closeWaiting(self):
+        """
+        Consumers that wait get C{None} when the queue is closed.
+        """
+        d = self.queue.get()
+        self.queue.close()
+        self.assertIdentical(None, self.successResultOf(d))
+
+
+    def test_closeReason(self):
+        """
+        Closing with a reason fails consumers after the buffered entries.
+        """
+        self.queue(makeStatus(1))
+        self.queue.close(failure.Failure(ValueError()))
+        self.successResultOf(self.queue.get())
+        self.failureResultOf(self.queue.get(), ValueError)
+        self.failureResultOf(self.queue.get(), ValueError)
+
+
+    def test_closeUnregisters(self):
+        """
+        Producers are forgotten once closed.
+        """
+        for id in xrange(4):
+            self.queue(makeStatus(id))
+        self.queue.close()
+        for id in xrange(4):
+            self.queue.get()
+        self.assertEqual(['pause'], self.producer.events)
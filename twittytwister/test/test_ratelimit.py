@@ -0,0 +1,165 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.ratelimit}.
+"""
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from twittytwister import ratelimit
+
+class ParseRateLimitHeadersTest(unittest.TestCase):
+    """
+    Tests for L{ratelimit.parseRateLimitHeaders}.
+    """
+
+    def test_parse(self):
+        headers = {'x-ratelimit-limit': ['350'],
+                   'x-ratelimit-remaining': ['349'],
+                   'x-ratelimit-reset': ['1277485629']}
+        self.assertEqual((350, 349, 1277485629),
+                         ratelimit.parseRateLimitHeaders(headers))
+
+
+    def test_parseNewStyle(self):
+        headers = {'x-rate-limit-limit': ['15'],
+                   'x-rate-limit-remaining': ['0'],
+                   'x-rate-limit-reset': ['1350000000']}
+        self.assertEqual((15, 0, 1350000000),
+                         ratelimit.parseRateLimitHeaders(headers))
+
+
+    def test_missing(self):
+        self.assertIdentical(None, ratelimit.parseRateLimitHeaders({}))
+        self.assertIdentical(None, ratelimit.parseRateLimitHeaders({
+            'x-ratelimit-limit': ['a'],
+            'x-ratelimit-remaining': ['1'],
+            'x-ratelimit-reset': ['1']}))
+
+
+
+class RateLimitSchedulerTest(unittest.TestCase):
+    """
+    Tests for L{ratelimit.RateLimitScheduler}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.scheduler = ratelimit.RateLimitScheduler(reactor=self.clock)
+        self.calls = []
+        self.pending = []
+
+
+    def request(self, name, priority=ratelimit.PRIORITY_NORMAL):
+        def call():
+            self.calls.append(name)
+            d = defer.Deferred()
+            self.pending.append(d)
+            return d
+        return self.scheduler.schedule('key', priority, call)
+
+
+    def finish(self):
+        while self.pending:
+            self.pending.pop(0).callback(None)
+
+
+    def test_unknownBudget(self):
+        """
+        Requests are released immediately until a budget is known.
+        """
+        for i in xrange(3):
+            self.request(i)
+        self.assertEqual([0, 1, 2], self.calls)
+        self.assertEqual(0, self.scheduler.delayed)
+
+
+    def test_result(self):
+        d = self.scheduler.schedule('key', ratelimit.PRIORITY_NORMAL,
+                                    lambda x: x * 2, 21)
+        self.assertEqual(42, self.successResultOf(d))
+
+
+    def test_exhausted(self):
+        """
+        Without budget left, requests wait for the reset by priority.
+        """
+        self.scheduler.update('key', 100, 0, 1060)
+        self.request('low', ratelimit.PRIORITY_LOW)
+        self.request('high', ratelimit.PRIORITY_HIGH)
+        self.assertEqual([], self.calls)
+        self.assertEqual(2, self.scheduler.stats()['queued'])
+
+        self.clock.advance(60)
+        self.assertEqual(['high', 'low'], self.calls)
+        self.assertEqual(2, self.scheduler.delayed)
+
+
+    def test_otherKeys(self):
+        """
+        Budgets are separate per key.
+        """
+        self.scheduler.update('key', 100, 0, 1060)
+        self.scheduler.schedule('other', ratelimit.PRIORITY_NORMAL,
+                                self.calls.append, 'other')
+        self.assertEqual(['other'], self.calls)
+
+
+    def test_plenty(self):
+        """
+        Requests are not delayed while above the low water mark.
+        """
+        self.scheduler.update('key', 100, 50, 1060)
+        for i in xrange(5):
+            self.request(i)
+        self.assertEqual(range(5), self.calls)
+
+
+    def test_paced(self):
+        """
+        Below the low water mark, requests are spread over the window.
+        """
+        self.scheduler.update('key', 100, 10, 1100)
+        for i in xrange(3):
+            self.request(i)
+        self.assertEqual([0], self.calls)
+
+        self.clock.advance(9)
+        self.assertEqual([0], self.calls)
+        self.clock.advance(1)
+        self.assertEqual([0, 1], self.calls)
+
+
+    def test_inFlight(self):
+        """
+        Requests in flight count against the remaining budget.
+        """
+        self.scheduler.update('key', 100, 1, 1060)
+        self.request(0)
+        self.request(1)
+        self.assertEqual([0], self.calls)
+
+        self.scheduler.update('key', 100, 0, 1060)
+        self.finish()
+        self.assertEqual([0], self.calls)
+        self.clock.advance(60)
+        self.assertEqual([0, 1], self.calls)
+
+
+    def test_maxWait(self):
+        """
+        Bogus reset times do not block requests indefinitely.
+        """
+        self.scheduler.update('key', 100, 0, 1000 + 86400)
+        self.request(0)
+        self.clock.advance(self.scheduler.maxWait)
+        self.assertEqual([0], self.calls)
+
+
+    def test_stop(self):
+        self.scheduler.update('key', 100, 0, 1060)
+        self.request(0)
+        self.scheduler.stop()
+        self.assertEqual([], self.clock.getDelayedCalls())
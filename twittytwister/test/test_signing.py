@@ -0,0 +1,135 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.signing}.
+"""
+
+from oauth import oauth
+
+from twisted.trial import unittest
+
+from twittytwister import signing, twitter
+
+def parseHeader(header):
+    """
+    Parse an OAuth C{Authorization} header into a dictionary.
+    """
+    scheme, params = header.split(' ', 1)
+    result = {}
+    for param in params.split(', '):
+        name, value = param.split('=', 1)
+        result[name] = value
+    return scheme, result
+
+
+
+class OAuthSignerTest(unittest.TestCase):
+    """
+    Tests for L{signing.OAuthSigner}.
+    """
+
+    def setUp(self):
+        self.consumer = oauth.OAuthConsumer('consumer key', 'consumer/secret')
+        self.token = oauth.OAuthToken('token key', 'token secret~')
+        self.signer = signing.OAuthSigner(self.consumer, self.token)
+
+
+    def expected(self, method, url, parameters, token=True):
+        token = self.token if token else None
+        params = {'oauth_timestamp': 1350000000, 'oauth_nonce': '12345678'}
+        params.update(parameters)
+        request = oauth.OAuthRequest.from_consumer_and_token(
+            self.consumer, token=token, http_method=method, http_url=url,
+            parameters=params)
+        request.sign_request(oauth.OAuthSignatureMethod_HMAC_SHA1(),
+                             self.consumer, token)
+        return parseHeader(request.to_header()['Authorization'])
+
+
+    def sign(self, method, url, parameters, signer=None):
+        signer = signer or self.signer
+        return parseHeader(signer.sign(method, url, parameters,
+                                       timestamp=1350000000,
+                                       nonce='12345678'))
+
+
+    def test_sameAsOAuthRequest(self):
+        """
+        The header is the same as the one from L{oauth.OAuthRequest}.
+        """
+        url = 'https://api.twitter.com/1/statuses/update.xml'
+        params = {'status': u'Hello w\xf6rld & friends!', 'count': 20}
+        self.assertEqual(self.expected('POST', url, params),
+                         self.sign('POST', url, params))
+
+
+    def test_noParameters(self):
+        url = 'https://api.twitter.com/1/account/verify_credentials.xml'
+        self.assertEqual(self.expected('GET', url, {}),
+                         self.sign('GET', url, None))
+
+
+    def test_noToken(self):
+        signer = signing.OAuthSigner(self.consumer)
+        url = 'https://api.twitter.com/1/users/show/ralphm.xml'
+        self.assertEqual(self.expected('GET', url, {}, token=False),
+                         self.sign('GET', url, None, signer))
+
+
+    def test_normalizedURL(self):
+        """
+        Default ports and query arguments are not part of the signed URL.
+        """
+        url = 'https://stream.twitter.com:443/1.1/statuses/filter.json'
+        params = {'track': 'twisted', 'delimited': 'length'}
+        self.assertEqual(self.expected('GET', url + '?track=twisted', params),
+                         self.sign('GET', url + '?track=twisted', params))
+
+
+    def test_oauthParameters(self):
+        """
+        Extra parameters starting with C{oauth_} are included in the header.
+        """
+        url = 'https://api.twitter.com/oauth/access_token'
+        params = {'oauth_verifier': 'abc def'}
+        scheme, header = self.sign('POST', url, params)
+        self.assertEqual('"abc%20def"', header['oauth_verifier'])
+        self.assertEqual(self.expected('POST', url, params),
+                         (scheme, header))
+
+
+    def test_overrideStatic(self):
+        """
+        Parameters that override static OAuth parameters are respected.
+        """
+        url = 'https://api.twitter.com/1/users/show/ralphm.xml'
+        params = {'oauth_version': '1.0a'}
+        scheme, header = self.sign('GET', url, params)
+        self.assertEqual('"1.0a"', header['oauth_version'])
+        self.assertEqual(self.expected('GET', url, params),
+                         (scheme, header))
+
+
+    def test_makeHeader(self):
+        headers = self.signer.makeHeader('GET', 'http://example.org/',
+                                         headers={'X-Test': 'test'})
+        self.assertEqual('test', headers['X-Test'])
+        self.assertTrue(headers['Authorization'].startswith('OAuth realm=""'))
+
+
+    def test_twitterUsesSigner(self):
+        """
+        L{twitter.Twitter} reuses a signer for its consumer and token.
+        """
+        api = twitter.Twitter(consumer=self.consumer, token=self.token)
+        headers = api.makeAuthHeader('GET', 'http://example.org/', {}, {})
+        self.assertIn('Authorization', headers)
+        signer = api._signer
+        self.assertIdentical(self.token, signer.token)
+
+        api.makeAuthHeader('GET', 'http://example.org/', {}, {})
+        self.assertIdentical(signer, api._signer)
+
+        api.token = oauth.OAuthToken('other key', 'other secret')
+        api.makeAuthHeader('GET', 'http://example.org/', {}, {})
+        self.assertIdentical(api.token, api._signer.token)
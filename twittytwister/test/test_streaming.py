@@ -424,6 +424,37 @@ class TwitterStreamTest(unittest.TestCase):
         self.assertEquals(0, len(self.objects))
 
 
+    def test_counters(self):
+        """
+        Datagrams, keep-alives and the creation time of the last status are
+        recorded.
+        """
+        self.protocol.dataReceived('\r\n\r\n')
+        self.protocol.datagramReceived('{"text": "Test", "created_at": '
+                                       '"Mon Dec 06 11:46:33 +0000 2010"}')
+        self.protocol.datagramReceived('{"something": "Some Value"}')
+        self.assertEqual(2, self.protocol.keepAlives)
+        self.assertEqual(2, self.protocol.datagrams)
+        self.assertEqual('Mon Dec 06 11:46:33 +0000 2010',
+                         self.protocol.lastCreatedAt)
+
+
+    def test_pauseProducing(self):
+        """
+        Pausing pauses the transport and suspends the timeout.
+        """
+        self.protocol.pauseProducing()
+        self.assertTrue(self.protocol.paused)
+        self.assertEqual('paused', self.transport.producerState)
+        self.clock.advance(120)
+        self.assertEqual('paused', self.transport.producerState)
+
+        self.protocol.resumeProducing()
+        self.assertEqual('producing', self.transport.producerState)
+        self.clock.advance(60)
+        self.assertEqual('stopped', self.transport.producerState)
+
+
     def test_badJSON(self):
         """
         Datagrams with invalid JSON are logged and ignored.
@@ -0,0 +1,136 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.tjson}.
+"""
+
+import simplejson as json
+
+from twisted.trial import unittest
+
+from twittytwister import streaming, tjson
+
+STATUS = {'id': 1, 'text': u'Hello w\xf6rld',
+          'user': {'id': 2, 'screen_name': 'ralphm'}}
+
+def feed(parser, data, chunkSize=7):
+    for i in xrange(0, len(data), chunkSize):
+        parser.write(data[i:i + chunkSize])
+    parser.close()
+
+
+
+class ParserTest(unittest.TestCase):
+    """
+    Tests for the parser factories in L{tjson}.
+    """
+
+    def test_statuses(self):
+        statuses = []
+        feed(tjson.Statuses(statuses.append), json.dumps([STATUS, STATUS]))
+        self.assertEqual(2, len(statuses))
+        self.assertIsInstance(statuses[0], streaming.Status)
+        self.assertEqual(u'Hello w\xf6rld', statuses[0].text)
+        self.assertEqual('ralphm', statuses[0].user.screen_name)
+
+
+    def test_extraArgs(self):
+        result = []
+        feed(tjson.Statuses(lambda s, arg: result.append(arg), 'extra'),
+             json.dumps([STATUS]))
+        self.assertEqual(['extra'], result)
+
+
+    def test_singleUser(self):
+        users = []
+        feed(tjson.Users(users.append), json.dumps(STATUS['user']))
+        self.assertEqual(['ralphm'], [u.screen_name for u in users])
+
+
+    def test_direct(self):
+        messages = []
+        feed(tjson.Direct(messages.append),
+             json.dumps([{'id': 3, 'text': 'hi', 'sender': STATUS['user']}]))
+        self.assertIsInstance(messages[0], streaming.DirectMessage)
+        self.assertEqual('ralphm', messages[0].sender.screen_name)
+
+
+    def test_search(self):
+        """
+        Search results are statuses, with a user built from the author
+        fields.
+        """
+        statuses = []
+        feed(tjson.Search(statuses.append),
+             json.dumps({'results': [{'id': 1, 'text': u'Hello',
+                                      'from_user': 'ralphm',
+                                      'from_user_id': 2}],
+                         'max_id': 1}))
+        self.assertIsInstance(statuses[0], streaming.Status)
+        self.assertEqual(u'Hello', statuses[0].text)
+        self.assertEqual((2, 'ralphm'), (statuses[0].user.id,
+                                         statuses[0].user.screen_name))
+
+
+    def test_invalid(self):
+        parser = tjson.Statuses(lambda s: None)
+        parser.write('[{')
+        self.assertRaises(ValueError, parser.close)
+
+
+    def test_paging(self):
+        ids = []
+        pages = []
+        parser = tjson.PagedIDList.pagingParser(ids.append, pages.append)
+        feed(parser, json.dumps({'ids': [1, 2], 'next_cursor': 123,
+                                 'next_cursor_str': '123',
+                                 'previous_cursor': 0}))
+        self.assertEqual([1, 2], ids)
+        self.assertEqual([('123', '0')],
+                         [(p.next_cursor, p.previous_cursor) for p in pages])
+
+
+    def test_noPaging(self):
+        users = []
+        parser = tjson.PagedUserList.noPagingParser(users.append)
+        feed(parser, json.dumps([STATUS['user']]))
+        self.assertEqual(['ralphm'], [u.screen_name for u in users])
+
+
+    def test_parseUpdateResponse(self):
+        self.assertEqual('240859602684612608', tjson.parseUpdateResponse(
+            json.dumps({'id': 240859602684612608,
+                        'id_str': '240859602684612608'})))
+
+
+    def test_updateResponse(self):
+        ids = []
+        feed(tjson.UpdateResponse(ids.append), json.dumps(STATUS))
+        self.assertEqual(['1'], ids)
+
+
+
+class PathExtractorTest(unittest.TestCase):
+    """
+    Tests for L{tjson.PathExtractor}.
+    """
+
+    def test_paths(self):
+        self.assertEqual({('id',): STATUS['id'],
+                          ('user', 'screen_name'): 'ralphm'},
+                         tjson.extractPaths(json.dumps(STATUS),
+                                            [('id',), ('user', 'screen_name'),
+                                             ('user', 'missing')]))
+
+
+    def test_list(self):
+        """
+        In lists, the first item that has the path is used.
+        """
+        data = json.dumps([{'id': 1}, {'id': 2, 'geo': 'here'}])
+        self.assertEqual({('id',): 1, ('geo',): 'here'},
+                         tjson.extractPaths(data, [('id',), ('geo',)]))
+
+
+    def test_empty(self):
+        self.assertEqual({}, tjson.extractPaths('', [('id',)]))
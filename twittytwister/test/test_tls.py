@@ -0,0 +1,136 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.tls}.
+"""
+
+from OpenSSL import crypto
+
+from twisted.internet import reactor, ssl
+from twisted.trial import unittest
+from twisted.web import client, resource, server
+
+from twittytwister import tls
+
+def makeCertificate(hostname):
+    """
+    Create a self-signed certificate and key for C{hostname}.
+    """
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    cert = crypto.X509()
+    cert.get_subject().CN = hostname
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(-60)
+    cert.gmtime_adj_notAfter(3600)
+    cert.set_issuer(cert.get_subject())
+    cert.add_extensions([
+        crypto.X509Extension('subjectAltName', False, 'DNS:' + hostname),
+        crypto.X509Extension('basicConstraints', True, 'CA:TRUE'),
+        ])
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+    return ssl.PrivateCertificate.load(
+        crypto.dump_certificate(crypto.FILETYPE_PEM, cert),
+        ssl.KeyPair(key), crypto.FILETYPE_PEM)
+
+
+
+class Hello(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        return 'Hello'
+
+
+
+class SessionResumingPolicyTest(unittest.TestCase):
+    """
+    Tests for L{tls.SessionResumingPolicy}.
+    """
+
+    def setUp(self):
+        certificate = makeCertificate('localhost')
+        options = certificate.options()
+        self.port = reactor.listenSSL(0, server.Site(Hello()), options,
+                                      interface='127.0.0.1')
+        self.portNumber = self.port.getHost().port
+        self.policy = tls.SessionResumingPolicy(
+                            trustRoot=ssl.Certificate(certificate.original))
+
+        # Don't keep connections, to have a handshake for each request.
+        pool = client.HTTPConnectionPool(reactor, persistent=False)
+        self.agent = client.Agent(reactor, self.policy, pool=pool)
+
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+
+    def get(self, host='localhost'):
+        url = 'https://%s:%d/' % (host, self.portNumber)
+        d = self.agent.request('GET', url)
+        d.addCallback(client.readBody)
+        return d
+
+
+    def test_resume(self):
+        """
+        A second connection to the same host resumes the TLS session.
+        """
+        d = self.get()
+        d.addCallback(self.assertEqual, 'Hello')
+        d.addCallback(lambda _: self.get())
+        d.addCallback(self.assertEqual, 'Hello')
+
+        def check(_):
+            self.assertEqual({'handshakes': 2,
+                              'resumed': 1,
+                              'resumptionRate': 0.5},
+                             self.policy.stats())
+
+        d.addCallback(check)
+        return d
+
+
+    def test_resumeUnknown(self):
+        """
+        Without the OpenSSL binding to detect resumption, handshakes are
+        still counted, and resumption is reported as unknown.
+        """
+        self.patch(tls, '_SSL_session_reused', None)
+        d = self.get()
+        d.addCallback(lambda _: self.get())
+
+        def check(_):
+            self.assertEqual({'handshakes': 2,
+                              'resumed': None,
+                              'resumptionRate': None},
+                             self.policy.stats())
+
+        d.addCallback(check)
+        return d
+
+
+    def test_sharedContext(self):
+        """
+        All connections use the same context.
+        """
+        creator = self.policy.creatorForNetloc('localhost', self.portNumber)
+        first = creator.clientConnectionForTLS(None)
+        second = creator.clientConnectionForTLS(None)
+        self.assertIdentical(first.get_context(), second.get_context())
+
+
+    def test_hostnameMismatch(self):
+        """
+        Connections fail if the certificate does not match the host name.
+        """
+        d = self.get(host='127.0.0.1')
+        self.assertFailure(d, client.ResponseNeverReceived)
+
+        def check(_):
+            self.assertEqual(0, self.policy.stats()['handshakes'])
+
+        d.addCallback(check)
+        return d
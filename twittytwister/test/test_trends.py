@@ -0,0 +1,191 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.trends}.
+"""
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from twittytwister import streaming, trends
+
+def makeStatus(text, hashtags=None):
+    data = {'text': text}
+    if hashtags is not None:
+        data['entities'] = {'hashtags': [{'text': tag, 'indices': [0, 1]}
+                                         for tag in hashtags]}
+    return streaming.Status.fromDict(data)
+
+
+
+class CountMinSketchTest(unittest.TestCase):
+    """
+    Tests for L{trends.CountMinSketch}.
+    """
+
+    def test_estimateExact(self):
+        """
+        With few keys in a wide sketch, estimates are exact.
+        """
+        sketch = trends.CountMinSketch(width=1024, depth=4)
+        sketch.add(u'foo', 3)
+        sketch.add(u'bar')
+        self.assertEqual(3, sketch.estimate(u'foo'))
+        self.assertEqual(1, sketch.estimate(u'bar'))
+        self.assertEqual(0, sketch.estimate(u'baz'))
+
+
+    def test_neverUndercounts(self):
+        """
+        Collisions in a narrow sketch can only cause overestimates.
+        """
+        sketch = trends.CountMinSketch(width=8, depth=2)
+        for i in xrange(100):
+            sketch.add(u'key%d' % i, i)
+        for i in xrange(100):
+            self.assertTrue(sketch.estimate(u'key%d' % i) >= i)
+
+
+    def test_hashCollision(self):
+        """
+        Keys with the same built-in hash do not share their counters, as
+        each row hashes the key itself, with its own salt.
+        """
+        class Key(object):
+            def __init__(self, name):
+                self.name = name
+            def __hash__(self):
+                return 1
+            def __str__(self):
+                return self.name
+
+        sketch = trends.CountMinSketch(width=1024, depth=4)
+        sketch.add(Key('foo'), 5)
+        self.assertEqual(0, sketch.estimate(Key('bar')))
+
+
+    def test_clear(self):
+        sketch = trends.CountMinSketch(width=16, depth=2)
+        sketch.add(u'foo', 5)
+        sketch.clear()
+        self.assertEqual(0, sketch.estimate(u'foo'))
+
+
+
+class ExtractKeysTest(unittest.TestCase):
+    """
+    Tests for L{trends.extractKeys}.
+    """
+
+    def test_hashtagsFromEntities(self):
+        """
+        Hash tags are taken from the entities and prefixed with C{'#'}.
+        """
+        status = makeStatus(u'Hello #Twisted', hashtags=[u'Twisted'])
+        self.assertEqual([u'#twisted', u'hello'],
+                         trends.extractKeys(status))
+
+
+    def test_hashtagsFromText(self):
+        """
+        Without entities, hash tags are taken from the text.
+        """
+        status = makeStatus(u'Hello #Twisted')
+        self.assertEqual([u'hello', u'#twisted'],
+                         trends.extractKeys(status))
+
+
+    def test_skipped(self):
+        """
+        Links, mentions, numbers, short and stop words are not terms.
+        """
+        status = makeStatus(u'RT @ralphm: the 2012 talk http://t.co/x ok')
+        self.assertEqual([u'talk'], trends.extractKeys(status))
+
+
+    def test_noTerms(self):
+        status = makeStatus(u'Hello #Twisted', hashtags=[u'Twisted'])
+        self.assertEqual([u'#twisted'], trends.extractKeys(status, False))
+
+
+
+class TrendingAggregatorTest(unittest.TestCase):
+    """
+    Tests for L{trends.TrendingAggregator}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.aggregator = trends.TrendingAggregator(bucketSize=60,
+                                                    numBuckets=10,
+                                                    capacity=5,
+                                                    reactor=self.clock)
+
+
+    def test_top(self):
+        """
+        The most frequent keys are returned first, with their counts.
+        """
+        for i in xrange(3):
+            self.aggregator(makeStatus(u'twisted python', [u'tt']))
+        self.aggregator(makeStatus(u'python'))
+        self.assertEqual([(u'python', 4), (u'twisted', 3)],
+                         self.aggregator.top(2))
+
+
+    def test_topAcrossBuckets(self):
+        """
+        Counts from all buckets within the window are summed.
+        """
+        self.aggregator.add(u'foo', 2)
+        self.clock.advance(60)
+        self.aggregator.add(u'foo', 3)
+        self.aggregator.add(u'bar', 4)
+        self.assertEqual([(u'foo', 5), (u'bar', 4)],
+                         self.aggregator.top(window=120))
+
+
+    def test_windowExpiry(self):
+        """
+        Buckets older than the window are not counted.
+        """
+        self.aggregator.add(u'foo', 2)
+        self.clock.advance(120)
+        self.aggregator.add(u'bar', 1)
+        self.assertEqual([(u'bar', 1)], self.aggregator.top(window=60))
+
+
+    def test_bucketReuse(self):
+        """
+        When the ring wraps around, old counts are discarded.
+        """
+        self.aggregator.add(u'foo', 2)
+        self.clock.advance(600)
+        self.aggregator.add(u'bar', 1)
+        self.assertEqual([(u'bar', 1)], self.aggregator.top(window=600))
+
+
+    def test_capacity(self):
+        """
+        Only the heaviest candidates are kept per bucket.
+        """
+        for i in xrange(10):
+            self.aggregator.add(u'key%d' % i, i + 1)
+        self.aggregator.add(u'key9', 1)
+        result = self.aggregator.top(10)
+        self.assertEqual(5, len(result))
+        self.assertEqual((u'key9', 11), result[0])
+        self.assertEqual([u'key9', u'key8', u'key7', u'key6', u'key5'],
+                         [key for key, count in result])
+
+
+    def test_capacityInvalid(self):
+        """
+        Buckets need room for at least one candidate.
+        """
+        self.assertRaises(ValueError, trends.TrendingAggregator, capacity=0,
+                          reactor=self.clock)
+
+
+    def test_windowTooLarge(self):
+        self.assertRaises(ValueError, self.aggregator.top, window=601)
@@ -6,17 +6,638 @@ Tests for L{twittytwister.twitter}.
 """
 
 from twisted.internet import defer, task
+from twisted.internet import error as ierror
 from twisted.internet.error import ConnectError
 from twisted.python import failure
+from twisted.test import proto_helpers
 from twisted.trial import unittest
 from twisted.web import error as http_error
 from twisted.web.client import ResponseDone
 from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
 
-from twittytwister import twitter, streaming
+from twittytwister import cache, checkpoint, ratelimit, twitter, streaming
+from twittytwister import watchdog
 
 DELAY_INITIAL = twitter.TwitterMonitor.backOffs[None]['initial']
 
+USER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<user>
+  <id>70393696</id>
+  <name>ikDisplay</name>
+  <screen_name>ikdisplay</screen_name>
+</user>
+"""
+
+class FakeResponse(object):
+    """
+    A response as returned by L{FakeAgent}.
+    """
+
+    def __init__(self, code, body, headers=None):
+        self.code = code
+        self.phrase = 'Phrase'
+        self.headers = Headers(headers or {})
+        self.body = body
+
+
+    def deliverBody(self, protocol):
+        protocol.makeConnection(self)
+        protocol.dataReceived(self.body)
+        protocol.connectionLost(failure.Failure(ResponseDone()))
+
+
+    def stopProducing(self):
+        pass
+
+
+
+class FakeAgent(object):
+    """
+    Agent that records requests, to be answered using L{respond}.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        d = defer.Deferred()
+        self.requests.append((method, uri, headers, bodyProducer, d))
+        return d
+
+
+    def respond(self, body, code=200, headers=None, index=0):
+        method, uri, requestHeaders, bodyProducer, d = self.requests.pop(index)
+        d.callback(FakeResponse(code, body, headers))
+
+
+
+class TwitterTest(unittest.TestCase):
+    """
+    Tests for L{twitter.Twitter}.
+    """
+
+    def setUp(self):
+        self.restAgent = FakeAgent()
+        self.twitter = twitter.Twitter('user', 'secret',
+                                       base_url='http://api.example.org/1')
+        self.twitter.restAgent = self.restAgent
+
+
+    def test_pool(self):
+        """
+        REST requests use persistent connections from a connection pool.
+        """
+        twitterAPI = twitter.Twitter()
+        self.assertTrue(twitterAPI.pool.persistent)
+        self.assertEqual(twitter.Twitter.maxConnectionsPerHost,
+                         twitterAPI.pool.maxPersistentPerHost)
+        self.assertEqual(twitter.Twitter.idleTimeout,
+                         twitterAPI.pool.cachedConnectionTimeout)
+        self.assertIdentical(twitterAPI.pool, twitterAPI.restAgent._pool)
+
+
+    def test_statsTLS(self):
+        """
+        Statistics include the TLS handshakes of the shared HTTPS policy.
+        """
+        self.assertEqual({'handshakes': 0, 'resumed': 0,
+                          'resumptionRate': 0.0},
+                         self.twitter.stats()['tls'])
+
+
+    def test_showUser(self):
+        """
+        C{show_user} fetches and parses a user.
+        """
+        d = self.twitter.show_user('ikdisplay')
+        method, uri, headers, bodyProducer, _ = self.restAgent.requests[0]
+        self.assertEqual('GET', method)
+        self.assertEqual('http://api.example.org/1/users/show/ikdisplay.xml',
+                         uri)
+        self.assertEqual(['twitty twister'],
+                         headers.getRawHeaders('User-Agent'))
+        self.assertEqual(['Basic dXNlcjpzZWNyZXQ='],
+                         headers.getRawHeaders('Authorization'))
+
+        self.restAgent.respond(USER_XML)
+        d.addCallback(lambda user: self.assertEqual('ikdisplay',
+                                                    user.screen_name))
+        return d
+
+
+    def test_userAgentFeed(self):
+        """
+        REST requests of a L{twitter.TwitterFeed}, which keeps its streaming
+        agent in C{agent}, carry the User-Agent string.
+        """
+        feed = twitter.TwitterFeed(base_url='http://api.example.org/1')
+        feed.restAgent = self.restAgent
+        feed.userAgent = 'test agent'
+        feed.show_user('ikdisplay')
+        headers = self.restAgent.requests[0][2]
+        self.assertEqual(['test agent'], headers.getRawHeaders('User-Agent'))
+
+
+    def test_timeout(self):
+        """
+        Requests are cancelled after the timeout, using the reactor of the
+        client.
+        """
+        clock = task.Clock()
+        self.twitter.reactor = clock
+        self.twitter.timeout = 10
+        d = self.twitter.show_user('ikdisplay')
+        self.restAgent.requests[0][4].addErrback(lambda f: None)
+        clock.advance(10)
+        self.failureResultOf(d, ierror.TimeoutError)
+
+
+    def test_rateLimitHeaders(self):
+        """
+        Rate limit headers of responses are recorded.
+        """
+        self.twitter.verify_credentials(lambda user: None)
+        self.restAgent.respond(USER_XML, headers={
+            'X-RateLimit-Limit': ['350'],
+            'X-RateLimit-Remaining': ['349'],
+            'X-RateLimit-Reset': ['1277485629']})
+        self.assertEqual(350, self.twitter.rate_limit_limit)
+        self.assertEqual(349, self.twitter.rate_limit_remaining)
+        self.assertEqual(1277485629, self.twitter.rate_limit_reset)
+
+
+    def test_post(self):
+        """
+        POST requests send the urlencoded arguments and return the body.
+        """
+        d = self.twitter.follow('ikdisplay')
+        method, uri, headers, bodyProducer, _ = self.restAgent.requests[0]
+        self.assertEqual('POST', method)
+        self.assertEqual(
+            'http://api.example.org/1/friendships/create/ikdisplay.xml', uri)
+        self.assertEqual(0, bodyProducer.length)
+
+        self.restAgent.respond(USER_XML)
+        d.addCallback(self.assertEqual, USER_XML)
+        return d
+
+
+    def test_updateProfileImage(self):
+        """
+        Profile images are streamed from a file.
+        """
+        path = self.mktemp() + '.png'
+        open(path, 'wb').write('\x89PNG')
+        d = self.twitter.update_profile_image(path)
+        method, uri, headers, bodyProducer, _ = self.restAgent.requests[0]
+        self.assertEqual(
+            'http://api.example.org/1/account/update_profile_image.xml', uri)
+        self.assertEqual([bodyProducer.contentType],
+                         headers.getRawHeaders('Content-Type'))
+        self.assertTrue(bodyProducer.length > 4)
+
+        self.restAgent.respond(USER_XML)
+        self.successResultOf(d)
+        self.assertTrue(bodyProducer._parts[1].closed)
+
+
+    def test_httpError(self):
+        """
+        Non-2xx responses result in an L{http_error.Error}.
+        """
+        d = self.twitter.show_user('ikdisplay')
+        self.restAgent.respond('Not found', code=404)
+        self.assertFailure(d, http_error.Error)
+        d.addCallback(lambda e: self.assertEqual(('404', 'Not found'),
+                                                 (e.status, e.response)))
+        return d
+
+
+    def test_maxConnectionsPerHost(self):
+        """
+        Requests beyond the per-host limit wait for a free connection.
+        """
+        self.twitter.maxConnectionsPerHost = 2
+        for i in xrange(3):
+            self.twitter.show_user('user%d' % i)
+        self.assertEqual(2, len(self.restAgent.requests))
+        self.restAgent.respond(USER_XML)
+        self.assertEqual(2, len(self.restAgent.requests))
+        self.assertTrue(self.restAgent.requests[-1][1].endswith('user2.xml'))
+
+
+    def test_endpointFamily(self):
+        family = self.twitter._endpointFamily
+        self.assertEqual('statuses', family(
+            'http://api.example.org/1/statuses/home_timeline.xml?count=2'))
+        self.assertEqual('direct_messages',
+                         family('http://api.example.org/1/direct_messages.xml'))
+        self.assertEqual('search', family('http://search.example.org/search.atom'))
+
+
+    def test_rateLimitScheduler(self):
+        """
+        Requests wait when the rate limit of their endpoint family is used up.
+        """
+        clock = task.Clock()
+        self.twitter.scheduler = ratelimit.RateLimitScheduler(reactor=clock)
+        self.twitter.show_user('ikdisplay')
+        self.restAgent.respond(USER_XML, headers={
+            'X-RateLimit-Limit': ['350'],
+            'X-RateLimit-Remaining': ['0'],
+            'X-RateLimit-Reset': ['60']})
+
+        self.twitter.show_user('ralphm')
+        self.twitter.home_timeline(lambda status: None)
+        self.assertEqual(1, len(self.restAgent.requests))
+        self.assertIn('/statuses/', self.restAgent.requests[0][1])
+
+        stats = self.twitter.stats()['rateLimit']
+        self.assertEqual(1, stats['delayed'])
+        self.assertEqual((350, 0, 60),
+                         stats['budgets']['users', ('basic', 'user')])
+
+        clock.advance(60)
+        self.assertEqual(2, len(self.restAgent.requests))
+
+
+
+    def test_coalesceShowUser(self):
+        """
+        Concurrent identical requests share one download.
+        """
+        d1 = self.twitter.show_user('ikdisplay')
+        d2 = self.twitter.show_user('ikdisplay')
+        self.assertEqual(1, len(self.restAgent.requests))
+        self.assertEqual({'inFlight': 1, 'coalesced': 1},
+                         self.twitter.stats()['coalescing'])
+
+        self.restAgent.respond(USER_XML)
+        user1 = self.successResultOf(d1)
+        user2 = self.successResultOf(d2)
+        self.assertEqual('ikdisplay', user2.screen_name)
+        self.assertIdentical(user1, user2)
+        self.assertEqual(0, self.twitter.stats()['coalescing']['inFlight'])
+
+
+    def test_coalesceDelegates(self):
+        """
+        The delegates of coalesced requests are called with all items.
+        """
+        statuses1 = []
+        statuses2 = []
+        d1 = self.twitter.user_timeline(statuses1.append, 'ikdisplay')
+        d2 = self.twitter.user_timeline(statuses2.append, 'ikdisplay')
+        self.twitter.user_timeline(lambda status: None, 'ralphm')
+        self.assertEqual(2, len(self.restAgent.requests))
+
+        self.restAgent.respond("""<statuses>
+            <status><id>1</id><text>one</text></status>
+            <status><id>2</id><text>two</text></status>
+            </statuses>""")
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+        self.assertEqual(['one', 'two'], [s.text for s in statuses1])
+        self.assertEqual(['one', 'two'], [s.text for s in statuses2])
+
+
+    def test_coalesceError(self):
+        """
+        Errors are passed to all coalesced requests.
+        """
+        d1 = self.twitter.show_user('ikdisplay')
+        d2 = self.twitter.show_user('ikdisplay')
+        self.restAgent.respond('Not found', code=404)
+        self.failureResultOf(d1, http_error.Error)
+        self.failureResultOf(d2, http_error.Error)
+
+        self.twitter.show_user('ikdisplay')
+        self.assertEqual(1, len(self.restAgent.requests))
+
+
+    def test_lookupUser(self):
+        """
+        User lookups within the lookup window are batched in one request.
+        """
+        clock = task.Clock()
+        self.twitter.reactor = clock
+        d1 = self.twitter.lookup_user('ikdisplay')
+        d2 = self.twitter.lookup_user('RalphM')
+        d3 = self.twitter.lookup_user('nobody')
+        d4 = self.twitter.lookup_user(70393696)
+        self.assertEqual(0, len(self.restAgent.requests))
+
+        clock.advance(self.twitter.lookupWindow)
+        self.assertEqual(2, len(self.restAgent.requests))
+        uris = sorted([request[1] for request in self.restAgent.requests])
+        self.assertEqual(
+            ['http://api.example.org/1/users/lookup.xml?'
+             'screen_name=ikdisplay%2Cnobody%2Cralphm',
+             'http://api.example.org/1/users/lookup.xml?user_id=70393696'],
+            uris)
+
+        for i in xrange(2):
+            self.restAgent.respond("""<users>
+                <user><id>70393696</id><screen_name>ikdisplay</screen_name></user>
+                <user><id>1</id><screen_name>ralphm</screen_name></user>
+                </users>""")
+        self.assertEqual('ikdisplay', self.successResultOf(d1).screen_name)
+        self.assertEqual('ralphm', self.successResultOf(d2).screen_name)
+        self.assertEqual('404', self.failureResultOf(d3, http_error.Error)
+                                    .value.status)
+        self.assertEqual('ikdisplay', self.successResultOf(d4).screen_name)
+
+
+    def test_lookupUserBatchSize(self):
+        """
+        A full batch is requested without waiting for the window.
+        """
+        clock = task.Clock()
+        self.twitter.reactor = clock
+        self.twitter.lookupBatchSize = 2
+        self.twitter.lookup_user('a')
+        self.twitter.lookup_user('b')
+        self.assertEqual(1, len(self.restAgent.requests))
+        self.assertEqual([], clock.getDelayedCalls())
+
+
+    def test_lookupUserError(self):
+        clock = task.Clock()
+        self.twitter.reactor = clock
+        d = self.twitter.lookup_user('ikdisplay')
+        clock.advance(self.twitter.lookupWindow)
+        self.restAgent.respond('Oops', code=500)
+        self.assertEqual('500', self.failureResultOf(d, http_error.Error)
+                                    .value.status)
+
+
+    def test_walkCursor(self):
+        """
+        All pages are fetched, following the cursors.
+        """
+        ids = []
+        d = self.twitter.walk_cursor(self.twitter.followers_ids, ids.append,
+                                     args=('ikdisplay',))
+        self.assertTrue(self.restAgent.requests[0][1].endswith(
+                        '/followers/ids/ikdisplay.xml?cursor=-1'))
+        self.restAgent.respond("""<id_list><ids><id>1</id><id>2</id></ids>
+            <next_cursor>42</next_cursor>
+            <previous_cursor>0</previous_cursor></id_list>""")
+        self.assertTrue(self.restAgent.requests[0][1].endswith(
+                        '/followers/ids/ikdisplay.xml?cursor=42'))
+        self.restAgent.respond("""<id_list><ids><id>3</id></ids>
+            <next_cursor>0</next_cursor>
+            <previous_cursor>-42</previous_cursor></id_list>""")
+        self.assertEqual(3, self.successResultOf(d))
+        self.assertEqual(['1', '2', '3'], ids)
+
+
+    def test_jsonMode(self):
+        """
+        In JSON mode, the JSON variants of resources are parsed into the
+        model objects of L{streaming}.
+        """
+        twitterAPI = twitter.Twitter('user', 'secret',
+                                     base_url='http://api.example.org/1',
+                                     restFormat='json')
+        twitterAPI.restAgent = self.restAgent
+        statuses = []
+        d = twitterAPI.home_timeline(statuses.append)
+        self.assertEqual(
+            'http://api.example.org/1/statuses/home_timeline.json',
+            self.restAgent.requests[0][1])
+        self.restAgent.respond('[{"id": 1, "text": "Hello", '
+                               '"user": {"id": 2, "screen_name": "ralphm"}}]')
+        self.successResultOf(d)
+        self.assertIsInstance(statuses[0], streaming.Status)
+        self.assertEqual('ralphm', statuses[0].user.screen_name)
+
+
+    def test_jsonModeInvalid(self):
+        twitterAPI = twitter.Twitter('user', 'secret',
+                                     base_url='http://api.example.org/1',
+                                     restFormat='json')
+        twitterAPI.restAgent = self.restAgent
+        d = twitterAPI.show_user('ralphm')
+        self.restAgent.respond('{"id": ')
+        self.failureResultOf(d, ValueError)
+
+
+    def test_lookupUserJSON(self):
+        """
+        In JSON mode, where ids are integers, users looked up by id are
+        matched to their lookups.
+        """
+        clock = task.Clock()
+        twitterAPI = twitter.Twitter('user', 'secret',
+                                     base_url='http://api.example.org/1',
+                                     restFormat='json')
+        twitterAPI.restAgent = self.restAgent
+        twitterAPI.reactor = clock
+        d = twitterAPI.lookup_user(70393696)
+        clock.advance(twitterAPI.lookupWindow)
+        self.assertEqual(
+            'http://api.example.org/1/users/lookup.json?user_id=70393696',
+            self.restAgent.requests[0][1])
+        self.restAgent.respond('[{"id": 70393696, '
+                               '"screen_name": "ikdisplay"}]')
+        self.assertEqual('ikdisplay', self.successResultOf(d).screen_name)
+
+
+    def test_unknownFormat(self):
+        self.assertRaises(ValueError, twitter.Twitter, restFormat='yaml')
+
+
+    def test_update(self):
+        """
+        C{update} posts a status and fires with its id, taken from the
+        response as it arrives.
+        """
+        d = self.twitter.update(u'Hello')
+        method, uri, headers, bodyProducer, _ = self.restAgent.requests[0]
+        self.assertEqual('POST', method)
+        self.assertEqual('http://api.example.org/1/statuses/update.xml', uri)
+        self.restAgent.respond('<status><id>240859602684612608</id>'
+                               '<user><id>1</id></user></status>')
+        self.assertEqual(u'240859602684612608', self.successResultOf(d))
+
+
+    def test_updateJSON(self):
+        twitterAPI = twitter.Twitter('user', 'secret',
+                                     base_url='http://api.example.org/1',
+                                     restFormat='json')
+        twitterAPI.restAgent = self.restAgent
+        d = twitterAPI.update(u'Hello')
+        self.assertEqual('http://api.example.org/1/statuses/update.json',
+                         self.restAgent.requests[0][1])
+        self.restAgent.respond('{"id": 240859602684612608, '
+                               '"id_str": "240859602684612608"}')
+        self.assertEqual('240859602684612608', self.successResultOf(d))
+
+
+    def test_updateNoId(self):
+        d = self.twitter.update(u'Hello')
+        self.restAgent.respond('<status></status>')
+        self.failureResultOf(d, KeyError)
+
+
+    def test_extractPaths(self):
+        """
+        C{extract_paths} fetches a resource and fires with the values at
+        the given paths.
+        """
+        d = self.twitter.extract_paths('/users/show/ikdisplay.xml',
+                                       [('screen_name',), ('status', 'id')],
+                                       {'include_entities': 'false'})
+        self.assertEqual('http://api.example.org/1/users/show/ikdisplay.xml'
+                         '?include_entities=false',
+                         self.restAgent.requests[0][1])
+        self.restAgent.respond(USER_XML)
+        self.assertEqual({('screen_name',): u'ikdisplay'},
+                         self.successResultOf(d))
+
+
+class TwitterCacheTest(unittest.TestCase):
+    """
+    Tests for caching of GET requests by L{twitter.Twitter}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = cache.ResponseCache(reactor=self.clock)
+        self.restAgent = FakeAgent()
+        self.twitter = twitter.Twitter('user', 'secret',
+                                       base_url='http://api.example.org/1',
+                                       cache=self.cache)
+        self.twitter.restAgent = self.restAgent
+
+
+    def verify(self):
+        users = []
+        d = self.twitter.verify_credentials(users.append)
+        d.addCallback(lambda _: users)
+        return d
+
+
+    def test_hit(self):
+        """
+        A fresh cached response is delivered without a request.
+        """
+        d = self.verify()
+        self.restAgent.respond(USER_XML)
+        first = self.successResultOf(d)
+
+        second = self.successResultOf(self.verify())
+        self.assertEqual(0, len(self.restAgent.requests))
+        self.assertEqual(['ikdisplay'], [u.screen_name for u in second])
+        self.assertIdentical(first[0], second[0])
+        self.assertEqual(1, self.twitter.stats()['cache']['hits'])
+
+
+    def test_perUser(self):
+        """
+        Responses are cached per authenticated user.
+        """
+        self.verify()
+        self.restAgent.respond(USER_XML)
+        self.twitter.username = 'other'
+        self.verify()
+        self.assertEqual(1, len(self.restAgent.requests))
+
+
+    def test_uncached(self):
+        """
+        Endpoints without a TTL are not cached.
+        """
+        for i in xrange(2):
+            self.twitter.list_friends(lambda user: None)
+            self.restAgent.respond('<users></users>')
+        self.assertEqual(0, len(self.cache))
+
+
+    def test_expired(self):
+        """
+        Expired responses without validators are requested again.
+        """
+        self.verify()
+        self.restAgent.respond(USER_XML)
+        self.clock.advance(300)
+        self.verify()
+        self.assertEqual(1, len(self.restAgent.requests))
+        headers = self.restAgent.requests[0][2]
+        self.assertFalse(headers.hasHeader('If-None-Match'))
+
+
+    def test_notModified(self):
+        """
+        Expired responses are revalidated with a conditional request.
+        """
+        self.verify()
+        self.restAgent.respond(USER_XML, headers={'ETag': ['"v1"']})
+        self.clock.advance(300)
+
+        d = self.verify()
+        headers = self.restAgent.requests[0][2]
+        self.assertEqual(['"v1"'], headers.getRawHeaders('If-None-Match'))
+        self.restAgent.respond('', code=304)
+        users = self.successResultOf(d)
+        self.assertEqual(['ikdisplay'], [u.screen_name for u in users])
+        self.assertEqual(1, self.cache.revalidations)
+
+        self.verify()
+        self.assertEqual(0, len(self.restAgent.requests))
+
+
+    def test_modified(self):
+        """
+        A full response to a conditional request replaces the entry.
+        """
+        self.verify()
+        self.restAgent.respond(USER_XML, headers={'ETag': ['"v1"']})
+        self.clock.advance(300)
+
+        d = self.verify()
+        self.restAgent.respond(USER_XML.replace('ikdisplay', 'ralphm'),
+                               headers={'ETag': ['"v2"']})
+        users = self.successResultOf(d)
+        self.assertEqual(['ralphm'], [u.screen_name for u in users])
+        self.assertEqual(1, len(self.cache))
+        fresh, entry = self.cache.lookup(self.cache._entries.keys()[0])
+        self.assertEqual('"v2"', entry.etag)
+
+
+    def test_showUser(self):
+        d = self.twitter.show_user('ikdisplay')
+        self.restAgent.respond(USER_XML)
+        first = self.successResultOf(d)
+        d = self.twitter.show_user('ikdisplay')
+        self.assertIdentical(first, self.successResultOf(d))
+
+
+    def test_pagingCached(self):
+        """
+        Cursors of cached pages are passed to the page delegate again.
+        """
+        self.cache.ttls['list_friends'] = 60
+        pages = []
+        def get():
+            return self.twitter.list_friends(
+                lambda user: None, params={'cursor': '-1'},
+                page_delegate=lambda n, p: pages.append((n, p)))
+
+        get()
+        self.restAgent.respond("""<users_list><users></users>
+            <next_cursor>123</next_cursor>
+            <previous_cursor>0</previous_cursor></users_list>""")
+        get()
+        self.assertEqual(0, len(self.restAgent.requests))
+        self.assertEqual([('123', '0'), ('123', '0')], pages)
+
+
+
+
 class TwitterFeedTest(unittest.TestCase):
     """
     Tests for L{twitter.TwitterFeed):
@@ -67,6 +688,32 @@ class TwitterFeedTest(unittest.TestCase):
         self.assertEqual({'follow': '6253282'}, args)
 
 
+    def test_pull(self):
+        """
+        C{pull} returns a queue for the stream, that is closed when the
+        stream ends.
+        """
+        def filter(delegate, args):
+            self.calls.append((delegate, args))
+            protocol = streaming.TwitterStream(delegate)
+            protocol.makeConnection(proto_helpers.StringTransport())
+            return defer.succeed(protocol)
+
+        d = self.feed.pull(filter, {'track': 'twisted'}, size=1)
+        queue = self.successResultOf(d)
+        self.assertEqual([(queue, {'track': 'twisted'})], self.calls)
+        self.assertEqual(1, queue.size)
+
+        protocol = list(queue._producers)[0]
+        protocol.datagramReceived('{"text": "Hello"}')
+        self.assertTrue(protocol.paused)
+        self.assertEqual('Hello', self.successResultOf(queue.get()).text)
+        self.assertFalse(protocol.paused)
+
+        protocol.connectionLost(failure.Failure(ResponseDone()))
+        self.assertIdentical(None, self.successResultOf(queue.get()))
+
+
 
 class FakeTwitterProtocol(object):
     """
@@ -722,3 +1369,466 @@ class TwitterMonitorTest(unittest.TestCase):
         self.api.delegate(status)
 
         self.assertEqual(1, len(self.flushLoggedErrors(Error)))
+
+
+    def setUpHandover(self):
+        """
+        Set up a connected monitor in handover mode and start a handover to
+        new arguments.
+
+        @return: The protocol and delegate of the previous stream.
+        """
+        self.monitor.handover = True
+        self.setUpState('connected')
+        self.clock.advance(0)
+        previous = self.api.protocol, self.api.delegate
+
+        self.monitor.args = {'track': 'new'}
+        self.monitor.connect(forceReconnect=True)
+        return previous
+
+
+    def status(self, id):
+        return streaming.Status.fromDict({'id': id, 'text': u'Hello!'})
+
+
+    def test_handover(self):
+        """
+        In handover mode, a forced reconnect opens a new stream while the
+        current one stays connected.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        self.assertEqual(2, len(self.api.filterCalls))
+        self.assertEqual({'track': 'new'}, self.api.filterCalls[-1])
+        self.assertEqual('connected', self.monitor._state)
+
+        self.api.connected()
+        self.assertFalse(previousProtocol.stopCalled)
+        self.assertIdentical(previousProtocol, self.monitor.protocol)
+
+        status = self.status(1)
+        previousDelegate(status)
+        self.assertEqual([status], self.entries)
+        self.monitor.stopService()
+
+
+    def test_handoverSwitch(self):
+        """
+        When the new stream delivers its first entry, delivery switches to
+        it and the previous stream is closed.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        self.api.connected()
+
+        status = self.status(1)
+        self.api.delegate(status)
+        self.assertEqual([status], self.entries)
+        self.assertTrue(previousProtocol.stopCalled)
+        self.assertIdentical(self.api.protocol, self.monitor.protocol)
+
+        # Entries of the previous stream are dropped from now on.
+        previousDelegate(self.status(2))
+        self.assertEqual([status], self.entries)
+
+        # Closing the previous stream does not cause a reconnect.
+        previousProtocol.connectionLost(failure.Failure(ResponseDone()))
+        self.assertEqual('connected', self.monitor._state)
+        self.assertEqual(2, len(self.api.filterCalls))
+
+
+    def test_handoverDuplicates(self):
+        """
+        Entries delivered by both streams are passed on once.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        self.api.connected()
+
+        previousDelegate(self.status(1))
+        previousDelegate(self.status(2))
+        self.api.delegate(self.status(2))
+        self.api.delegate(self.status(3))
+        self.api.delegate(self.status(1))
+        self.assertEqual([1, 2, 3], [entry.id for entry in self.entries])
+
+
+    def test_handoverTimeout(self):
+        """
+        If the new stream delivers nothing, delivery switches to it after
+        the handover timeout.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        self.api.connected()
+
+        self.clock.advance(self.monitor.handoverTimeout - 1)
+        self.assertFalse(previousProtocol.stopCalled)
+        self.clock.advance(1)
+        self.assertTrue(previousProtocol.stopCalled)
+        self.assertIdentical(self.api.protocol, self.monitor.protocol)
+
+
+    def test_handoverPreviousClosed(self):
+        """
+        If the previous stream is closed before the new one is connected,
+        the new stream takes over once connected, without a reconnect.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        previousProtocol.connectionLost(failure.Failure(ResponseDone()))
+        self.assertEqual('connected', self.monitor._state)
+
+        self.api.connected()
+        self.assertIdentical(self.api.protocol, self.monitor.protocol)
+        self.assertEqual(2, len(self.api.filterCalls))
+
+        # From now on, losing the new stream causes a reconnect.
+        self.api.protocol.connectionLost(failure.Failure(ResponseDone()))
+        self.assertEqual('waiting', self.monitor._state)
+        self.clock.advance(DELAY_INITIAL)
+        self.assertEqual(3, len(self.api.filterCalls))
+
+
+    def test_handoverFailed(self):
+        """
+        If the new stream cannot be opened, the current one is kept.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        self.api.connectFail(failure.Failure(http_error.Error(401)))
+        self.assertEqual(1, len(self.flushLoggedErrors(http_error.Error)))
+
+        self.assertEqual('connected', self.monitor._state)
+        self.assertIdentical(previousProtocol, self.monitor.protocol)
+        self.assertFalse(previousProtocol.stopCalled)
+        status = self.status(1)
+        previousDelegate(status)
+        self.assertEqual([status], self.entries)
+
+
+    def test_handoverFailedPreviousClosed(self):
+        """
+        If the new stream cannot be opened after the previous one was
+        closed, the monitor reconnects.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        previousProtocol.connectionLost(failure.Failure(ResponseDone()))
+        self.api.connectFail(failure.Failure(http_error.Error(401)))
+        self.assertEqual(1, len(self.flushLoggedErrors(http_error.Error)))
+        self.assertEqual('waiting', self.monitor._state)
+        self.clock.advance(self.monitor.backOffs['http']['initial'])
+        self.assertEqual(3, len(self.api.filterCalls))
+
+
+    def test_handoverStopService(self):
+        """
+        Stopping the service during a handover closes both streams.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        self.api.connected()
+        self.monitor.stopService()
+        self.assertTrue(previousProtocol.stopCalled)
+        self.assertTrue(self.api.protocol.stopCalled)
+
+
+    def test_handoverAgain(self):
+        """
+        A new handover abandons a pending one.
+        """
+        previousProtocol, previousDelegate = self.setUpHandover()
+        self.api.connected()
+        pendingProtocol = self.api.protocol
+
+        self.monitor.connect(forceReconnect=True)
+        self.assertTrue(pendingProtocol.stopCalled)
+        self.assertFalse(previousProtocol.stopCalled)
+        self.api.connected()
+        self.api.delegate(self.status(1))
+        self.assertTrue(previousProtocol.stopCalled)
+        self.assertIdentical(self.api.protocol, self.monitor.protocol)
+
+
+    def setUpBackfill(self):
+        """
+        Set up a connected monitor with backfill, that delivered a status
+        before being disconnected and connected again.
+
+        @return: The list of backfill calls, as tuples of the arguments and
+            deferred.
+        """
+        calls = []
+        def backfill(args, sinceId):
+            d = defer.Deferred()
+            calls.append((args, sinceId, d))
+            return d
+
+        self.monitor.backfill = backfill
+        self.monitor.args = {'track': 'foo'}
+        self.setUpState('connected')
+        self.api.delegate(self.status(1))
+        self.api.protocol.connectionLost(failure.Failure(ResponseDone()))
+        self.clock.advance(DELAY_INITIAL)
+        self.api.connected()
+        return calls
+
+
+    def test_backfill(self):
+        """
+        After a reconnect, the statuses since the last delivered one are
+        fetched, and merged with the new entries in id order.
+        """
+        calls = self.setUpBackfill()
+        self.assertEqual(1, self.monitor.lastId)
+        self.assertEqual(1, len(calls))
+        args, sinceId, d = calls[0]
+        self.assertEqual(({'track': 'foo'}, 1), (args, sinceId))
+
+        self.api.delegate(self.status(4))
+        self.api.delegate(self.status(3))
+        self.assertEqual([1], [entry.id for entry in self.entries])
+
+        self.clock.advance(2)
+        d.callback([self.status(3), self.status(2), self.status(1)])
+        self.assertEqual([1, 2, 3, 4], [entry.id for entry in self.entries])
+        self.assertEqual(4, self.monitor.lastId)
+        self.assertEqual({'sinceId': 1, 'gap': DELAY_INITIAL, 'fetched': 2,
+                          'recovered': 1, 'buffered': 2, 'duration': 2},
+                         self.monitor.lastBackfill)
+
+        self.api.delegate(self.status(5))
+        self.assertEqual(5, self.entries[-1].id)
+        self.monitor.stopService()
+
+
+    def test_backfillInitial(self):
+        """
+        Without a delivered status, there is no backfill.
+        """
+        self.monitor.backfill = lambda args, sinceId: self.fail("Called")
+        self.setUpState('connected')
+        self.monitor.stopService()
+
+
+    def test_backfillFailed(self):
+        """
+        If the backfill fails, the entries held back are passed on.
+        """
+        calls = self.setUpBackfill()
+        self.api.delegate(self.status(4))
+        calls[0][2].errback(ValueError())
+        self.assertEqual(1, len(self.flushLoggedErrors(ValueError)))
+        self.assertEqual([1, 4], [entry.id for entry in self.entries])
+        self.monitor.stopService()
+
+
+    def test_backfillStopService(self):
+        """
+        Stopping the service passes on the entries held back, and ignores
+        the result of the backfill.
+        """
+        calls = self.setUpBackfill()
+        self.api.delegate(self.status(4))
+        self.monitor.stopService()
+        self.assertEqual([1, 4], [entry.id for entry in self.entries])
+        calls[0][2].callback([self.status(2)])
+        self.assertEqual([1, 4], [entry.id for entry in self.entries])
+        self.assertIdentical(None, self.monitor.lastBackfill)
+
+
+    def test_checkpointRestore(self):
+        """
+        On start, the last id, arguments and back-off state are restored
+        from the checkpoint store.
+        """
+        store = checkpoint.FileCheckpointStore(self.mktemp())
+        store.save('monitor', {'lastId': 5, 'args': {'track': 'foo'},
+                               'errorState': 'http', 'delay': 20})
+        self.monitor.checkpointStore = store
+        self.monitor.delegate = self.onEntry
+        self.monitor.startService()
+
+        self.assertEqual(5, self.monitor.lastId)
+        self.assertEqual([{'track': 'foo'}], self.api.filterCalls)
+        self.api.connectFail(failure.Failure(http_error.Error(500)))
+        self.flushLoggedErrors(http_error.Error)
+        self.assertEqual(40, self.monitor._delay)
+        self.monitor.stopService()
+
+
+    def test_checkpointKeepsArgs(self):
+        """
+        Arguments that were set are not replaced by the checkpoint.
+        """
+        store = checkpoint.FileCheckpointStore(self.mktemp())
+        store.save('monitor', {'lastId': 5, 'args': {'track': 'foo'}})
+        self.monitor.checkpointStore = store
+        self.monitor.args = {'track': 'bar'}
+        self.setUpState('connected')
+        self.assertEqual([{'track': 'bar'}], self.api.filterCalls)
+        self.monitor.stopService()
+
+
+    def test_checkpointSave(self):
+        """
+        The state is saved periodically and when the service stops.
+        """
+        path = self.mktemp()
+        self.monitor.checkpointStore = checkpoint.FileCheckpointStore(path)
+        self.monitor.setName('filter')
+        self.monitor.args = {'track': 'foo'}
+        self.setUpState('connected')
+        self.api.delegate(self.status(7))
+        self.clock.advance(self.monitor.checkpointInterval)
+        self.assertEqual(7, checkpoint.FileCheckpointStore(path).load(
+            'filter')['lastId'])
+
+        self.api.delegate(self.status(8))
+        self.monitor.stopService()
+        self.assertEqual({'lastId': 8, 'args': {'track': 'foo'},
+                          'errorState': None, 'delay': None},
+                         checkpoint.FileCheckpointStore(path).load('filter'))
+
+
+    def test_watchdog(self):
+        """
+        The watchdog watches the current stream, and a stall forces a
+        reconnect.
+        """
+        self.monitor.watchdog = watchdog.StreamWatchdog(self.clock)
+        self.setUpState('connected')
+        protocol = self.api.protocol
+        self.assertIdentical(protocol, self.monitor.watchdog.protocol)
+
+        self.clock.advance(80)
+        self.assertEqual('disconnecting', self.monitor._state)
+        self.assertTrue(protocol.stopCalled)
+        self.assertEqual(1, self.monitor.watchdog.stalls)
+
+        protocol.connectionLost(failure.Failure(ResponseDone()))
+        self.clock.advance(DELAY_INITIAL)
+        self.api.connected()
+        self.assertIdentical(self.api.protocol,
+                             self.monitor.watchdog.protocol)
+        self.monitor.stopService()
+        self.assertIdentical(None, self.monitor.watchdog.protocol)
+
+
+    def test_watchdogHandover(self):
+        """
+        In handover mode, the watchdog follows the new stream.
+        """
+        self.monitor.watchdog = watchdog.StreamWatchdog(self.clock)
+        self.monitor.handover = True
+        self.setUpState('connected')
+        self.clock.advance(80)
+        self.assertEqual(2, len(self.api.filterCalls))
+        self.assertEqual('connected', self.monitor._state)
+
+        self.api.connected()
+        self.api.delegate(self.status(1))
+        self.assertIdentical(self.api.protocol,
+                             self.monitor.watchdog.protocol)
+        self.monitor.stopService()
+
+
+    def test_registerProducer(self):
+        """
+        A delegate that takes producers gets the current stream registered,
+        and unregistered when it is lost.
+        """
+        events = []
+        class Delegate(object):
+            def __call__(self, entry):
+                pass
+            def registerProducer(self, producer):
+                events.append(('register', producer))
+            def unregisterProducer(self, producer):
+                events.append(('unregister', producer))
+
+        self.monitor.delegate = Delegate()
+        self.setUpState('connected')
+        protocol = self.api.protocol
+        self.assertEqual([('register', protocol)], events)
+
+        protocol.connectionLost(failure.Failure(ResponseDone()))
+        self.assertEqual([('register', protocol), ('unregister', protocol)],
+                         events)
+        self.monitor.stopService()
+
+
+    def setUpJitter(self, jitter):
+        """
+        Set up jitter for HTTP errors, with a random source that returns
+        the upper bound.
+        """
+        backOffs = dict(self.monitor.backOffs)
+        backOffs['http'] = dict(backOffs['http'], jitter=jitter)
+        self.monitor.backOffs = backOffs
+        bounds = []
+        class FakeRandom(object):
+            def uniform(self, low, high):
+                bounds.append((low, high))
+                return high
+        self.monitor.random = FakeRandom()
+        return bounds
+
+
+    def failHTTP(self):
+        self.api.connectFail(failure.Failure(http_error.Error(500)))
+        self.flushLoggedErrors(http_error.Error)
+
+
+    def test_fullJitter(self):
+        """
+        With full jitter, the monitor waits a random time up to the delay.
+        """
+        bounds = self.setUpJitter('full')
+        self.setUpState('connecting')
+        self.failHTTP()
+        self.clock.advance(10)
+        self.failHTTP()
+        self.assertEqual([(0, 10), (0, 20)], bounds)
+        self.assertEqual(20, self.monitor._wait)
+        self.monitor.stopService()
+
+
+    def test_decorrelatedJitter(self):
+        """
+        With decorrelated jitter, the monitor waits a random time between
+        the initial delay and a multiple of the previous wait.
+        """
+        bounds = self.setUpJitter('decorrelated')
+        self.setUpState('connecting')
+        self.failHTTP()
+        self.clock.advance(20)
+        self.failHTTP()
+        self.clock.advance(40)
+        self.failHTTP()
+        self.clock.advance(80)
+        self.failHTTP()
+        self.assertEqual([(10, 20), (10, 40), (10, 80), (10, 160)], bounds)
+        self.assertEqual(160, self.monitor._wait)
+        self.clock.advance(160)
+        self.failHTTP()
+        self.assertEqual(240, self.monitor._wait)
+        self.monitor.stopService()
+
+
+    def test_metrics(self):
+        """
+        Time in states, reconnects per error state and times to connect
+        are recorded.
+        """
+        self.setUpState('connecting')
+        self.clock.advance(1)
+        self.failHTTP()
+        self.clock.advance(10)
+        self.clock.advance(1)
+        self.api.connected()
+        self.clock.advance(30)
+
+        snapshot = self.monitor.snapshot()
+        self.assertEqual('connected', snapshot['state'])
+        self.assertEqual(30, snapshot['stateTimes']['connected'])
+        self.assertEqual(10, snapshot['stateTimes']['waiting'])
+        self.assertEqual(2, snapshot['stateTimes']['connecting'])
+        self.assertEqual({'http': 1}, snapshot['errorStates'])
+        self.assertEqual(1, snapshot['backOffDelays']['count'])
+        self.assertEqual(12, snapshot['connectLatency']['sum'])
+        self.monitor.stopService()
@@ -0,0 +1,345 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.txml}.
+"""
+
+from twisted.trial import unittest
+
+from twittytwister import txml
+
+STATUSES_XML = u"""<?xml version="1.0" encoding="UTF-8"?>
+<statuses type="array">
+<status>
+  <id>1</id>
+  <text>Hello w\xf6rld &amp; \u2603</text>
+  <user><id>2</id><screen_name>ralphm</screen_name></user>
+</status>
+</statuses>
+""".encode('utf-8')
+
+class ParserTest(unittest.TestCase):
+    """
+    Tests for L{txml.Parser}.
+    """
+
+    def parse(self, chunkSize):
+        statuses = []
+        parser = txml.Statuses(statuses.append)
+        for i in xrange(0, len(STATUSES_XML), chunkSize):
+            parser.write(STATUSES_XML[i:i + chunkSize])
+        parser.close()
+        return statuses
+
+
+    def test_statuses(self):
+        statuses = self.parse(len(STATUSES_XML))
+        self.assertEqual(1, len(statuses))
+        self.assertEqual(u'Hello w\xf6rld &amp; \u2603', statuses[0].text)
+        self.assertEqual(u'ralphm', statuses[0].user.screen_name)
+
+
+    def test_splitCharacters(self):
+        """
+        Multi-byte characters split across writes are decoded.
+        """
+        for chunkSize in (1, 2, 3, 5):
+            statuses = self.parse(chunkSize)
+            self.assertEqual(u'Hello w\xf6rld &amp; \u2603', statuses[0].text)
+
+
+
+TRICKY_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<statuses type="array">
+<status>
+  <id>2</id>
+  <text>&lt;b&gt; &amp; &quot;q&quot; &apos;a&apos; &#233;&#x41; &nbsp; \xc3\xa9 > y<![CDATA[cd]]><![CDATA[&]]></text>
+  <unknown><id>99</id></unknown>
+  <source>&lt;a href=&quot;http://example.org/&quot;&gt;web&lt;/a&gt;</source>
+  <user>
+    <id>3</id>
+    <screen_name>ikdisplay</screen_name>
+    <description>Line 1
+Line 2</description>
+  </user>
+  <retweeted_status>
+    <id>1</id>
+    <text>RT &#8220;x&#8221;</text>
+    <user><id>2</id><screen_name>ralphm</screen_name></user>
+  </retweeted_status>
+</status>
+</statuses>
+"""
+
+USERS_PAGE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<users_list>
+<users>
+<user><id>1</id><name>Ralph M\xc3\xa9ijer</name><screen_name>ralphm</screen_name>
+<status><id>10</id><text>Hi &amp; bye</text></status></user>
+<user><id>2</id><name>ikDisplay</name><screen_name>ikdisplay</screen_name></user>
+</users>
+<next_cursor>1300794057949944903</next_cursor>
+<previous_cursor>0</previous_cursor>
+</users_list>
+"""
+
+def toData(value):
+    """
+    Convert parsed objects into comparable data.
+    """
+    if isinstance(value, txml.BaseXMLHandler):
+        return (value.__class__, dict([(k, toData(v))
+                                       for k, v in value.asDict().iteritems()]))
+    return value
+
+
+
+class BackendTest(unittest.TestCase):
+    """
+    Tests that L{txml.ExpatParser} and L{txml.SuxParser} give the same
+    results.
+    """
+
+    def parse(self, parserClass, parse, document, chunkSize):
+        self.patch(txml, 'Parser', parserClass)
+        results = []
+        parser = parse(results)
+        for i in xrange(0, len(document), chunkSize):
+            parser.write(document[i:i + chunkSize])
+        parser.close()
+        return [toData(result) for result in results]
+
+
+    def assertSameResults(self, parse, document):
+        expected = self.parse(txml.SuxParser, parse, document, len(document))
+        self.assertNotEqual([], expected)
+        for chunkSize in (1, 3, 7, 4096):
+            self.assertEqual(expected, self.parse(txml.ExpatParser, parse,
+                                                  document, chunkSize))
+        return expected
+
+
+    def test_default(self):
+        """
+        Sux stays the default parser, expat is only used when asked for.
+        """
+        self.assertIdentical(txml.SuxParser, txml.Parser)
+
+
+    def test_selectParser(self):
+        """
+        The parser factories take the parser class as an argument.
+        """
+        self.assertIsInstance(
+            txml.Statuses(lambda status: None, parser=txml.ExpatParser),
+            txml.ExpatParser)
+        self.assertIsInstance(
+            txml.PagedUserList.pagingParser(lambda user: None,
+                                            lambda page: None,
+                                            parser=txml.ExpatParser),
+            txml.ExpatParser)
+        self.assertIsInstance(
+            txml.PagedIDList.noPagingParser(lambda id: None,
+                                            parser=txml.ExpatParser),
+            txml.ExpatParser)
+        self.assertIsInstance(txml.Users(lambda user: None), txml.SuxParser)
+
+
+    def test_statuses(self):
+        results = self.assertSameResults(
+            lambda results: txml.Statuses(results.append), TRICKY_XML)
+        self.assertEqual(u'&lt;b&gt; &amp; "q" a &#233;&#x41;  \xe9 > ycd&',
+                         results[0][1]['text'])
+
+
+    def test_paging(self):
+        def parse(results):
+            return txml.PagedUserList.pagingParser(results.append,
+                                                   results.append)
+        results = self.assertSameResults(parse, USERS_PAGE_XML)
+        self.assertEqual(3, len(results))
+
+
+    def test_ids(self):
+        document = '<ids><id>1</id><id>2</id></ids>'
+        self.assertEqual([u'1', u'2'], self.assertSameResults(
+            lambda results: txml.PagedIDList.noPagingParser(results.append),
+            document))
+
+
+    def test_incomplete(self):
+        """
+        Incomplete documents do not raise an error.
+        """
+        parser = txml.ExpatParser(txml.StatusList(None))
+        parser.write(TRICKY_XML[:100])
+        parser.close()
+
+
+
+class HandlerTest(unittest.TestCase):
+    """
+    Tests for the parsed objects.
+    """
+
+    def parse(self, document):
+        statuses = []
+        parser = txml.Statuses(statuses.append)
+        parser.write(document)
+        parser.close()
+        return statuses
+
+
+    def test_slots(self):
+        """
+        Statuses, users and direct messages keep their fields in slots.
+        """
+        for klass in (txml.Status, txml.RetweetedStatus, txml.User,
+                      txml.SenderUser, txml.DirectMessage):
+            self.assertFalse(hasattr(klass('tag'), '__dict__'), klass)
+        self.assertIn('retweeted_status', txml.Status.__slots__)
+        self.assertIn('user', txml.Status.__slots__)
+        self.assertEqual((), txml.RetweetedStatus.__slots__)
+
+
+    def test_compiled(self):
+        """
+        The dispatch tables of the predefined handlers are built when the
+        module is imported, with the classes of their forward properties.
+        """
+        for klass in (txml.Status, txml.RetweetedStatus, txml.User,
+                      txml.DirectMessage, txml.UserListPage):
+            self.assertIn('_handlers', klass.__dict__, klass)
+        self.assertIdentical(txml.User, txml.Status._handlers['user'])
+        self.assertIdentical(txml.RetweetedStatus,
+                             txml.Status._handlers['retweeted_status'])
+        self.assertIdentical(txml.User,
+                             txml.RetweetedStatus._handlers['user'])
+
+        class Tweet(txml.Status):
+            MY_TAG = 'tweet'
+            SIMPLE_PROPS = txml.Status.SIMPLE_PROPS + ['lang']
+
+        self.assertIn('lang', Tweet._fields)
+        self.assertIn('user', Tweet._fields)
+
+
+    def test_missingFields(self):
+        """
+        Known fields that are not in the document are C{None}.
+        """
+        status = self.parse(STATUSES_XML)[0]
+        self.assertEqual(u'1', status.id)
+        self.assertIdentical(None, status.source)
+        self.assertIdentical(None, status.retweeted_status)
+        self.assertIdentical(None, status.user.location)
+        self.assertRaises(AttributeError, getattr, status, 'unknown')
+
+
+    def test_nested(self):
+        status = self.parse(TRICKY_XML)[0]
+        self.assertIsInstance(status.retweeted_status, txml.RetweetedStatus)
+        self.assertEqual(u'ralphm', status.retweeted_status.user.screen_name)
+        self.assertEqual(u'ikdisplay', status.user.screen_name)
+
+
+    def test_asDict(self):
+        status = self.parse(STATUSES_XML)[0]
+        fields = status.asDict()
+        self.assertEqual(set(txml.Status.SIMPLE_PROPS +
+                             ['retweeted_status', 'user']),
+                         set(fields))
+        self.assertIdentical(status.user, fields['user'])
+        self.assertIn("'id': u'1'", repr(status))
+
+
+    def test_entryLinks(self):
+        """
+        Links of feed entries are stored by their relation.
+        """
+        entries = []
+        parser = txml.Feed(entries.append)
+        parser.write('<feed><entry><id>1</id><title>t</title>'
+                     '<link rel="alternate" href="http://example.org/1"/>'
+                     '<twitter:lang>en</twitter:lang></entry></feed>')
+        parser.close()
+        self.assertEqual(u'http://example.org/1', entries[0].alternate)
+        self.assertEqual(u'en', entries[0].twitter_lang)
+        self.assertIdentical(None, entries[0].link)
+
+
+
+class PathExtractorTest(unittest.TestCase):
+    """
+    Tests for L{txml.PathExtractor}.
+    """
+
+    def extract(self, paths, document, chunkSize=None):
+        results = []
+        extractor = txml.PathExtractor(paths, results.append)
+        chunkSize = chunkSize or len(document)
+        for i in xrange(0, len(document), chunkSize):
+            extractor.write(document[i:i + chunkSize])
+        extractor.close()
+        self.assertEqual(1, len(results))
+        return results[0]
+
+
+    def test_paths(self):
+        """
+        The text of the first element at each path is extracted, skipping
+        other elements with the same name.
+        """
+        paths = [('status', 'id'), ('status', 'user', 'screen_name'),
+                 ('status', 'retweeted_status', 'user', 'screen_name'),
+                 ('status', 'text')]
+        for chunkSize in (1, 5, None):
+            self.assertEqual({('status', 'id'): u'2',
+                              ('status', 'user', 'screen_name'): u'ikdisplay',
+                              ('status', 'retweeted_status', 'user',
+                               'screen_name'): u'ralphm',
+                              ('status', 'text'):
+                                  u'<b> & "q" \'a\' \xe9A \xa0 \xe9 > ycd&'},
+                             self.extract(paths, TRICKY_XML.replace(
+                                 '&nbsp;', '&#160;'), chunkSize))
+
+
+    def test_missing(self):
+        """
+        Paths that are not in the document are left out.
+        """
+        self.assertEqual({('status', 'id'): u'1'},
+                         self.extract([('status', 'id'), ('status', 'geo'),
+                                       ('status', 'user', 'geo')],
+                                      STATUSES_XML))
+
+
+    def test_stopsWhenFound(self):
+        """
+        Once all paths are found, the rest of the document is not parsed.
+        """
+        document = '<status><id>1</id><text>a</text><oops></status>'
+        self.assertEqual({('id',): u'1'}, self.extract([('id',)], document))
+
+
+    def test_incomplete(self):
+        """
+        The delegate gets the paths found in an incomplete document.
+        """
+        self.assertEqual({('id',): u'1'},
+                         self.extract([('id',), ('text',)],
+                                      '<status><id>1</id><te'))
+
+
+    def test_parseUpdateResponse(self):
+        self.assertEqual(u'3', txml.parseUpdateResponse(
+            '<status><user><id>2</id></user><id>3</id></status>'))
+
+
+    def test_updateResponse(self):
+        ids = []
+        parser = txml.UpdateResponse(ids.append)
+        parser.write(STATUSES_XML.replace('<statuses type="array">', '')
+                                 .replace('</statuses>', ''))
+        parser.close()
+        self.assertEqual([u'1'], ids)
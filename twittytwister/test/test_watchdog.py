@@ -0,0 +1,196 @@
+# See LICENSE.txt for details
+
+"""
+Tests for L{twittytwister.watchdog}.
+"""
+
+import time
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from twittytwister import watchdog
+
+def createdAt(seconds):
+    return time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(seconds))
+
+
+
+class FakeStream(object):
+    """
+    Stream with the counters of L{twittytwister.streaming.TwitterStream}.
+    """
+
+    datagrams = 0
+    keepAlives = 0
+    lastCreatedAt = None
+
+
+
+class ParseCreatedAtTest(unittest.TestCase):
+    """
+    Tests for L{watchdog.parseCreatedAt}.
+    """
+
+    def test_parse(self):
+        self.assertEqual(1291635993,
+                         watchdog.parseCreatedAt(
+                             'Mon Dec 06 11:46:33 +0000 2010'))
+
+
+    def test_offset(self):
+        self.assertEqual(1291635993 - 5400,
+                         watchdog.parseCreatedAt(
+                             'Mon Dec 06 11:46:33 +0130 2010'))
+        self.assertEqual(1291635993 + 3600,
+                         watchdog.parseCreatedAt(
+                             'Mon Dec 06 11:46:33 -0100 2010'))
+
+
+    def test_invalid(self):
+        self.assertIdentical(None, watchdog.parseCreatedAt(None))
+        self.assertIdentical(None, watchdog.parseCreatedAt('yesterday'))
+
+
+
+class EWMATest(unittest.TestCase):
+    """
+    Tests for L{watchdog.EWMA}.
+    """
+
+    def test_update(self):
+        average = watchdog.EWMA(0.5)
+        self.assertIdentical(None, average.value)
+        average.update(4)
+        self.assertEqual((4, 0), (average.value, average.deviation))
+        average.update(8)
+        self.assertEqual((6, 2), (average.value, average.deviation))
+
+
+
+class StreamWatchdogTest(unittest.TestCase):
+    """
+    Tests for L{watchdog.StreamWatchdog}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.watchdog = watchdog.StreamWatchdog(self.clock)
+        self.stream = FakeStream()
+        self.reasons = []
+        self.watchdog.watch(self.stream, self.reasons.append)
+
+
+    def tearDown(self):
+        self.watchdog.unwatch()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
+    def feed(self, seconds, rate=0, keepAliveInterval=None, lag=0):
+        """
+        Feed the stream for some seconds, sampling every second.
+        """
+        for i in xrange(seconds):
+            now = self.clock.seconds() + 1
+            self.stream.datagrams += rate
+            if rate:
+                self.stream.lastCreatedAt = createdAt(now - lag)
+            if keepAliveInterval and now % keepAliveInterval == 0:
+                self.stream.keepAlives += 1
+            self.clock.advance(1)
+            if self.reasons:
+                return
+
+
+    def test_silence(self):
+        """
+        A stream without any data is flagged after the default keep-alive
+        timeout.
+        """
+        self.feed(75)
+        self.assertEqual([], self.reasons)
+        self.feed(5)
+        self.assertEqual(["Nothing received for 80 seconds"], self.reasons)
+        self.assertIdentical(None, self.watchdog.protocol)
+        self.assertEqual(1, self.watchdog.stalls)
+
+
+    def test_keepAliveInterval(self):
+        """
+        The timeout for silence follows the learned keep-alive interval.
+        """
+        self.feed(60, keepAliveInterval=10)
+        self.assertEqual(10, self.watchdog.keepAliveInterval.value)
+        self.feed(30)
+        self.assertEqual(["Nothing received for 30 seconds"], self.reasons)
+
+
+    def test_stall(self):
+        """
+        A busy stream that only sends keep-alives is flagged.
+        """
+        self.feed(60, rate=2, keepAliveInterval=10)
+        self.assertEqual(30, self.watchdog.silenceThreshold())
+        self.feed(60, keepAliveInterval=10)
+        self.assertEqual(1, len(self.reasons))
+        self.assertTrue(self.reasons[0].startswith(
+            "No statuses for 35 seconds"))
+
+
+    def test_quietStream(self):
+        """
+        A quiet stream gets more time without statuses.
+        """
+        for i in xrange(10):
+            self.stream.datagrams += 1
+            self.feed(100, keepAliveInterval=10)
+        self.assertEqual([], self.reasons)
+        self.assertTrue(self.watchdog.silenceThreshold() > 600)
+
+
+    def test_rateDrop(self):
+        """
+        A stream that trickles is flagged.
+        """
+        self.feed(60, rate=20, keepAliveInterval=10)
+        self.feed(60, rate=1, keepAliveInterval=10)
+        self.assertEqual(1, len(self.reasons))
+        self.assertTrue(self.reasons[0].startswith("Rate dropped"))
+        self.assertTrue(self.watchdog.rate.value > 10)
+
+
+    def test_lag(self):
+        """
+        A stream with statuses much later than usual is flagged.
+        """
+        self.feed(60, rate=1, lag=2)
+        self.assertEqual(2, self.watchdog.lag.value)
+        self.assertEqual(32, self.watchdog.lagThreshold())
+        self.feed(30, rate=1, lag=20)
+        self.assertEqual([], self.reasons)
+        self.feed(30, rate=1, lag=120)
+        self.assertEqual(1, len(self.reasons))
+        self.assertTrue(self.reasons[0].startswith(
+            "Statuses delayed by 120 seconds"))
+
+
+    def test_watchReplaces(self):
+        """
+        Watching a new stream stops watching the previous one, and keeps
+        the learned averages.
+        """
+        self.feed(60, rate=2, keepAliveInterval=10)
+        stream = FakeStream()
+        self.watchdog.watch(stream, self.reasons.append)
+        self.assertIdentical(stream, self.watchdog.protocol)
+        self.assertEqual(2, self.watchdog.rate.value)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+
+
+    def test_stats(self):
+        self.feed(60, rate=1, keepAliveInterval=10, lag=2)
+        stats = self.watchdog.stats()
+        self.assertEqual(1, stats['rate'])
+        self.assertEqual(10, stats['keepAliveInterval'])
+        self.assertEqual(2, stats['lag'])
+        self.assertEqual(0, stats['stalls'])
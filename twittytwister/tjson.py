@@ -0,0 +1,254 @@
+# -*- test-case-name: twittytwister.test.test_tjson -*-
+#
+# See LICENSE.txt for details
+
+"""
+Parsers for JSON responses of the REST API.
+
+This mirrors the parser factories of L{twittytwister.txml}, but builds the
+model objects of L{twittytwister.streaming} from the C{.json} variants of
+the resources. Responses are decoded as a whole, with the C extension of
+simplejson if available.
+
+Unlike their XML counterparts, ids and counts are integers.
+"""
+
+import simplejson as json
+
+from twittytwister import streaming
+
+class Parser(object):
+    """
+    A file-like object that collects a JSON response and passes the
+    decoded value to a handler when closed.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.data = []
+
+    def write(self, b):
+        self.data.append(b)
+    def close(self):
+        data = ''.join(self.data)
+        self.data = []
+        if data.strip():
+            self.handler(json.loads(data))
+    def open(self):
+        pass
+    def read(self):
+        return None
+
+
+
+class ListPage(streaming.TwitterObject):
+    """
+    Cursors of a page of a cursored resource.
+
+    The cursors are strings, like in the XML responses.
+    """
+    next_cursor = None
+    previous_cursor = None
+
+    @classmethod
+    def fromDict(cls, data):
+        obj = cls()
+        obj.raw = data
+        for name in ('next_cursor', 'previous_cursor'):
+            value = data.get(name + '_str', data.get(name))
+            if value is not None:
+                setattr(obj, name, str(value))
+        return obj
+
+
+
+def _items(value, key=None):
+    """
+    Return the list of items in a response.
+
+    Responses are a list of items, a single item, or an object holding the
+    items under C{key}.
+    """
+    if isinstance(value, list):
+        return value
+    if key is not None and isinstance(value, dict) and key in value:
+        return value[key]
+    return [value]
+
+
+def listParser(item_type, delegate, extra_args=None, key=None):
+    if extra_args:
+        args = (extra_args,)
+    else:
+        args = ()
+
+    def handler(value):
+        for item in _items(value, key):
+            delegate(item_type.fromDict(item), *args)
+
+    return Parser(handler)
+
+def simpleListFactory(item_type):
+    """Used for simple parsers that support only one type of object"""
+    def create(delegate, extra_args=None):
+        """Create a Parser object for the specific type, on the fly"""
+        return listParser(item_type, delegate, extra_args)
+    return create
+
+
+
+class _Id(object):
+    """
+    Item type for ids, which are passed on as is.
+    """
+
+    @staticmethod
+    def fromDict(value):
+        return value
+
+
+
+Users    = simpleListFactory(streaming.User)
+
+Direct   = simpleListFactory(streaming.DirectMessage)
+
+Statuses = simpleListFactory(streaming.Status)
+
+HoseFeed = simpleListFactory(streaming.Status)
+
+
+def _searchResult(result):
+    """
+    Build a status from a search result, which carries the author in
+    C{from_user} fields instead of a user object.
+    """
+    status = streaming.Status.fromDict(result)
+    user = {}
+    for name, key in (('id', 'from_user_id'), ('screen_name', 'from_user'),
+                      ('name', 'from_user_name'),
+                      ('profile_image_url', 'profile_image_url')):
+        if key in result:
+            user[name] = result[key]
+    status.user = streaming.User.fromDict(user)
+    return status
+
+
+def Search(delegate, extra_args=None):
+    """
+    Create a parser for the results of the Search API, passed on as
+    L{streaming.Status} objects.
+    """
+    if extra_args:
+        args = (extra_args,)
+    else:
+        args = ()
+
+    def handler(value):
+        for result in _items(value, 'results'):
+            delegate(_searchResult(result), *args)
+
+    return Parser(handler)
+
+
+class Pager:
+    """Able to create parsers that support paging, and parsers that don't"""
+    def __init__(self, key, item_type):
+        self.key = key
+        self.item_type = item_type
+
+    def pagingParser(self, delegate, page_delegate):
+        def handler(value):
+            for item in _items(value, self.key):
+                delegate(self.item_type.fromDict(item))
+            if isinstance(value, dict):
+                page_delegate(ListPage.fromDict(value))
+        return Parser(handler)
+
+    def noPagingParser(self, delegate):
+        return listParser(self.item_type, delegate, key=self.key)
+
+
+PagedUserList = Pager('users', streaming.User)
+PagedIDList = Pager('ids', _Id)
+
+
+def _lookup(value, path):
+    """
+    Return a tuple of whether C{path} was found in C{value}, and its value.
+
+    For lists, the first item that has the path is used.
+    """
+    if not path:
+        return True, value
+    if isinstance(value, list):
+        for item in value:
+            found, result = _lookup(item, path)
+            if found:
+                return found, result
+    elif isinstance(value, dict) and path[0] in value:
+        return _lookup(value[path[0]], path[1:])
+    return False, None
+
+
+
+class PathExtractor(Parser):
+    """
+    Extract the values at some paths of a response.
+
+    Paths are tuples of keys, like C{('user', 'screen_name')} in a status.
+    The delegate is called with a dictionary mapping the paths that were
+    found to their values.
+    """
+
+    def __init__(self, paths, delegate):
+        Parser.__init__(self, self.extract)
+        self.paths = [tuple(p) for p in paths]
+        self.delegate = delegate
+
+
+    def close(self):
+        if ''.join(self.data).strip():
+            Parser.close(self)
+        else:
+            self.data = []
+            self.delegate({})
+
+
+    def extract(self, value):
+        results = {}
+        for path in self.paths:
+            found, result = _lookup(value, path)
+            if found:
+                results[path] = result
+        self.delegate(results)
+
+
+
+def _statusId(status):
+    return status.get('id_str') or str(status['id'])
+
+
+def UpdateResponse(delegate):
+    """
+    Create a parser that passes the id of a new status to the delegate, as
+    a string.
+    """
+    return Parser(lambda status: delegate(_statusId(status)))
+
+
+def extractPaths(data, paths):
+    """
+    Return the values at some paths of a response, see L{PathExtractor}.
+    """
+    results = []
+    extractor = PathExtractor(paths, results.append)
+    extractor.write(data)
+    extractor.close()
+    return results[0]
+
+
+def parseUpdateResponse(data):
+    """
+    Return the id of the status in a response, as a string.
+    """
+    return _statusId(json.loads(data))
@@ -0,0 +1,186 @@
+# -*- test-case-name: twittytwister.test.test_tls -*-
+#
+# See LICENSE.txt for details
+
+"""
+TLS connection setup with a shared context and session resumption.
+
+Setting up a new TLS context for each connection, as
+L{twisted.web.client.BrowserLikePolicyForHTTPS} does, also means starting
+with an empty session cache each time, so every connection pays for a full
+handshake. L{SessionResumingPolicy} keeps one long-lived context and
+offers the last session negotiated with a host when connecting to it
+again.
+"""
+
+import weakref
+
+from OpenSSL import SSL
+from service_identity import VerificationError
+from service_identity.pyopenssl import verify_hostname, verify_ip_address
+from zope.interface import implementer
+
+from twisted.internet import ssl
+from twisted.internet.abstract import isIPAddress, isIPv6Address
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
+from twisted.python import failure, log
+from twisted.web.iweb import IPolicyForHTTPS
+
+# pyOpenSSL has no public API for this, so the binding is looked up in its
+# private cffi library, which may change with any release.
+_SSL_session_reused = getattr(getattr(SSL, '_lib', None),
+                              'SSL_session_reused', None)
+
+def _sessionReused(connection):
+    """
+    Return whether the handshake of C{connection} resumed a session.
+
+    pyOpenSSL has no wrapper for this, so this calls C{SSL_session_reused}
+    through the private C{OpenSSL.SSL._lib} and C{Connection._ssl}. These
+    are present in pyOpenSSL 20.0, but are not part of its API.
+
+    @return: C{True} or C{False}, or C{None} if the installed pyOpenSSL
+        does not expose the binding.
+    """
+    handle = getattr(connection, '_ssl', None)
+    if _SSL_session_reused is None or handle is None:
+        return None
+    return bool(_SSL_session_reused(handle))
+
+
+
+@implementer(IOpenSSLClientConnectionCreator)
+class _ResumingConnectionCreator(object):
+    """
+    Connection creator for one host, using the context of its policy.
+    """
+
+    def __init__(self, policy, hostname, port):
+        self.policy = policy
+        self.hostname = hostname
+        self.netloc = (hostname, port)
+        self.isDNSName = not (isIPAddress(hostname) or
+                              isIPv6Address(hostname))
+
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        connection = SSL.Connection(self.policy.context, None)
+        connection.set_app_data(tlsProtocol)
+        if self.isDNSName:
+            connection.set_tlsext_host_name(self.hostname.encode('idna'))
+        self.policy._connectionCreated(connection, self)
+        return connection
+
+
+    def verify(self, connection):
+        """
+        Verify that the certificate presented matches the host name.
+
+        @raise VerificationError: If it does not match.
+        """
+        if self.isDNSName:
+            verify_hostname(connection, self.hostname)
+        else:
+            verify_ip_address(connection, self.hostname)
+
+
+
+@implementer(IPolicyForHTTPS)
+class SessionResumingPolicy(object):
+    """
+    HTTPS policy with a shared context and a client-side session cache.
+
+    Pass this as the C{contextFactory} to L{twisted.web.client.Agent}.
+    Certificates are verified against C{trustRoot} and the host name, as
+    with L{twisted.web.client.BrowserLikePolicyForHTTPS}.
+
+    @ivar context: The TLS context shared by all connections.
+    @type context: L{OpenSSL.SSL.Context}
+
+    @ivar handshakes: Number of completed handshakes.
+    @type handshakes: C{int}
+
+    @ivar resumed: Number of handshakes that resumed an earlier session,
+        or C{None} if the installed pyOpenSSL cannot tell, see
+        L{_sessionReused}.
+    @type resumed: C{int}
+    """
+
+    def __init__(self, trustRoot=None):
+        if trustRoot is None:
+            trustRoot = ssl.platformTrust()
+        self.context = ssl.CertificateOptions(trustRoot=trustRoot).getContext()
+        self.context.set_session_cache_mode(SSL.SESS_CACHE_CLIENT)
+        self.context.set_info_callback(self._infoCallback)
+        self.handshakes = 0
+        self.resumed = 0
+        self._sessionSources = {}
+        self._connections = weakref.WeakKeyDictionary()
+
+
+    def creatorForNetloc(self, hostname, port):
+        """
+        Return a connection creator for the given host and port.
+        """
+        return _ResumingConnectionCreator(self, hostname.decode('ascii'),
+                                          port)
+
+
+    def _connectionCreated(self, connection, creator):
+        previous = self._sessionSources.get(creator.netloc)
+        if previous is not None:
+            connection.set_session(previous.get_session())
+        self._connections[connection] = creator
+
+
+    def _infoCallback(self, connection, where, ret):
+        """
+        Verify the host once a handshake is done.
+
+        The connection is then remembered as the session source for its
+        host. The session itself is only retrieved when the next connection
+        is made: with TLS 1.3 the session tickets arrive after the
+        handshake, so the session is not resumable yet at this point.
+        """
+        if not where & SSL.SSL_CB_HANDSHAKE_DONE:
+            return
+
+        try:
+            creator = self._connections.pop(connection, None)
+            if creator is None:
+                return
+
+            try:
+                creator.verify(connection)
+            except VerificationError:
+                connection.get_app_data().failVerification(failure.Failure())
+                return
+
+            self.handshakes += 1
+            reused = _sessionReused(connection)
+            if reused is None:
+                self.resumed = None
+            elif reused and self.resumed is not None:
+                self.resumed += 1
+            self._sessionSources[creator.netloc] = connection
+        except:
+            log.err()
+
+
+    def stats(self):
+        """
+        Return handshake statistics.
+
+        @return: Dictionary with the number of C{'handshakes'}, the number
+            of C{'resumed'} sessions and the C{'resumptionRate'}. The last
+            two are C{None} if resumption cannot be detected.
+        """
+        if self.resumed is None:
+            rate = None
+        elif self.handshakes:
+            rate = float(self.resumed) / self.handshakes
+        else:
+            rate = 0.0
+        return {'handshakes': self.handshakes,
+                'resumed': self.resumed,
+                'resumptionRate': rate}
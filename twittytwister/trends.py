@@ -0,0 +1,293 @@
+# -*- test-case-name: twittytwister.test.test_trends -*-
+#
+# See LICENSE.txt for details
+
+"""
+Sliding-window trend detection for Twitter streams.
+
+Hash tags and terms are counted in a ring of fixed-size time buckets. Each
+bucket holds a Count-Min sketch and a bounded set of heavy hitter candidates,
+so memory use does not depend on the number of distinct terms seen, and
+every update takes constant time.
+
+@see: U{http://dimacs.rutgers.edu/~graham/pubs/papers/cm-full.pdf}.
+"""
+
+import hashlib
+import heapq
+import re
+from array import array
+
+_TOKEN_RE = re.compile(r'https?://\S+|([#@]?)(\w+)', re.UNICODE)
+
+STOP_WORDS = frozenset("""
+    a about after all also an and any are as at be been but by can could
+    de do for from get got had has have he her his how i if in into is it
+    its just like me more my no not now of on or our out rt so some than
+    that the their them then there they this to up us was we what when
+    which who will with would you your
+    """.split())
+
+
+
+class CountMinSketch(object):
+    """
+    Count-Min sketch of fixed width and depth.
+
+    Estimates never undercount. With C{width} M{w} and C{depth} M{d}, an
+    estimate exceeds the true count by more than M{2N/w} with probability
+    at most M{2^-d}, where M{N} is the total of all counts added.
+
+    @ivar width: Number of counters per row.
+    @type width: C{int}
+
+    @ivar depth: Number of rows, each with an independent hash function.
+    @type depth: C{int}
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('l', [0]) * width for _ in xrange(depth)]
+        # One salted hash per row, so that keys that collide in one row
+        # are unlikely to collide in the others.
+        self._salts = [hashlib.md5('row-%d:' % i) for i in xrange(depth)]
+
+
+    def _indexes(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        else:
+            key = str(key)
+        width = self.width
+        indexes = []
+        for salt in self._salts:
+            digest = salt.copy()
+            digest.update(key)
+            indexes.append(int(digest.hexdigest()[:16], 16) % width)
+        return indexes
+
+
+    def add(self, key, count=1):
+        """
+        Add C{count} to the counters for C{key} and return the new estimate.
+        """
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(key)):
+            value = row[index] + count
+            row[index] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        return estimate
+
+
+    def estimate(self, key):
+        """
+        Return the estimated count for C{key}.
+        """
+        return min([row[index]
+                    for row, index in zip(self.rows, self._indexes(key))])
+
+
+    def clear(self):
+        """
+        Reset all counters to zero, keeping the allocated rows.
+        """
+        zeros = array('l', [0]) * self.width
+        for row in self.rows:
+            row[:] = zeros
+
+
+
+class _Bucket(object):
+    """
+    Counts for one time slot: a sketch plus heavy hitter candidates.
+
+    The candidates are kept in a dictionary of at most C{capacity} keys,
+    together with a lazily updated min-heap to find the weakest candidate
+    when a stronger one comes along.
+    """
+
+    def __init__(self, width, depth, capacity):
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1, not %r" %
+                             (capacity,))
+        self.epoch = None
+        self.sketch = CountMinSketch(width, depth)
+        self.capacity = capacity
+        self.candidates = {}
+        self._heap = []
+
+
+    def reset(self, epoch):
+        self.epoch = epoch
+        self.sketch.clear()
+        self.candidates.clear()
+        del self._heap[:]
+
+
+    def add(self, key, count):
+        estimate = self.sketch.add(key, count)
+        candidates = self.candidates
+
+        if key not in candidates and len(candidates) >= self.capacity:
+            self._prune()
+            weakest, weakestKey = self._heap[0]
+            if estimate <= weakest:
+                return
+            heapq.heappop(self._heap)
+            del candidates[weakestKey]
+
+        candidates[key] = estimate
+        heapq.heappush(self._heap, (estimate, key))
+
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(value, k) for k, value in candidates.iteritems()]
+            heapq.heapify(self._heap)
+
+
+    def _prune(self):
+        """
+        Drop outdated heap entries until the top reflects a candidate.
+        """
+        heap = self._heap
+        candidates = self.candidates
+        while candidates.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+
+
+class TrendingAggregator(object):
+    """
+    Sliding-window aggregator for trending hash tags and terms.
+
+    Statuses are fed to L{statusReceived}, which makes an instance usable
+    as a delegate for L{twittytwister.twitter.TwitterFeed} and
+    L{twittytwister.twitter.TwitterMonitor}. Hash tags are counted with a
+    C{'#'} prefix, words from the status text are counted as is, both
+    lowercased.
+
+    @ivar bucketSize: Length of a time bucket, in seconds.
+    @type bucketSize: C{int}
+
+    @ivar numBuckets: Number of buckets kept. Together with L{bucketSize}
+        this determines the longest window that can be queried.
+    @type numBuckets: C{int}
+
+    @ivar countTerms: Whether to count words from the status text, besides
+        hash tags.
+    @type countTerms: C{bool}
+    """
+
+    countTerms = True
+
+    def __init__(self, bucketSize=60, numBuckets=60, width=2048, depth=4,
+                       capacity=200, reactor=None):
+        """
+        @param width: Width of the Count-Min sketch for each bucket.
+        @param depth: Depth of the Count-Min sketch for each bucket.
+        @param capacity: Maximum number of heavy hitter candidates tracked
+            per bucket. This bounds the C{n} that can be reliably queried.
+        """
+        self.bucketSize = bucketSize
+        self.numBuckets = numBuckets
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._buckets = [_Bucket(width, depth, capacity)
+                         for _ in xrange(numBuckets)]
+
+
+    def _bucket(self, epoch):
+        bucket = self._buckets[epoch % self.numBuckets]
+        if bucket.epoch != epoch:
+            bucket.reset(epoch)
+        return bucket
+
+
+    def add(self, key, count=1):
+        """
+        Count C{key} in the current time bucket.
+        """
+        epoch = int(self.reactor.seconds() // self.bucketSize)
+        self._bucket(epoch).add(key, count)
+
+
+    def statusReceived(self, status):
+        """
+        Count the hash tags and terms of a status.
+
+        @type status: L{twittytwister.streaming.Status}
+        """
+        epoch = int(self.reactor.seconds() // self.bucketSize)
+        bucket = self._bucket(epoch)
+        for key in extractKeys(status, self.countTerms):
+            bucket.add(key, 1)
+
+    __call__ = statusReceived
+
+
+    def top(self, n=20, window=300):
+        """
+        Return the top C{n} keys seen within the last C{window} seconds.
+
+        @return: List of C{(key, estimatedCount)} tuples, highest count
+            first.
+        """
+        numEpochs = -(-window // self.bucketSize)
+        if numEpochs > self.numBuckets:
+            raise ValueError("Window of %s seconds exceeds the %s seconds "
+                             "kept" % (window,
+                                       self.bucketSize * self.numBuckets))
+
+        current = int(self.reactor.seconds() // self.bucketSize)
+        buckets = [bucket for bucket in self._buckets
+                   if bucket.epoch is not None and
+                      current - numEpochs < bucket.epoch <= current]
+
+        keys = set()
+        for bucket in buckets:
+            keys.update(bucket.candidates)
+
+        totals = []
+        for key in keys:
+            total = 0
+            for bucket in buckets:
+                total += bucket.sketch.estimate(key)
+            totals.append((total, key))
+
+        return [(key, total) for total, key in heapq.nlargest(n, totals)]
+
+
+
+def extractKeys(status, countTerms=True):
+    """
+    Return the trend keys for a status.
+
+    Hash tags come from the status entities, when available, and are
+    returned with a C{'#'} prefix. Terms are the remaining words of the
+    status text, excluding links, mentions, numbers and stop words.
+    """
+    keys = []
+    entities = getattr(status, 'entities', None)
+    hashtags = getattr(entities, 'hashtags', None)
+    if hashtags is not None:
+        for hashtag in hashtags:
+            keys.append(u'#' + hashtag.text.lower())
+
+    text = getattr(status, 'text', None)
+    if not text:
+        return keys
+
+    for match in _TOKEN_RE.finditer(text):
+        prefix, word = match.groups()
+        if word is None:
+            continue
+        word = word.lower()
+        if prefix == u'#':
+            if hashtags is None:
+                keys.append(u'#' + word)
+        elif (countTerms and not prefix and len(word) > 2 and
+              not word.isdigit() and word not in STOP_WORDS):
+            keys.append(word)
+    return keys
@@ -10,20 +10,32 @@ Twisted Twitter interface.
 """
 
 import base64
+import random
 import urllib
-import mimetypes
-import mimetools
+import urlparse
+import os
 import logging
+from cStringIO import StringIO
 
 from oauth import oauth
 
 from twisted.application import service
-from twisted.internet import defer, reactor, endpoints
+from twisted.internet import defer, reactor, endpoints, protocol
 from twisted.internet import error as ierror
 from twisted.python import failure, log
 from twisted.web import client, error, http_headers
+from twisted.web.http import PotentialDataLoss
 
-from twittytwister import streaming, txml
+from twittytwister import checkpoint, metrics, multipart, paging, ratelimit
+from twittytwister import pull, signing, streaming
+from twittytwister import tjson, txml
+from twittytwister.backfill import mergeEntries, statusId
+
+try:
+    from twittytwister import tls
+except ImportError:
+    # No pyOpenSSL or service_identity: HTTPS is unavailable anyway.
+    tls = None
 
 SIGNATURE_METHOD = oauth.OAuthSignatureMethod_HMAC_SHA1()
 
@@ -34,27 +46,6 @@ SEARCH_URL="http://search.twitter.com/search.atom"
 logger = logging.getLogger('twittytwister.twitter')
 
 
-##### ugly hack to work around a bug on HTTPDownloader on Twisted 8.2.0 (fixed on 9.0.0)
-def install_twisted_fix():
-    orig_method = client.HTTPDownloader.gotHeaders
-    def gotHeaders(self, headers):
-        client.HTTPClientFactory.gotHeaders(self, headers)
-        orig_method(self, headers)
-    client.HTTPDownloader.gotHeaders = gotHeaders
-
-def buggy_twisted():
-    o = client.HTTPDownloader('http://dummy-url/foo', None)
-    client.HTTPDownloader.gotHeaders(o, {})
-    if o.response_headers is None:
-        return True
-    return False
-
-if buggy_twisted():
-    install_twisted_fix()
-
-##### end of hack
-
-
 class TwitterClientInfo:
     def __init__ (self, name, version = None, url = None):
         self.name = name
@@ -73,51 +64,148 @@ class TwitterClientInfo:
         return self.name
 
 
-def __downloadPage(factory, *args, **kwargs):
-    """Start a HTTP download, returning a HTTPDownloader object"""
+class _BodyReceiver(protocol.Protocol):
+    """
+    Receive a response body, for requests made with L{Twitter._request}.
 
-    # The Twisted API is weird:
-    # 1) web.client.downloadPage() doesn't give us the HTTP headers
-    # 2) there is no method that simply accepts a URL and gives you back
-    #    a HTTPDownloader object
+    The body is either passed on to a file-like consumer (like the parsers
+    in L{txml}) as it arrives, or collected in a string.
+    """
+
+    def __init__(self, finished, consumer=None):
+        self.finished = finished
+        self.consumer = consumer
+        self.data = []
 
-    #TODO: convert getPage() usage to something similar, too
 
-    downloader = factory(*args, **kwargs)
-    if downloader.scheme == 'https':
-        from twisted.internet import ssl
-        contextFactory = ssl.ClientContextFactory()
-        reactor.connectSSL(downloader.host, downloader.port,
-                           downloader, contextFactory)
-    else:
-        reactor.connectTCP(downloader.host, downloader.port,
-                           downloader)
-    return downloader
+    def dataReceived(self, data):
+        if self.consumer is not None:
+            self.consumer.write(data)
+        else:
+            self.data.append(data)
+
 
-def downloadPage(url, file, timeout=0, **kwargs):
-    c = __downloadPage(client.HTTPDownloader, url, file, **kwargs)
-    # HTTPDownloader doesn't have the 'timeout' keyword parameter on
-    # Twisted 8.2.0, so set it directly:
-    if timeout:
-        c.timeout = timeout
-    return c
+    def connectionLost(self, reason):
+        if self.finished.called:
+            # cancelled
+            return
+        if not reason.check(client.ResponseDone, PotentialDataLoss):
+            self.finished.errback(reason)
+        elif self.consumer is not None:
+            try:
+                self.consumer.close()
+            except:
+                self.finished.errback(failure.Failure())
+            else:
+                self.finished.callback(None)
+        else:
+            self.finished.callback(''.join(self.data))
+
+
+    def cancel(self):
+        self.transport.stopProducing()
 
-def getPage(url, *args, **kwargs):
-    return __downloadPage(client.HTTPClientFactory, url, *args, **kwargs)
 
 class Twitter(object):
+    """
+    Twitter REST API client.
+
+    Requests are made over persistent HTTP/1.1 connections kept in L{pool},
+    so that consecutive calls to the same host skip the TCP and TLS
+    handshakes.
+
+    @cvar userAgent: The C{User-Agent} header sent with REST requests.
+    @type userAgent: C{str}
+
+    @cvar maxConnectionsPerHost: Maximum number of concurrent requests, and
+        of idle persistent connections kept, per host. Further requests are
+        queued until a connection is free.
+    @type maxConnectionsPerHost: C{int}
+
+    @cvar idleTimeout: Number of seconds an idle persistent connection is
+        kept open.
+    @type idleTimeout: C{int}
+
+    @ivar pool: The connection pool for REST requests.
+    @type pool: L{client.HTTPConnectionPool}
+
+    @ivar tlsPolicy: The HTTPS policy shared by all connections of this
+        instance, so that TLS sessions can be resumed. C{None} if TLS
+        support is not available.
+    @type tlsPolicy: L{tls.SessionResumingPolicy}
+
+    @ivar restAgent: The agent that issues REST requests using L{pool}.
+    @type restAgent: L{client.Agent}
+
+    @ivar cache: Optional cache for the parsed results of GET requests.
+    @type cache: L{cache.ResponseCache}
+
+    @ivar scheduler: Scheduler that holds back REST requests when the rate
+        limit of their endpoint family runs low.
+    @type scheduler: L{ratelimit.RateLimitScheduler}
+
+    @ivar coalesced: Number of GET requests that were saved by sharing the
+        download of an identical request in flight.
+    @type coalesced: C{int}
+
+    @ivar parsers: The module with the parsers for REST responses, either
+        L{txml} or, in JSON mode, L{tjson}.
 
-    agent="twitty twister"
+    @ivar lookupWindow: Time in seconds that L{lookup_user} waits for more
+        users to look up in the same request.
+    @type lookupWindow: C{float}
+
+    @ivar lookupBatchSize: Maximum number of users per lookup request.
+    @type lookupBatchSize: C{int}
+    """
+
+    userAgent = "twitty twister"
+
+    maxConnectionsPerHost = 4
+    idleTimeout = 240
+
+    lookupWindow = 0.05
+    lookupBatchSize = 100
 
     def __init__(self, user=None, passwd=None,
         base_url=BASE_URL, search_url=SEARCH_URL,
-                 consumer=None, token=None, signature_method=SIGNATURE_METHOD,client_info = None, timeout=0):
+                 consumer=None, token=None, signature_method=SIGNATURE_METHOD,client_info = None, timeout=0,
+                 pool=None, cache=None, scheduler=None, restFormat='xml'):
 
         self.base_url = base_url
         self.search_url = search_url
 
+        if pool is None:
+            pool = client.HTTPConnectionPool(reactor)
+            pool.maxPersistentPerHost = self.maxConnectionsPerHost
+            pool.cachedConnectionTimeout = self.idleTimeout
+        self.pool = pool
+        if tls is not None:
+            self.tlsPolicy = tls.SessionResumingPolicy()
+            self.restAgent = client.Agent(reactor, self.tlsPolicy, pool=pool)
+        else:
+            self.tlsPolicy = None
+            self.restAgent = client.Agent(reactor, pool=pool)
+        self._hostLimits = {}
+        self.cache = cache
+        if scheduler is None:
+            scheduler = ratelimit.RateLimitScheduler()
+        self.scheduler = scheduler
+        self._inFlight = {}
+        self.coalesced = 0
+        if restFormat == 'json':
+            self.parsers = tjson
+        elif restFormat == 'xml':
+            self.parsers = txml
+        else:
+            raise ValueError("Unknown REST format: %r" % (restFormat,))
+        self.reactor = reactor
+        self._pendingLookups = {'user_id': {}, 'screen_name': {}}
+        self._lookupCall = None
+
         self.use_auth = False
         self.use_oauth = False
+        self._signer = None
         self.client_info = None
         self.timeout = timeout
 
@@ -143,6 +231,15 @@ class Twitter(object):
 
 
     def __makeOAuthHeader(self, method, url, parameters={}, headers={}):
+        if isinstance(self.signature_method,
+                      oauth.OAuthSignatureMethod_HMAC_SHA1):
+            signer = self._signer
+            if (signer is None or signer.consumer is not self.consumer or
+                signer.token is not self.token):
+                signer = self._signer = signing.OAuthSigner(self.consumer,
+                                                            self.token)
+            return signer.makeHeader(method, url, parameters, headers)
+
         oauth_request = oauth.OAuthRequest.from_consumer_and_token(self.consumer,
             token=self.token, http_method=method, http_url=url, parameters=parameters)
         oauth_request.sign_request(self.signature_method, self.consumer, self.token)
@@ -176,33 +273,6 @@ class Twitter(object):
                 urllib.quote(v.encode("utf-8"))))
         return '&'.join(rv)
 
-    def __encodeMultipart(self, fields, files):
-        """
-        fields is a sequence of (name, value) elements for regular form fields.
-        files is a sequence of (name, filename, value) elements for data to be uploaded as files
-        Return (content_type, body) ready for httplib.HTTP instance
-        """
-        boundary = mimetools.choose_boundary()
-        crlf = '\r\n'
-
-        l = []
-        for k, v in fields:
-            l.append('--' + boundary)
-            l.append('Content-Disposition: form-data; name="%s"' % k)
-            l.append('')
-            l.append(v)
-        for (k, f, v) in files:
-            l.append('--' + boundary)
-            l.append('Content-Disposition: form-data; name="%s"; filename="%s"' % (k, f))
-            l.append('Content-Type: %s' % self.__getContentType(f))
-            l.append('')
-            l.append(v)
-        l.append('--' + boundary + '--')
-        l.append('')
-        body = crlf.join(l)
-
-        return boundary, body
-
     def gotHeaders(self, headers):
         logger.debug("hdrs: %r", headers)
         if headers is None:
@@ -224,32 +294,149 @@ class Twitter(object):
 
         logger.debug('hdrs end')
 
+    def stats(self):
+        """
+        Return statistics about the connections of this instance.
 
-    def __getContentType(self, filename):
-        return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        @return: Dictionary with a section per subsystem. The C{'tls'}
+            section holds the handshake statistics of L{tlsPolicy}, the
+            C{'cache'} section those of L{cache}, the C{'rateLimit'}
+            section those of L{scheduler} and the C{'coalescing'} section
+            the number of GET requests C{'inFlight'} and L{coalesced}.
+        """
+        stats = {'rateLimit': self.scheduler.stats(),
+                 'coalescing': {'inFlight': len(self._inFlight),
+                                'coalesced': self.coalesced}}
+        if self.tlsPolicy is not None:
+            stats['tls'] = self.tlsPolicy.stats()
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
 
-    def __clientDefer(self, c):
-        """Return a deferred for a HTTP client, after handling incoming headers"""
-        def handle_headers(r):
-            self.gotHeaders(c.response_headers)
-            return r
 
-        return c.deferred.addBoth(handle_headers)
+    def _endpointFamily(self, url):
+        """
+        Return the endpoint family of a URL, for rate limiting.
+
+        This is the first path segment below L{base_url}, without
+        extension, like C{'statuses'} or C{'users'}.
+        """
+        path = urlparse.urlsplit(url)[2]
+        basePath = urlparse.urlsplit(self.base_url)[2].rstrip('/')
+        if path.startswith(basePath + '/'):
+            path = path[len(basePath):]
+        return path.strip('/').split('/')[0].split('.')[0]
+
+    def _request(self, method, url, headers=None, body=None, consumer=None,
+                 headersReceived=None, priority=None):
+        """
+        Issue a REST request over a persistent connection from L{pool}.
+
+        Requests are first passed through L{scheduler}, keyed by endpoint
+        family and authenticated user. Requests to the same host are then
+        limited to L{maxConnectionsPerHost} at a time, and the response
+        headers are passed to L{gotHeaders}.
+
+        @param body: The request body, a string or an C{IBodyProducer}.
+        @param consumer: Optional file-like object that the response body is
+            written to as it arrives, and that is closed when the response
+            is complete.
+        @param headersReceived: Optional callable that is called with the
+            response headers, in the form passed to L{gotHeaders}.
+        @param priority: Scheduling priority. By default, requests that
+            change state go before C{GET} requests.
+
+        @return: Deferred that fires with the response body, or with C{None}
+            when a C{consumer} was passed. Non-2xx responses result in a
+            L{error.Error} failure.
+        """
+        scheme, netloc = urlparse.urlsplit(url)[:2]
+        if (scheme, netloc) not in self._hostLimits:
+            self._hostLimits[scheme, netloc] = defer.DeferredSemaphore(
+                                                self.maxConnectionsPerHost)
+        limit = self._hostLimits[scheme, netloc]
+
+        if priority is None:
+            if method == 'GET':
+                priority = ratelimit.PRIORITY_NORMAL
+            else:
+                priority = ratelimit.PRIORITY_HIGH
+        key = (self._endpointFamily(url), self.__authIdentity())
+
+        def gotResponseHeaders(responseHeaders):
+            rateLimit = ratelimit.parseRateLimitHeaders(responseHeaders)
+            if rateLimit is not None:
+                self.scheduler.update(key, *rateLimit)
+            if headersReceived is not None:
+                headersReceived(responseHeaders)
+
+        return self.scheduler.schedule(key, priority, limit.run,
+                                       self.__doRequest, method, url,
+                                       headers or {}, body, consumer,
+                                       gotResponseHeaders)
+
+    def __doRequest(self, method, url, headers, body, consumer,
+                    headersReceived):
+        rawHeaders = {'User-Agent': [self.userAgent]}
+        for name, value in headers.iteritems():
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            rawHeaders[name] = [value]
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        if isinstance(body, str):
+            body = client.FileBodyProducer(StringIO(body))
+
+        def cb(response):
+            responseHeaders = dict([(name.lower(), values)
+                                    for name, values
+                                    in response.headers.getAllRawHeaders()])
+            self.gotHeaders(responseHeaders)
+            if headersReceived is not None:
+                headersReceived(responseHeaders)
+            finished = defer.Deferred(lambda d: receiver.cancel())
+            if 200 <= response.code < 300:
+                receiver = _BodyReceiver(finished, consumer)
+            else:
+                def eb(body):
+                    raise error.Error(str(response.code), response.phrase,
+                                      body)
+                receiver = _BodyReceiver(finished)
+                finished.addCallback(eb)
+            response.deliverBody(receiver)
+            return finished
+
+        d = self.restAgent.request(method, url,
+                                   http_headers.Headers(rawHeaders), body)
+        d.addCallback(cb)
+
+        if self.timeout:
+            timeoutCall = self.reactor.callLater(self.timeout, d.cancel)
+            def cancelTimeout(result):
+                if timeoutCall.active():
+                    timeoutCall.cancel()
+                elif isinstance(result, failure.Failure):
+                    result.trap(defer.CancelledError)
+                    raise ierror.TimeoutError(string=url)
+                return result
+            d.addBoth(cancelTimeout)
+
+        return d
 
     def __postMultipart(self, path, fields=(), files=()):
         url = self.base_url + path
 
-        (boundary, body) = self.__encodeMultipart(fields, files)
-        headers = {'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
-            'Content-Length': str(len(body))
-            }
+        body = multipart.MultipartProducer(fields, files)
+        headers = {'Content-Type': body.contentType}
 
         self._makeAuthHeader('POST', url, headers=headers)
 
-        c = getPage(url, method='POST',
-            agent=self.agent,
-            postdata=body, headers=headers, timeout=self.timeout)
-        return self.__clientDefer(c)
+        d = self._request('POST', url, headers, body)
+        def closeFiles(result):
+            body.close()
+            return result
+        d.addBoth(closeFiles)
+        return d
 
     #TODO: deprecate __post()?
     def __post(self, path, args={}):
@@ -263,54 +450,190 @@ class Twitter(object):
             headers.update(self.client_info.get_headers())
             args['source'] = self.client_info.get_source()
 
-        c = getPage(url, method='POST',
-            agent=self.agent,
-            postdata=self._urlencode(args), headers=headers, timeout=self.timeout)
-        return self.__clientDefer(c)
+        return self._request('POST', url, headers, self._urlencode(args))
 
-    def __doDownloadPage(self, *args, **kwargs):
-        """Works like client.downloadPage(), but handle incoming headers
+    def __doDownloadPage(self, url, parser, method='GET', headers=None,
+                         postdata=None, headersReceived=None):
+        """Download a page into a parser, handling incoming headers
         """
-        logger.debug("download page: %r, %r", args, kwargs)
+        logger.debug("download page: %r, %r", method, url)
 
-        return self.__clientDefer(downloadPage(*args, **kwargs))
+        return self._request(method, url, headers, postdata, parser,
+                             headersReceived)
+
+    def __restPath(self, path):
+        """
+        Return the path of the C{.json} variant of a resource in JSON mode.
+        """
+        if self.parsers is tjson and path.endswith('.xml'):
+            return path[:-4] + '.json'
+        return path
 
     def __postPage(self, path, parser, args={}):
-        url = self.base_url + path
+        url = self.base_url + self.__restPath(path)
         headers = self.makeAuthHeader('POST', url, args)
 
         if self.client_info != None:
             headers.update(self.client_info.get_headers())
             args['source'] = self.client_info.get_source()
 
+        headers['Content-Type'] = 'application/x-www-form-urlencoded; charset=utf-8'
         return self.__doDownloadPage(url, parser, method='POST',
-            agent=self.agent,
-            postdata=self._urlencode(args), headers=headers, timeout=self.timeout)
+            headers=headers, postdata=self._urlencode(args))
 
-    def __downloadPage(self, path, parser, params=None):
+    def __downloadPage(self, path, parser, params=None, headers=None,
+                       headersReceived=None):
         url = self.base_url + path
 
-        headers = self.makeAuthHeader('GET', url, params)
+        allHeaders = self.makeAuthHeader('GET', url, params, {})
+        if headers:
+            allHeaders.update(headers)
         if params:
             url += '?' + self._urlencode(params)
 
-        return self.__doDownloadPage(url, parser,
-            agent=self.agent, headers=headers, timeout=self.timeout)
+        return self.__doDownloadPage(url, parser, headers=allHeaders,
+                                     headersReceived=headersReceived)
 
-    def __get(self, path, delegate, params, parser_factory=txml.Feed, extra_args=None):
-        parser = parser_factory(delegate, extra_args)
-        return self.__downloadPage(path, parser, params)
+    def __authIdentity(self):
+        if self.use_oauth:
+            return ('oauth', self.consumer.key, self.token.key)
+        elif self.use_auth:
+            return ('basic', self.username)
+        else:
+            return None
+
+    def __replay(self, events, onItem, onPage):
+        for isPage, value in events:
+            if not isPage:
+                onItem(value)
+            elif onPage:
+                onPage(*value)
+
+    def __fetch(self, endpoint, path, params, makeParser, onItem, onPage=None):
+        """Download and parse a GET resource, through the cache if enabled
+
+        makeParser is called with an item and a page callback, and returns
+        the parser. onItem is called for each parsed item, onPage with the
+        next and previous cursor of a page. If the response for this
+        endpoint is cached, the stored results are passed to these
+        callbacks without a download.
+
+        Identical requests made while one is in flight share its download.
+        The results are passed to the callbacks of the later requests when
+        it completes.
+        """
+        path = self.__restPath(path)
+        key = (path, tuple(sorted((params or {}).iteritems())),
+               self.__authIdentity())
+
+        cache = self.cache
+        if cache is not None and not cache.cacheable(endpoint):
+            cache = None
+
+        entry = None
+        if cache is not None:
+            fresh, entry = cache.lookup(key)
+            if fresh:
+                self.__replay(entry.events, onItem, onPage)
+                return defer.succeed(None)
+
+        if key in self._inFlight:
+            self.coalesced += 1
+            d = defer.Deferred()
+            self._inFlight[key].append((d, onItem, onPage))
+            return d
+        waiters = self._inFlight[key] = []
+
+        events = []
+        def recordItem(item):
+            events.append((False, item))
+            onItem(item)
+
+        def recordPage(next_cursor, previous_cursor):
+            events.append((True, (next_cursor, previous_cursor)))
+            if onPage:
+                onPage(next_cursor, previous_cursor)
+
+        received = {}
+        if entry is not None:
+            validators = entry.validators()
+        else:
+            validators = None
+
+        def cb(result):
+            if cache is not None:
+                if entry is not None:
+                    cache.invalidated(key)
+                etag = received.get('etag', [None])[0]
+                lastModified = received.get('last-modified', [None])[0]
+                cache.store(key, endpoint, events, etag, lastModified)
+            return result
+
+        def eb(reason):
+            reason.trap(error.Error)
+            if entry is None or reason.value.status != '304':
+                return reason
+            cache.revalidated(entry, endpoint)
+            events[:] = entry.events
+            self.__replay(events, onItem, onPage)
+
+        def release(result):
+            del self._inFlight[key]
+            for waiter, waiterItem, waiterPage in waiters:
+                if isinstance(result, failure.Failure):
+                    waiter.errback(result)
+                else:
+                    d = defer.maybeDeferred(self.__replay, events, waiterItem,
+                                            waiterPage)
+                    d.addCallback(lambda _, result=result: result)
+                    d.chainDeferred(waiter)
+            return result
+
+        d = self.__downloadPage(path, makeParser(recordItem, recordPage),
+                                params, validators, received.update)
+        d.addCallbacks(cb, eb)
+        d.addBoth(release)
+        return d
+
+    def __get(self, path, delegate, params, parser_factory=txml.Feed, extra_args=None,
+              endpoint=None):
+        if extra_args is None:
+            eargs = ()
+        else:
+            eargs = (extra_args,)
+
+        def onItem(item):
+            delegate(item, *eargs)
+
+        return self.__fetch(endpoint, path, params,
+                            lambda onItem, onPage: parser_factory(onItem),
+                            onItem)
 
     def verify_credentials(self, delegate=None):
         "Verify a user's credentials."
-        parser = txml.Users(delegate)
-        return self.__downloadPage('/account/verify_credentials.xml', parser)
-
-    def __parsed_post(self, hdef, parser):
-        deferred = defer.Deferred()
-        hdef.addErrback(lambda e: deferred.errback(e))
-        hdef.addCallback(lambda p: deferred.callback(parser(p)))
-        return deferred
+        def onItem(user):
+            if delegate:
+                delegate(user)
+
+        return self.__fetch('verify_credentials',
+                            '/account/verify_credentials.xml', None,
+                            lambda onItem, onPage: self.parsers.Users(onItem),
+                            onItem)
+
+    def extract_paths(self, path, paths, params=None):
+        """Get some values out of a resource, without parsing all of it.
+
+        Paths are tuples of tag names below the root element in XML mode,
+        or of keys in JSON mode, like ('user', 'screen_name') in a status.
+
+        Returns a deferred that fires with a dictionary mapping the paths
+        that were found to their values. Unlike other resources, these are
+        not cached, as the results depend on the paths."""
+        results = []
+        parser = self.parsers.PathExtractor(paths, results.append)
+        d = self.__downloadPage(self.__restPath(path), parser, params)
+        d.addCallback(lambda _: results[0])
+        return d
 
     def update(self, status, source=None, params={}):
         "Update your status.  Returns the ID of the new post."
@@ -318,15 +641,18 @@ class Twitter(object):
         params['status'] = status
         if source:
             params['source'] = source
-        return self.__parsed_post(self.__post('/statuses/update.xml', params),
-            txml.parseUpdateResponse)
+        ids = []
+        parser = self.parsers.UpdateResponse(ids.append)
+        d = self.__postPage('/statuses/update.xml', parser, params)
+        d.addCallback(lambda _: ids[0])
+        return d
 
     def retweet(self, id, delegate):
         """Retweet a post
 
         Returns the retweet status info back to the given delegate
         """
-        parser = txml.Statuses(delegate)
+        parser = self.parsers.Statuses(delegate)
         return self.__postPage('/statuses/retweet/%s.xml' % (id), parser)
 
     def friends(self, delegate, params={}, extra_args=None):
@@ -334,18 +660,21 @@ class Twitter(object):
 
         Calls the delgate once for each status object received."""
         return self.__get('/statuses/friends_timeline.xml', delegate, params,
-            txml.Statuses, extra_args=extra_args)
+            self.parsers.Statuses, extra_args=extra_args,
+                          endpoint='friends')
 
     def home_timeline(self, delegate, params={}, extra_args=None):
         """Get updates from friends.
 
         Calls the delgate once for each status object received."""
         return self.__get('/statuses/home_timeline.xml', delegate, params,
-            txml.Statuses, extra_args=extra_args)
+            self.parsers.Statuses, extra_args=extra_args,
+                          endpoint='home_timeline')
 
     def mentions(self, delegate, params={}, extra_args=None):
         return self.__get('/statuses/mentions.xml', delegate, params,
-            txml.Statuses, extra_args=extra_args)
+            self.parsers.Statuses, extra_args=extra_args,
+                          endpoint='mentions')
 
     def user_timeline(self, delegate, user=None, params={}, extra_args=None):
         """Get the most recent updates for a user.
@@ -357,18 +686,20 @@ class Twitter(object):
         if user:
             params['id'] = user
         return self.__get('/statuses/user_timeline.xml', delegate, params,
-                          txml.Statuses, extra_args=extra_args)
+                          self.parsers.Statuses, extra_args=extra_args,
+                          endpoint='user_timeline')
 
     def list_timeline(self, delegate, user, list_name, params={},
             extra_args=None):
         return self.__get('/%s/lists/%s/statuses.xml' % (user, list_name),
-                delegate, params, txml.Statuses, extra_args=extra_args)
+                delegate, params, self.parsers.Statuses, extra_args=extra_args,
+                endpoint='list_timeline')
 
     def public_timeline(self, delegate, params={}, extra_args=None):
         "Get the most recent public timeline."
 
         return self.__get('/statuses/public_timeline.atom', delegate, params,
-                          extra_args=extra_args)
+                          extra_args=extra_args, endpoint='public_timeline')
 
     def direct_messages(self, delegate, params={}, extra_args=None):
         """Get direct messages for the authenticating user.
@@ -376,7 +707,8 @@ class Twitter(object):
         Search results are returned one message at a time a DirectMessage
         objects"""
         return self.__get('/direct_messages.xml', delegate, params,
-                          txml.Direct, extra_args=extra_args)
+                          self.parsers.Direct, extra_args=extra_args,
+                          endpoint='direct_messages')
 
     def send_direct_message(self, text, user=None, delegate=None, screen_name=None, user_id=None, params={}):
         """Send a direct message
@@ -389,7 +721,7 @@ class Twitter(object):
         if screen_name is not None:
             params['screen_name'] = screen_name
         params['text'] = text
-        parser = txml.Direct(delegate)
+        parser = self.parsers.Direct(delegate)
         return self.__postPage('/direct_messages/new.xml', parser, params)
 
     def replies(self, delegate, params={}, extra_args=None):
@@ -397,7 +729,7 @@ class Twitter(object):
 
         See search for example of how results are returned."""
         return self.__get('/statuses/replies.atom', delegate, params,
-                          extra_args=extra_args)
+                          extra_args=extra_args, endpoint='replies')
 
     def follow(self, user):
         """Follow the given user.
@@ -416,7 +748,7 @@ class Twitter(object):
 
         Returns the user info back to the given delegate
         """
-        parser = txml.Users(delegate)
+        parser = self.parsers.Users(delegate)
         return self.__postPage('/friendships/create/%s.xml' % (user), parser)
 
     def unfollow_user(self, user, delegate):
@@ -424,22 +756,26 @@ class Twitter(object):
 
         Returns the user info back to the given delegate
         """
-        parser = txml.Users(delegate)
+        parser = self.parsers.Users(delegate)
         return self.__postPage('/friendships/destroy/%s.xml' % (user), parser)
 
-    def __paging_get(self, url, delegate, params, pager, page_delegate=None):
-        def end_page(p):
-            if page_delegate:
-                page_delegate(p.next_cursor, p.previous_cursor)
+    def __paging_get(self, url, delegate, params, pager, page_delegate=None,
+                     endpoint=None):
+        def makeParser(onItem, onPage):
+            def end_page(p):
+                onPage(p.next_cursor, p.previous_cursor)
+            return pager.pagingParser(onItem, page_delegate=end_page)
 
-        parser = pager.pagingParser(delegate, page_delegate=end_page)
-        return self.__downloadPage(url, parser, params)
+        return self.__fetch(endpoint, url, params, makeParser, delegate,
+                            page_delegate)
 
-    def __nopaging_get(self, url, delegate, params, pager):
-        parser = pager.noPagingParser(delegate)
-        return self.__downloadPage(url, parser, params)
+    def __nopaging_get(self, url, delegate, params, pager, endpoint=None):
+        return self.__fetch(endpoint, url, params,
+                            lambda onItem, onPage: pager.noPagingParser(onItem),
+                            delegate)
 
-    def __get_maybe_paging(self, url, delegate, params, pager, extra_args=None, page_delegate=None):
+    def __get_maybe_paging(self, url, delegate, params, pager, extra_args=None, page_delegate=None,
+                           endpoint=None):
         if extra_args is None:
             eargs = ()
         else:
@@ -449,9 +785,10 @@ class Twitter(object):
             delegate(i, *eargs)
 
         if params.has_key('cursor'):
-            return self.__paging_get(url, delegate, params, pager, page_delegate)
+            return self.__paging_get(url, delegate, params, pager, page_delegate,
+                                     endpoint)
         else:
-            return self.__nopaging_get(url, delegate, params, pager)
+            return self.__nopaging_get(url, delegate, params, pager, endpoint)
 
 
     def list_friends(self, delegate, user=None, params={}, extra_args=None, page_delegate=None):
@@ -463,7 +800,32 @@ class Twitter(object):
         else:
             url = '/statuses/friends.xml'
 
-        return self.__get_maybe_paging(url, delegate, params, txml.PagedUserList, extra_args, page_delegate)
+        return self.__get_maybe_paging(url, delegate, params, self.parsers.PagedUserList, extra_args, page_delegate,
+                                       endpoint='list_friends')
+
+    def walk_cursor(self, method, delegate, args=(), params=None, prefetch=1,
+                    maxPages=None):
+        """Walk all pages of a cursored resource.
+
+        The next page is requested as soon as its cursor has been parsed.
+        If the delegate returns a Deferred, the next item is delivered when
+        it fires, while up to prefetch pages are fetched ahead.
+
+        @param method: A paging method, like L{list_followers} or
+            L{followers_ids}.
+        @param args: Positional arguments for method after the delegate,
+            like the user.
+        @param maxPages: Maximum number of pages to fetch.
+        @return: Deferred that fires with the number of items when done.
+        """
+        def fetchPage(cursor, onItem, onPage):
+            pageParams = dict(params or {})
+            pageParams['cursor'] = cursor
+            return method(onItem, *args, **{'params': pageParams,
+                                            'page_delegate': onPage})
+
+        walker = paging.CursorWalker(fetchPage, delegate, prefetch, maxPages)
+        return walker.start()
 
     def list_followers(self, delegate, user=None, params={}, extra_args=None, page_delegate=None):
         """Get the list of followers for a user.
@@ -474,16 +836,20 @@ class Twitter(object):
         else:
             url = '/statuses/followers.xml'
 
-        return self.__get_maybe_paging(url, delegate, params, txml.PagedUserList, extra_args, page_delegate)
+        return self.__get_maybe_paging(url, delegate, params, self.parsers.PagedUserList, extra_args, page_delegate,
+                                       endpoint='list_followers')
 
     def friends_ids(self, delegate, user, params={}, extra_args=None, page_delegate=None):
-        return self.__get_maybe_paging('/friends/ids/%s.xml' % (user), delegate, params, txml.PagedIDList, extra_args, page_delegate)
+        return self.__get_maybe_paging('/friends/ids/%s.xml' % (user), delegate, params, self.parsers.PagedIDList, extra_args, page_delegate,
+                                       endpoint='friends_ids')
 
     def followers_ids(self, delegate, user, params={}, extra_args=None, page_delegate=None):
-        return self.__get_maybe_paging('/followers/ids/%s.xml' % (user), delegate, params, txml.PagedIDList, extra_args, page_delegate)
+        return self.__get_maybe_paging('/followers/ids/%s.xml' % (user), delegate, params, self.parsers.PagedIDList, extra_args, page_delegate,
+                                       endpoint='followers_ids')
 
     def list_members(self, delegate, user, list_name, params={}, extra_args=None, page_delegate=None):
-        return self.__get_maybe_paging('/%s/%s/members.xml' % (user, list_name), delegate, params, txml.PagedUserList, extra_args, page_delegate=page_delegate)
+        return self.__get_maybe_paging('/%s/%s/members.xml' % (user, list_name), delegate, params, self.parsers.PagedUserList, extra_args, page_delegate=page_delegate,
+                                       endpoint='list_members')
 
     def show_user(self, user):
         """Get the info for a specific user.
@@ -493,11 +859,84 @@ class Twitter(object):
         url = '/users/show/%s.xml' % (user)
         d = defer.Deferred()
 
-        self.__downloadPage(url, txml.Users(lambda u: d.callback(u))) \
+        self.__fetch('show_user', url, None,
+                     lambda onItem, onPage: self.parsers.Users(onItem), d.callback) \
             .addErrback(lambda e: d.errback(e))
 
         return d
 
+    def lookup_user(self, user):
+        """Get the info for a specific user, batched with other lookups.
+
+        Users to look up are collected for L{lookupWindow} seconds, or until
+        L{lookupBatchSize} users are waiting, and then fetched with a single
+        request to C{users/lookup}.
+
+        @param user: The screen name or, as an integer, the id of the user.
+        @return: Deferred that fires with the user. If the user does not
+            exist, it fails with an L{error.Error} with status C{'404'}.
+        """
+        if isinstance(user, (int, long)):
+            kind, value = 'user_id', str(user)
+        else:
+            kind, value = 'screen_name', user.lower()
+
+        d = defer.Deferred()
+        pending = self._pendingLookups[kind]
+        pending.setdefault(value, []).append(d)
+
+        if len(pending) >= self.lookupBatchSize:
+            self.__flushLookups(kind)
+        elif self._lookupCall is None:
+            self._lookupCall = self.reactor.callLater(self.lookupWindow,
+                                                      self.__flushLookups)
+        return d
+
+    def __flushLookups(self, kind=None):
+        if kind is None:
+            self._lookupCall = None
+            kinds = self._pendingLookups.keys()
+        else:
+            kinds = [kind]
+
+        for kind in kinds:
+            pending = self._pendingLookups[kind]
+            self._pendingLookups[kind] = {}
+            values = pending.keys()
+            for i in xrange(0, len(values), self.lookupBatchSize):
+                batch = dict([(value, pending[value]) for value
+                              in values[i:i + self.lookupBatchSize]])
+                self.__lookupUsers(kind, batch)
+
+        if (self._lookupCall is not None and
+            not [p for p in self._pendingLookups.itervalues() if p]):
+            self._lookupCall.cancel()
+            self._lookupCall = None
+
+    def __lookupUsers(self, kind, batch):
+        def gotUser(user):
+            if kind == 'user_id':
+                # Ids are ints in JSON responses, and strings in XML.
+                value = str(user.id)
+            else:
+                value = user.screen_name.lower()
+            for d in batch.pop(value, ()):
+                d.callback(user)
+
+        def done(result):
+            for value, waiters in batch.iteritems():
+                for d in waiters:
+                    if isinstance(result, failure.Failure):
+                        d.errback(result)
+                    else:
+                        d.errback(error.Error('404', 'Not Found',
+                                              'User %s not found' % value))
+
+        params = {kind: ','.join(sorted(batch))}
+        d = self.__fetch('lookup_user', '/users/lookup.xml', params,
+                         lambda onItem, onPage: self.parsers.Users(onItem), gotUser)
+        d.addBoth(done)
+
     def search(self, query, delegate, args=None, extra_args=None):
         """Perform a search query.
 
@@ -505,12 +944,18 @@ class Twitter(object):
         may look like this:
 
         def exampleDelegate(entry):
-            print entry.title"""
+            print entry.title
+
+        The results are Atom entries, or, in JSON mode, statuses from the
+        C{.json} variant of the search URL."""
         if args is None:
             args = {}
         args['q'] = query
-        return self.__doDownloadPage(self.search_url + '?' + self._urlencode(args),
-            txml.Feed(delegate, extra_args), agent=self.agent)
+        url = self.search_url
+        if self.parsers is tjson and url.endswith('.atom'):
+            url = url[:-5] + '.json'
+        return self.__doDownloadPage(url + '?' + self._urlencode(args),
+            self.parsers.Search(delegate, extra_args))
 
     def block(self, user):
         """Block the given user.
@@ -524,12 +969,19 @@ class Twitter(object):
         Returns no useful data."""
         return self.__post('/blocks/destroy/%s.xml' % user)
 
-    def update_profile_image(self, filename, image):
+    def update_profile_image(self, filename, image=None):
         """Update the profile image of an authenticated user.
-        The image parameter must be raw data.
+        The image parameter must be raw data or a file object. If it is
+        not given, the image is read from the file at filename.
+
+        Files are streamed, without reading them into memory as a whole.
 
         Returns no useful data."""
 
+        if image is None:
+            image = open(filename, 'rb')
+            filename = os.path.basename(filename)
+
         return self.__postMultipart('/account/update_profile_image.xml',
                                     files=(('image', filename, image),))
 
@@ -558,6 +1010,7 @@ class TwitterFeed(Twitter):
 
     def __init__(self, *args, **kwargs):
         self.proxy_username = None
+        endpoint = None
         if "proxy_host" in kwargs:
             port = 80
             if "proxy_port" in kwargs:
@@ -571,13 +1024,19 @@ class TwitterFeed(Twitter):
                 del kwargs["proxy_password"]
 
             endpoint = endpoints.TCP4ClientEndpoint(reactor, kwargs["proxy_host"], port)
-            self.agent = client.ProxyAgent(endpoint)
             del kwargs["proxy_host"]
-        else:
-            self.agent = client.Agent(reactor)
 
         Twitter.__init__(self, *args, **kwargs)
 
+        if endpoint is not None:
+            self.agent = client.ProxyAgent(endpoint)
+        elif self.tlsPolicy is not None:
+            # Share the TLS policy with REST calls, so that reconnects of
+            # streams can resume their TLS session.
+            self.agent = client.Agent(reactor, self.tlsPolicy)
+        else:
+            self.agent = client.Agent(reactor)
+
 
     def _rtfeed(self, url, delegate, args):
         def cb(response):
@@ -744,6 +1203,37 @@ class TwitterFeed(Twitter):
             args)
 
 
+    def pull(self, method, *args, **kwargs):
+        """
+        Open a stream to be read from a queue, instead of a delegate.
+
+        For example, C{feed.pull(feed.track, ['twisted'], size=100)} returns
+        a queue of statuses matching C{'twisted'}, that pauses the stream
+        while 100 statuses are waiting to be taken. The queue is closed when
+        the stream ends.
+
+        @param method: One of the stream methods of this class.
+
+        @param args: Further arguments to C{method}, after the delegate.
+
+        @param size: Keyword argument with the size of the buffer, see
+            L{pull.StatusQueue}.
+
+        @return: Deferred that fires with a L{pull.StatusQueue} once the
+            stream is connected.
+        """
+        queue = pull.StatusQueue(**kwargs)
+
+        def cb(protocol):
+            queue.registerProducer(protocol)
+            protocol.deferred.addCallbacks(queue.close, queue.close)
+            return queue
+
+        d = method(queue, *args)
+        d.addCallback(cb)
+        return d
+
+
 
 class Error(Exception):
     """
@@ -766,6 +1256,37 @@ class NoConsumerError(Error):
 
 
 
+class _Handover(object):
+    """
+    A new stream that L{TwitterMonitor} opens next to the current one.
+
+    @ivar protocol: The protocol of the new stream, once connected.
+
+    @ivar switched: Whether delivery has switched to the new stream.
+
+    @ivar cancelled: Whether the new stream was abandoned.
+
+    @ivar previousLost: Whether the previous stream was closed before the
+        switch, in which case the new stream takes over as soon as it is
+        connected.
+
+    @ivar seen: Ids of the entries delivered from the previous stream
+        while both streams were open.
+
+    @ivar early: Entries received before the new stream was connected.
+    """
+
+    def __init__(self):
+        self.protocol = None
+        self.switched = False
+        self.cancelled = False
+        self.previousLost = False
+        self.timeoutCall = None
+        self.seen = set()
+        self.early = []
+
+
+
 class TwitterMonitor(service.Service):
     """
     Reconnecting Twitter monitor service.
@@ -793,6 +1314,10 @@ class TwitterMonitor(service.Service):
     @ivar _delay: Current delay, in seconds.
     @type _delay: C{float}
 
+    @ivar _wait: Current wait before reconnecting, in seconds. This is
+        L{_delay}, unless full jitter applies.
+    @type _wait: C{float}
+
     @ivar _state: Current state.
 
     @ivar _errorState: Current error state. One of C{None}, C{'http'},
@@ -801,23 +1326,103 @@ class TwitterMonitor(service.Service):
     @ivar _reconnectDelayedCall: Current pending reconnect call.
     @type _reconnectDelayedCall: {twitter.internet.base.DelayedCall}
 
+    @ivar handover: Whether a forced reconnect while connected opens the
+        new stream before closing the current one. Delivery switches to the
+        new stream when it delivers its first entry, or after
+        L{handoverTimeout} seconds, and the current stream is then closed.
+        Entries delivered by both streams are passed on once, by id.
+    @type handover: C{bool}
+
+    @ivar handoverTimeout: Number of seconds after which delivery switches
+        to a new, connected stream that has not delivered any entries yet.
+    @type handoverTimeout: C{float}
+
+    @ivar _handover: The current or last handover.
+    @type _handover: L{_Handover}
+
+    @ivar backfill: Optional callable that fetches the statuses missed
+        while disconnected, like L{twittytwister.backfill.Backfill}. It is
+        called with L{args} and L{lastId} when a new connection is made,
+        and returns a deferred that fires with a list of statuses. Entries
+        from the new connection are held back until the statuses are
+        fetched, and then passed on together in id order, without
+        duplicates. A reconnect while a backfill is in progress does not
+        start another one.
+
+    @ivar lastId: The highest status id passed to the delegate, as an
+        integer. Set it before starting the service to backfill from a
+        known status.
+
+    @ivar lastBackfill: Report of the last completed backfill, a dictionary
+        with the keys C{'sinceId'}, C{'gap'} (the seconds without a
+        connection, or C{None} if unknown), C{'fetched'} (the number of
+        statuses fetched), C{'recovered'} (those of them not also received
+        from the new connection), C{'buffered'} (the number of entries held
+        back) and C{'duration'} (the seconds it took).
+    @type lastBackfill: C{dict}
+
+    @ivar checkpointStore: Optional store to save the state of the monitor
+        in, see L{twittytwister.checkpoint}. The state is loaded when the
+        service starts, and saved every L{checkpointInterval} seconds if it
+        changed, and when the service stops. It holds L{lastId}, L{args}
+        and the back-off state, under the name of the service, or
+        C{'monitor'}.
+
+    @ivar checkpointInterval: Seconds between checkpoints.
+    @type checkpointInterval: C{float}
+
+    @ivar watchdog: Optional watchdog that watches the current stream, like
+        L{twittytwister.watchdog.StreamWatchdog}. When it flags the stream
+        as stalled or delayed, the monitor reconnects, as with
+        C{connect(forceReconnect=True)}.
+
     @cvar backOffs: Configuration of back-off strategies for the various
         error states (see L{_errorState}). The value is a dictionary with
         keys C{'initial'}, C{'max'} and {'factor'} to represent the initial
         and maximum backoff delay (both in seconds), and the multiplication
         factor on each attempt, respectively. The key C{'errorTypes'} key
-        holds a set of exceptions to match failures against.
+        holds a set of exceptions to match failures against. The optional
+        key C{'jitter'} selects randomized delays, so that monitors that
+        lost their connections together do not reconnect in lockstep:
+        C{'full'} waits a random time up to the delay, and
+        C{'decorrelated'} waits a random time between the initial delay
+        and C{'factor'} times the previous wait, up to the maximum.
     @type backOffs: C{dict}
 
+    @ivar random: The source of randomness for jitter.
+    @type random: C{random.Random}
+
+    @ivar metrics: Reconnect metrics of this monitor, see L{snapshot}.
+    @type metrics: L{metrics.MonitorMetrics}
+
     """
     noisy = False
 
     protocol = None
 
+    handover = False
+    handoverTimeout = 30
+
     _delay = None
+    _wait = None
     _state = None
     _errorState = None
     _reconnectDelayedCall = None
+    _handover = None
+
+    backfill = None
+    lastId = None
+    lastBackfill = None
+    _backfilling = None
+    _lostAt = None
+
+    checkpointStore = None
+    checkpointInterval = 10
+    _checkpointer = None
+
+    watchdog = None
+
+    random = random.Random()
 
     backOffs = {
             # Back-off settings from clean disconnects
@@ -863,7 +1468,10 @@ class TwitterMonitor(service.Service):
 
         @param delegate: The consumer of received Twitter entries.
             This callable will be called with a L{Status} instances as they
-            are received.
+            are received. If it has C{registerProducer} and
+            C{unregisterProducer} methods, like
+            L{twittytwister.dispatch.ThreadPoolDelegate}, the streams are
+            registered with it, so that it can pause them.
 
         @param args: Initial arguments to the API.
         @type args: C{dict}
@@ -874,6 +1482,8 @@ class TwitterMonitor(service.Service):
         if reactor is None:
             from twisted.internet import reactor
         self.reactor = reactor
+        self.metrics = metrics.MonitorMetrics(reactor.seconds())
+        self.metrics.stateChanged('stopped', reactor.seconds())
         self._state = 'stopped'
 
 
@@ -885,6 +1495,15 @@ class TwitterMonitor(service.Service):
         L{connect} to attempt an initial conection.
         """
         service.Service.startService(self)
+        if self.checkpointStore is not None:
+            self._checkpointer = checkpoint.Checkpointer(
+                self.checkpointStore, self.name or 'monitor',
+                self.checkpointState, self.checkpointInterval, self.reactor)
+            state = self._checkpointer.load()
+            if state is not None:
+                self.restoreCheckpoint(state)
+            self._checkpointer.start()
+
         self._toState('idle')
 
         try:
@@ -901,6 +1520,35 @@ class TwitterMonitor(service.Service):
         """
         service.Service.stopService(self)
         self._toState('stopped')
+        if self._checkpointer is not None:
+            self._checkpointer.stop()
+            self._checkpointer = None
+
+
+    def checkpointState(self):
+        """
+        Return the state to save in a checkpoint.
+        """
+        return {'lastId': self.lastId,
+                'args': self.args,
+                'errorState': self._errorState,
+                'delay': self._delay}
+
+
+    def restoreCheckpoint(self, state):
+        """
+        Restore the state from a checkpoint.
+
+        L{lastId} and L{args} are only restored if they are not set.
+        """
+        if self.lastId is None:
+            self.lastId = state.get('lastId')
+        if self.args is None and state.get('args') is not None:
+            self.args = dict([(str(key), value) for key, value
+                              in state['args'].iteritems()])
+        if 'errorState' in state and state['errorState'] in self.backOffs:
+            self._errorState = state['errorState']
+            self._delay = state.get('delay')
 
 
     def connect(self, forceReconnect=False):
@@ -913,6 +1561,8 @@ class TwitterMonitor(service.Service):
         If the service is not running, this will do nothing.
 
         @param forceReconnect: Drop an existing connection to reconnnect.
+            If connected and L{handover} is set, the existing connection is
+            only dropped once the new one is up.
         @type forceReconnect: C{False}
 
         @raises L{ConnectError}: When a connection (attempt) is already in
@@ -926,7 +1576,10 @@ class TwitterMonitor(service.Service):
             raise Error("This service is not running. Not connecting.")
         if self._state == 'connected':
             if forceReconnect:
-                self._toState('disconnecting')
+                if self.handover:
+                    self._startHandover()
+                else:
+                    self._toState('disconnecting')
                 return True
             else:
                 raise ConnectError("Already connected.")
@@ -984,7 +1637,28 @@ class TwitterMonitor(service.Service):
         self._errorState = None
 
         def cb(result):
+            unregister = getattr(self.delegate, 'unregisterProducer', None)
+            if unregister is not None:
+                unregister(protocol)
+
+            if protocol is not self.protocol:
+                # This stream was handed over to a new one.
+                return
+
             self.protocol = None
+            if self.watchdog is not None:
+                self.watchdog.unwatch()
+            handover = self._handover
+            if (handover is not None and not handover.switched and
+                not handover.cancelled):
+                # The new stream takes over.
+                handover.previousLost = True
+                if handover.protocol is not None:
+                    self._switch(handover)
+                return
+
+            self._handover = None
+            self._lostAt = self.reactor.seconds()
             if self._state == 'stopped':
                 # Don't transition to any other state. We are stopped.
                 pass
@@ -998,6 +1672,211 @@ class TwitterMonitor(service.Service):
         self.protocol = protocol
         d = protocol.deferred
         d.addBoth(cb)
+        if self.watchdog is not None:
+            self.watchdog.watch(protocol, self._stalled)
+        register = getattr(self.delegate, 'registerProducer', None)
+        if register is not None:
+            register(protocol)
+
+
+    def _stalled(self, reason):
+        """
+        Called when the watchdog flags the current stream.
+        """
+        log.msg("Stream stalled: %s" % (reason,))
+        handover = self._handover
+        if handover is not None and not handover.switched:
+            # The new stream takes over as soon as it delivers.
+            return
+        if self._state == 'connected':
+            self.connect(forceReconnect=True)
+
+
+    def _deliver(self, entry):
+        """
+        Pass an entry to the delegate.
+        """
+        handover = self._handover
+        if handover is not None and not handover.switched:
+            id = getattr(entry, 'id', None)
+            if id is not None:
+                handover.seen.add(id)
+
+        if self._backfilling is not None:
+            self._backfilling.append(entry)
+        else:
+            self._passOn(entry)
+
+
+    def _passOn(self, entry):
+        id = statusId(entry)
+        if id is not None and (self.lastId is None or id > self.lastId):
+            self.lastId = id
+
+        if self.delegate:
+            try:
+                self.delegate(entry)
+            except:
+                log.err()
+
+
+    def _startBackfill(self):
+        """
+        Fetch the statuses since L{lastId} and hold back new entries until
+        they are in.
+        """
+        sinceId = self.lastId
+        started = self.reactor.seconds()
+        if self._lostAt is None:
+            gap = None
+        else:
+            gap = started - self._lostAt
+        buffered = self._backfilling = []
+
+        if self.noisy:
+            log.msg("Backfilling statuses since %d" % (sinceId,))
+
+        def failed(reason):
+            log.err(reason, "Backfill failed")
+            return []
+
+        def merge(entries):
+            if self._backfilling is not buffered:
+                return
+            self._backfilling = None
+
+            entries = [entry for entry in entries
+                       if statusId(entry) > sinceId]
+            live = set([statusId(entry) for entry in buffered])
+            recovered = len([entry for entry in entries
+                             if statusId(entry) not in live])
+            for entry in mergeEntries(entries, buffered):
+                self._passOn(entry)
+
+            self.lastBackfill = {'sinceId': sinceId,
+                                 'gap': gap,
+                                 'fetched': len(entries),
+                                 'recovered': recovered,
+                                 'buffered': len(buffered),
+                                 'duration': self.reactor.seconds() - started}
+            if self.noisy:
+                log.msg("Backfilled %d statuses in %0.2f seconds" %
+                        (recovered, self.lastBackfill['duration']))
+
+        d = defer.maybeDeferred(self.backfill, self.args, sinceId)
+        d.addErrback(failed)
+        d.addCallback(merge)
+
+
+    def _flushBackfill(self):
+        """
+        Pass on the entries held back for a backfill, and ignore its result.
+        """
+        buffered, self._backfilling = self._backfilling, None
+        for entry in buffered or ():
+            self._passOn(entry)
+
+
+    def _startHandover(self):
+        """
+        Open a new stream with the current arguments, next to the current
+        one.
+        """
+        self._cancelHandover()
+        handover = self._handover = _Handover()
+
+        def onEntry(entry):
+            if handover.cancelled:
+                return
+            if handover.protocol is None:
+                handover.early.append(entry)
+                return
+            if not handover.switched:
+                self._switch(handover)
+            if getattr(entry, 'id', None) in handover.seen:
+                return
+            self._deliver(entry)
+
+        def lost(result):
+            if handover.switched:
+                return result
+            if handover.cancelled:
+                return
+            # The new stream was dropped before it took over.
+            self._handover = None
+            if handover.previousLost:
+                self._toState('disconnected', result)
+            else:
+                log.err(result, "New stream dropped during handover")
+
+        def responseReceived(protocol):
+            if handover.cancelled:
+                protocol.deferred.addErrback(lambda _: None)
+                protocol.transport.stopProducing()
+                return
+
+            handover.protocol = protocol
+            protocol.deferred.addBoth(lost)
+            if handover.previousLost or handover.early:
+                self._switch(handover)
+                early, handover.early = handover.early, []
+                for entry in early:
+                    onEntry(entry)
+            else:
+                handover.timeoutCall = self.reactor.callLater(
+                    self.handoverTimeout, self._switch, handover)
+
+        def trapError(reason):
+            if handover.cancelled:
+                return
+            self._handover = None
+            if handover.previousLost:
+                self._toState('error', reason)
+            else:
+                log.err(reason, "Handover failed, keeping the current stream")
+
+        if self.noisy:
+            log.msg("Opening new stream for handover.")
+        d = self.api(onEntry, self.args)
+        d.addCallbacks(responseReceived, trapError)
+
+
+    def _switch(self, handover):
+        """
+        Switch delivery to the new stream of a handover and close the
+        previous one.
+        """
+        if handover.switched:
+            return
+        handover.switched = True
+        if handover.timeoutCall is not None:
+            if handover.timeoutCall.active():
+                handover.timeoutCall.cancel()
+            handover.timeoutCall = None
+
+        if self.noisy:
+            log.msg("Handing over to the new stream.")
+        previous = self.protocol
+        self.makeConnection(handover.protocol)
+        if previous is not None:
+            previous.transport.stopProducing()
+
+
+    def _cancelHandover(self):
+        """
+        Abandon a handover that has not switched yet.
+        """
+        handover = self._handover
+        self._handover = None
+        if handover is None or handover.switched:
+            return
+
+        handover.cancelled = True
+        if handover.timeoutCall is not None:
+            handover.timeoutCall.cancel()
+            handover.timeoutCall = None
+        if handover.protocol is not None:
+            handover.protocol.transport.stopProducing()
 
 
     def _reconnect(self, errorState):
@@ -1017,18 +1896,56 @@ class TwitterMonitor(service.Service):
 
         if self._errorState != errorState or self._delay is None:
             self._errorState = errorState
-            self._delay = backOff['initial']
+            previous = None
         else:
-            self._delay = min(backOff['max'], self._delay * backOff['factor'])
+            previous = self._delay
+        self._delay = self._nextDelay(backOff, previous)
 
-        if self._delay == 0:
+        if backOff.get('jitter') == 'full':
+            self._wait = self.random.uniform(0, self._delay)
+        else:
+            self._wait = self._delay
+        self.metrics.reconnecting(errorState, self._wait)
+
+        if self._wait == 0:
             connect()
         else:
-            self._reconnectDelayedCall = self.reactor.callLater(self._delay,
+            self._reconnectDelayedCall = self.reactor.callLater(self._wait,
                                                                 connect)
             self._toState('waiting')
 
 
+    def _nextDelay(self, backOff, previous):
+        """
+        Return the back-off delay after the previous one.
+
+        @param previous: The previous delay, or C{None} for the first.
+        """
+        if backOff.get('jitter') == 'decorrelated':
+            upper = (previous or backOff['initial']) * backOff['factor']
+            return min(backOff['max'],
+                       self.random.uniform(backOff['initial'], upper))
+        elif previous is None:
+            return backOff['initial']
+        else:
+            return min(backOff['max'], previous * backOff['factor'])
+
+
+    def snapshot(self):
+        """
+        Return the reconnect metrics, see L{metrics.MonitorMetrics.snapshot}.
+        """
+        return self.metrics.snapshot(self.reactor.seconds())
+
+
+    @property
+    def state(self):
+        """
+        The name of the current state, like C{'connected'} or C{'waiting'}.
+        """
+        return self._state
+
+
     def _toState(self, state, *args, **kwargs):
         """
         Transition to the next state.
@@ -1041,6 +1958,7 @@ class TwitterMonitor(service.Service):
             raise ValueError("No such state %r" % state)
 
         log.msg("%s: to state %r" % (self.__class__.__name__, state))
+        self.metrics.stateChanged(state, self.reactor.seconds())
         self._state = state
         method(*args, **kwargs)
 
@@ -1056,6 +1974,10 @@ class TwitterMonitor(service.Service):
         if self._reconnectDelayedCall:
             self._reconnectDelayedCall.cancel()
             self._reconnectDelayedCall = None
+        self._cancelHandover()
+        self._flushBackfill()
+        if self.watchdog is not None:
+            self.watchdog.unwatch()
         self.loseConnection()
 
 
@@ -1090,7 +2012,10 @@ class TwitterMonitor(service.Service):
         Errors will cause a transition to the C{'error'} state.
         """
 
+        stream = []
+
         def responseReceived(protocol):
+            stream.append(protocol)
             self.makeConnection(protocol)
             if self._state == 'aborting':
                 self._toState('disconnecting')
@@ -1101,13 +2026,10 @@ class TwitterMonitor(service.Service):
             self._toState('error', failure)
 
         def onEntry(entry):
-            if self.delegate:
-                try:
-                    self.delegate(entry)
-                except:
-                    log.err()
-            else:
-                pass
+            if stream and stream[0] is not self.protocol:
+                # Handed over to a new stream.
+                return
+            self._deliver(entry)
 
         d = self.api(onEntry, self.args)
         d.addCallback(responseReceived)
@@ -1121,8 +2043,12 @@ class TwitterMonitor(service.Service):
         The protocol passed to this state has a deferred that will fire
         when the connection has been dropped, which then causes a transition
         to the C{'disconnected'} state.
+
+        If L{backfill} is set, the statuses since L{lastId} are fetched.
         """
-        pass
+        if (self.backfill is not None and self.lastId is not None and
+            self._backfilling is None):
+            self._startBackfill()
 
 
     def _state_disconnecting(self):
@@ -1162,7 +2088,7 @@ class TwitterMonitor(service.Service):
         Wait for L{delay} seconds until attempting a new connect.
         """
         if self.noisy:
-            log.msg("Reconnecting in %0.2f seconds" % (self._delay,))
+            log.msg("Reconnecting in %0.2f seconds" % (self._wait,))
 
 
     def _state_error(self, reason):
@@ -1,3 +1,5 @@
+from xml.parsers import expat
+
 from twisted.internet import error
 from twisted.web import sux, microdom
 
@@ -16,24 +18,37 @@ class NoopParser(object):
         # don't store anything on the object after parsing this
         return None
 
+def _cleanup(n):
+    return n.replace(':', '_')
+
 class BaseXMLHandler(object):
 
+    __slots__ = ('done', 'current_ob', 'tag_name', 'before_delegates',
+                 'after_delegates', 'handler_dict', 'enter_unknown')
+
     def __init__(self, n, handler_dict={}, enter_unknown=False):
         self.done = False
         self.current_ob = None
         self.tag_name = n
-        self.before_delegates = {}
-        self.after_delegates = {}
+        self.before_delegates = None
+        self.after_delegates = None
         self.handler_dict = handler_dict
         self.enter_unknown = enter_unknown
 
-        for p in self.handler_dict:
-            self.__dict__[self.cleanup(p)] = None
+    def __getattr__(self, name):
+        # fields that did not occur in the document are None
+        if name not in BaseXMLHandler.__slots__ and name in self.fieldNames():
+            return None
+        raise AttributeError(name)
 
     def setBeforeDelegate(self, name, fn):
+        if self.before_delegates is None:
+            self.before_delegates = {}
         self.before_delegates[name] = fn
 
     def setAfterDelegate(self, name, fn):
+        if self.after_delegates is None:
+            self.after_delegates = {}
         self.after_delegates[name] = fn
 
     def setDelegate(self, name, before=None, after=None):
@@ -55,35 +70,38 @@ class BaseXMLHandler(object):
             self.setDelegate(namelist[0], before, after)
 
     def objectStarted(self, name, o):
-        if name in self.before_delegates:
-            self.before_delegates[name](o)
+        delegates = self.before_delegates
+        if delegates is not None and name in delegates:
+            delegates[name](o)
 
     def objectFinished(self, name, o):
-        if name in self.after_delegates:
-            self.after_delegates[name](o)
+        delegates = self.after_delegates
+        if delegates is not None and name in delegates:
+            delegates[name](o)
 
     def gotTagStart(self, name, attrs):
-        if self.current_ob:
-            self.current_ob.gotTagStart(name, attrs)
+        current = self.current_ob
+        if current:
+            current.gotTagStart(name, attrs)
         elif name in self.handler_dict:
-            self.current_ob = self.handler_dict[name](name)
-            self.objectStarted(name, self.current_ob)
+            current = self.current_ob = self.handler_dict[name](name)
+            self.objectStarted(name, current)
         elif not self.enter_unknown:
             logger.warning("Got unknown tag %s in %s", name, self.__class__)
             self.current_ob = NoopParser(name)
 
     def gotTagEnd(self, name, data):
-        if self.current_ob:
-            self.current_ob.gotTagEnd(name, data)
-            if self.current_ob.done:
-                v = self.current_ob.value()
+        current = self.current_ob
+        if current:
+            current.gotTagEnd(name, data)
+            if current.done:
+                v = current.value()
                 if v is not None:
-                    self.__dict__[self.cleanup(name)] = v
+                    setattr(self, self.attributeName(name), v)
                     self.objectFinished(name, v)
                 self.current_ob = None
         elif name == self.tag_name:
             self.done = True
-            del self.current_ob
             self.gotFinalData(data)
 
     def gotFinalData(self, data):
@@ -95,13 +113,29 @@ class BaseXMLHandler(object):
         return self
 
     def cleanup(self, n):
-        return n.replace(':', '_')
+        return _cleanup(n)
+
+    def attributeName(self, n):
+        """Return the name of the attribute that holds the value of a tag"""
+        return self.cleanup(n)
+
+    def fieldNames(self):
+        """Return the names of the attributes for the known tags"""
+        return [self.attributeName(p) for p in self.handler_dict]
+
+    def asDict(self):
+        """Return the fields of this object as a dictionary"""
+        d = dict([(f, getattr(self, f)) for f in self.fieldNames()])
+        d.update(getattr(self, '__dict__', {}))
+        return d
 
     def __repr__(self):
-        return "{%s %s}" % (self.tag_name, self.__dict__)
+        return "{%s %s}" % (self.tag_name, self.asDict())
 
 class XMLStringHandler(BaseXMLHandler):
     """XML data handler for simple string fields"""
+    __slots__ = ('data',)
+
     def gotFinalData(self, data):
         self.data = data
 
@@ -109,10 +143,56 @@ class XMLStringHandler(BaseXMLHandler):
         return self.data
 
 
+# Predefined handlers of this module waiting for _resolveForwardProps
+_unresolved = []
+
+class _PredefinedHandlerType(type):
+    """
+    Metaclass that gives predefined handlers a slot for each field, and
+    builds their dispatch tables once.
+
+    Complex properties that refer to classes defined later in this module
+    are declared in C{FORWARD_PROPS}, as a dict of their tags to the names
+    of their classes. Their slots are reserved when the class is created,
+    and L{_resolveForwardProps} adds their classes to C{COMPLEX_PROPS} once
+    all of them are defined.
+    """
+
+    def __new__(mcs, name, bases, ns):
+        def lookup(attr):
+            if attr in ns:
+                return ns[attr]
+            return getattr(bases[0], attr, ())
+
+        inherited = set()
+        for base in bases:
+            for klass in base.__mro__:
+                inherited.update(klass.__dict__.get('__slots__', ()))
+
+        tags = (list(lookup('SIMPLE_PROPS')) +
+                [p.MY_TAG for p in lookup('COMPLEX_PROPS')] +
+                list(lookup('FORWARD_PROPS')))
+        slots = list(ns.get('__slots__', ()))
+        for tag in tags:
+            n = _cleanup(tag)
+            if n not in inherited and n not in slots:
+                slots.append(n)
+        ns['__slots__'] = tuple(slots)
+        klass = type.__new__(mcs, name, bases, ns)
+        if _unresolved is None:
+            klass._compile()
+        else:
+            _unresolved.append(klass)
+        return klass
+
+
 class PredefinedXMLHandler(BaseXMLHandler):
+    __metaclass__ = _PredefinedHandlerType
+
     MY_TAG = ''
     SIMPLE_PROPS = []
     COMPLEX_PROPS = []
+    FORWARD_PROPS = {}
 
     # if set to True, contents inside unknown tags
     # will be parsed as if the unknown tags weren't
@@ -120,9 +200,26 @@ class PredefinedXMLHandler(BaseXMLHandler):
     ENTER_UNKNOWN = False
 
     def __init__(self, n):
-        handler_dict = dict([(p.MY_TAG,p) for p in self.COMPLEX_PROPS])
-        handler_dict.update([(p,XMLStringHandler) for p in self.SIMPLE_PROPS])
-        super(PredefinedXMLHandler, self).__init__(n, handler_dict, self.ENTER_UNKNOWN)
+        super(PredefinedXMLHandler, self).__init__(n, self._handlers,
+                                                   self.ENTER_UNKNOWN)
+
+    @classmethod
+    def _compile(klass):
+        """
+        Build the dispatch tables of this class, once its properties are
+        complete.
+        """
+        handlers = dict([(p.MY_TAG, p) for p in klass.COMPLEX_PROPS])
+        handlers.update([(p, XMLStringHandler) for p in klass.SIMPLE_PROPS])
+        klass._attributes = dict([(p, _cleanup(p)) for p in handlers])
+        klass._fields = frozenset(klass._attributes.itervalues())
+        klass._handlers = handlers
+
+    def attributeName(self, n):
+        return self._attributes[n]
+
+    def fieldNames(self):
+        return self._fields
 
 class Author(PredefinedXMLHandler):
     MY_TAG = 'author'
@@ -134,6 +231,9 @@ class Entry(PredefinedXMLHandler):
                     'twitter:source', 'twitter:lang']
     COMPLEX_PROPS = [Author]
 
+    # links are stored by their relation
+    __slots__ = ('__dict__',)
+
     def gotTagStart(self, name, attrs):
         super(Entry, self).gotTagStart(name, attrs)
         if name == 'link':
@@ -150,13 +250,12 @@ class Status(PredefinedXMLHandler):
         'in_reply_to_status_id', 'in_reply_to_screen_name',
         'in_reply_to_user_id', 'favorited', 'user_id', 'geo']
     COMPLEX_PROPS = []
+    # circular references:
+    FORWARD_PROPS = {'retweeted_status': 'RetweetedStatus', 'user': 'User'}
 
 class RetweetedStatus(Status):
     MY_TAG = 'retweeted_status'
 
-# circular reference:
-Status.COMPLEX_PROPS.append(RetweetedStatus)
-
 
 class User(PredefinedXMLHandler):
     MY_TAG = 'user'
@@ -170,9 +269,6 @@ class User(PredefinedXMLHandler):
         'geo_enabled']
     COMPLEX_PROPS = [Status]
 
-# circular reference:
-Status.COMPLEX_PROPS.append(User)
-
 
 class SenderUser(User):
     MY_TAG = 'sender'
@@ -242,25 +338,64 @@ class IDListPage(ListPage):
     COMPLEX_PROPS = [IDList]
 
 
+def _resolveForwardProps():
+    """
+    Add the classes named in C{FORWARD_PROPS} to C{COMPLEX_PROPS}, now that
+    they are defined, and build the dispatch tables of the predefined
+    handlers of this module. Handlers defined afterwards get their tables
+    when they are created.
+    """
+    global _unresolved
+    for klass in _unresolved:
+        forward = klass.__dict__.get('FORWARD_PROPS', {})
+        for tag, name in sorted(forward.iteritems()):
+            prop = globals()[name]
+            if prop.MY_TAG != tag:
+                raise TypeError("%s is the class of <%s>, not <%s>"
+                                % (name, prop.MY_TAG, tag))
+            klass.COMPLEX_PROPS.append(prop)
+    for klass in _unresolved:
+        klass._compile()
+    _unresolved = None
+
+_resolveForwardProps()
+
+
+class _TopLevelHandler(BaseXMLHandler):
+    """Handler for a whole document, holding its top level object"""
+
+
 def topLevelXMLHandler(toplevel_type):
     """Used to create a BaseXMLHandler object that just handles a single type of tag"""
-    return BaseXMLHandler(None,
+    return _TopLevelHandler(None,
                           handler_dict={toplevel_type.MY_TAG:toplevel_type},
                           enter_unknown=True)
 
 
-class Parser(sux.XMLParser):
+def _splitUTF8(b):
+    """Split off an incomplete UTF-8 sequence at the end of a string"""
+    for i in xrange(1, min(len(b), 4) + 1):
+        c = ord(b[-i])
+        if c & 0xC0 == 0x80:
+            # continuation byte
+            continue
+        if c >= 0xF0:
+            needed = 4
+        elif c >= 0xE0:
+            needed = 3
+        elif c >= 0xC0:
+            needed = 2
+        else:
+            needed = 1
+        if needed > i:
+            return b[:-i], b[-i:]
+        break
+    return b, ''
 
-    """A file-like thingy that parses a friendfeed feed with SUX."""
-    def __init__(self, handler):
-        self.connectionMade()
-        self.data=[]
-        self.handler=handler
 
-    def write(self, b):
-        self.dataReceived(b)
-    def close(self):
-        self.connectionLost(error.ConnectionDone())
+class _ParserCallbacks(object):
+    """XML callbacks and file-like methods shared by the parser backends"""
+
     def open(self):
         pass
     def read(self):
@@ -272,7 +407,10 @@ class Parser(sux.XMLParser):
         self.handler.gotTagStart(name, attrs)
 
     def gotTagEnd(self, name):
-        self.handler.gotTagEnd(name, ''.join(self.data).decode('utf8'))
+        data = ''.join(self.data)
+        if isinstance(data, str):
+            data = data.decode('utf8')
+        self.handler.gotTagEnd(name, data)
 
     def gotText(self, data):
         self.data.append(data)
@@ -287,7 +425,186 @@ class Parser(sux.XMLParser):
             logger.error("Unhandled entity reference: %s\n" % (data))
 
 
-def listParser(list_type, delegate, extra_args=None):
+class SuxParser(_ParserCallbacks, sux.XMLParser):
+
+    """A file-like thingy that parses a friendfeed feed with SUX."""
+    def __init__(self, handler):
+        self.connectionMade()
+        self.data=[]
+        self.handler=handler
+        self._partial = ''
+
+    def write(self, b):
+        # Newer versions of sux decode each chunk by itself, so keep back
+        # a UTF-8 sequence that is split across chunks.
+        b, self._partial = _splitUTF8(self._partial + b)
+        if b:
+            self.dataReceived(b)
+    def close(self):
+        self.connectionLost(error.ConnectionDone())
+
+
+class ExpatParser(_ParserCallbacks):
+
+    """A file-like thingy that parses a feed incrementally with expat.
+
+    This produces the same callbacks as L{SuxParser}. Expat replaces
+    references by their characters, but reports each of them as a separate
+    piece of text. The original reference is taken from the input context
+    of that text, so that it can be handled like sux does.
+
+    Sux remains the default L{Parser}; pass this class as the C{parser}
+    argument of the parser factories to use expat.
+    """
+
+    def __init__(self, handler):
+        self.data=[]
+        self.handler=handler
+        self._inCData = False
+
+        parser = self._parser = expat.ParserCreate()
+        parser.UseForeignDTD(True)
+        parser.StartElementHandler = self.gotTagStart
+        parser.EndElementHandler = self.gotTagEnd
+        parser.CharacterDataHandler = self._characterData
+        parser.SkippedEntityHandler = self._skippedEntity
+        parser.StartCdataSectionHandler = self._startCData
+        parser.EndCdataSectionHandler = self._endCData
+
+    def write(self, b):
+        self._parser.Parse(b, False)
+    def close(self):
+        try:
+            self._parser.Parse('', True)
+        except expat.ExpatError, e:
+            # sux does not complain about incomplete documents either
+            logger.warning("Incomplete document: %s", e)
+
+    def _characterData(self, data):
+        # A reference decodes to at most two code units, and its input
+        # context starts with the reference itself.
+        if len(data) <= 2 and not self._inCData:
+            context = self._parser.GetInputContext()
+            if context and context[0] == '&':
+                self.gotEntityReference(context[1:context.index(';')])
+                return
+        self.data.append(data)
+
+    def _skippedEntity(self, name, isParameterEntity):
+        self.gotEntityReference(name)
+
+    def _startCData(self):
+        self._inCData = True
+
+    def _endCData(self):
+        self._inCData = False
+
+
+# Default parser of the factories below
+Parser = SuxParser
+
+
+class PathExtractor(object):
+
+    """A file-like thingy that extracts the text at some paths of a document.
+
+    Paths are tuples of tag names below the root element, like
+    C{('user', 'screen_name')} in a status. The text of the first element
+    at each path is used. No objects are built for the document, and the
+    rest of it is skipped once all paths have been found.
+
+    The delegate is called once, with a dictionary mapping the paths that
+    were found to their text.
+    """
+
+    def __init__(self, paths, delegate):
+        self.delegate = delegate
+        self.results = {}
+        self._wanted = set([tuple(p) for p in paths])
+        self._prefixes = set([p[:i] for p in self._wanted
+                                    for i in xrange(len(p) + 1)])
+        self._path = None
+        self._skip = 0
+        self._collecting = None
+        self._text = None
+        self._done = False
+
+        parser = self._parser = expat.ParserCreate()
+        parser.UseForeignDTD(True)
+        parser.StartElementHandler = self._startElement
+        parser.EndElementHandler = self._endElement
+        parser.CharacterDataHandler = self._characterData
+
+    def open(self):
+        pass
+    def read(self):
+        return None
+    def write(self, b):
+        if not self._done:
+            try:
+                self._parser.Parse(b, False)
+            except expat.ExpatError:
+                # expat goes on to the end of the data after the paths were
+                # found, without calling back
+                if not self._done:
+                    raise
+    def close(self):
+        if self._done:
+            return
+        try:
+            self._parser.Parse('', True)
+        except expat.ExpatError, e:
+            logger.warning("Incomplete document: %s", e)
+        if not self._done:
+            self._finish()
+
+    def _startElement(self, name, attrs):
+        if self._skip:
+            self._skip += 1
+            return
+        if self._path is None:
+            # the root element
+            self._path = ()
+            return
+
+        path = self._path + (name,)
+        if path not in self._prefixes:
+            self._skip = 1
+            return
+        self._path = path
+        if path in self._wanted and path not in self.results:
+            self._collecting = path
+            self._text = []
+
+    def _endElement(self, name):
+        if self._skip:
+            self._skip -= 1
+            return
+
+        path = self._path
+        if path is self._collecting:
+            self.results[path] = u''.join(self._text)
+            self._collecting = self._text = None
+            if len(self.results) == len(self._wanted):
+                self._finish()
+                return
+        self._path = path[:-1]
+
+    def _characterData(self, data):
+        if (self._collecting is not None and not self._skip and
+            self._path is self._collecting):
+            self._text.append(data)
+
+    def _finish(self):
+        self._done = True
+        parser = self._parser
+        parser.StartElementHandler = None
+        parser.EndElementHandler = None
+        parser.CharacterDataHandler = None
+        self.delegate(self.results)
+
+
+def listParser(list_type, delegate, extra_args=None, parser=None):
     toplevel_type = list_type.ITEM_TYPE
 
     if extra_args:
@@ -300,13 +617,13 @@ def listParser(list_type, delegate, extra_args=None):
 
     handler = list_type(None)
     handler.setPredefDelegate(toplevel_type, after=do_delegate)
-    return Parser(handler)
+    return (parser or Parser)(handler)
 
 def simpleListFactory(list_type):
     """Used for simple parsers that support only one type of object"""
-    def create(delegate, extra_args=None):
+    def create(delegate, extra_args=None, parser=None):
         """Create a Parser object for the specific tag type, on the fly"""
-        return listParser(list_type, delegate, extra_args)
+        return listParser(list_type, delegate, extra_args, parser)
     return create
 
 
@@ -321,6 +638,9 @@ Statuses = simpleListFactory(StatusList)
 
 HoseFeed = simpleListFactory(StatusList)
 
+# Search results are Atom entries
+Search   = Feed
+
 
 class Pager:
     """Able to create parsers that support paging, and parsers that don't"""
@@ -328,28 +648,42 @@ class Pager:
         self.page_type = page_type
         self.list_type = list_type
 
-    def pagingParser(self, delegate, page_delegate):
+    def pagingParser(self, delegate, page_delegate, parser=None):
         item_tag = self.list_type.item_tag()
         root_handler = topLevelXMLHandler(self.page_type)
         root_handler.setPredefDelegate(self.page_type, after=page_delegate)
         root_handler.setSubDelegates([self.page_type.MY_TAG, self.list_type.MY_TAG, item_tag], after=delegate)
-        return Parser(root_handler)
+        return (parser or Parser)(root_handler)
 
-    def noPagingParser(self, delegate):
+    def noPagingParser(self, delegate, parser=None):
         item_tag = self.list_type.item_tag()
         root_handler = topLevelXMLHandler(self.list_type)
         root_handler.setSubDelegates([self.list_type.MY_TAG, item_tag], after=delegate)
-        return Parser(root_handler)
+        return (parser or Parser)(root_handler)
 
 
 PagedUserList = Pager(UserListPage, UserList)
 PagedIDList = Pager(IDListPage, IDList)
 
 
+def UpdateResponse(delegate):
+    """Create a parser that passes the id of a new status to the delegate"""
+    return PathExtractor([('id',)], lambda results: delegate(results[('id',)]))
+
+
+def extractPaths(xml, paths):
+    """Return the text at some paths of a document, see L{PathExtractor}"""
+    results = []
+    extractor = PathExtractor(paths, results.append)
+    extractor.write(xml)
+    extractor.close()
+    return results[0]
+
+
 def parseXML(xml):
     return microdom.parseXMLString(xml)
 
 def parseUpdateResponse(xml):
-    return parseXML(xml).getElementsByTagName("id")[0].firstChild().data
+    return extractPaths(xml, [('id',)])[('id',)]
 
 # vim: set expandtab:
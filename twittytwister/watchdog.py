@@ -0,0 +1,319 @@
+# -*- test-case-name: twittytwister.test.test_watchdog -*-
+#
+# See LICENSE.txt for details
+
+"""
+Detection of stalled and delayed streams.
+"""
+
+import calendar
+import math
+import time
+
+from twisted.internet import task
+
+def parseCreatedAt(value):
+    """
+    Return the time of a C{created_at} value like
+    C{'Mon Dec 06 11:46:33 +0000 2010'} in seconds since the epoch, or
+    C{None} if it cannot be parsed.
+    """
+    try:
+        parts = value.split()
+        offset = parts.pop(4)
+        seconds = calendar.timegm(time.strptime(' '.join(parts),
+                                                '%a %b %d %H:%M:%S %Y'))
+        sign = offset.startswith('-') and -1 or 1
+        offset = sign * (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60)
+    except (AttributeError, IndexError, ValueError):
+        return None
+    return seconds - offset
+
+
+
+class EWMA(object):
+    """
+    Exponentially weighted moving average, and of the absolute deviation
+    from it.
+
+    @ivar value: The average, or C{None} before the first sample.
+    @ivar deviation: The average absolute deviation.
+    """
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+        self.deviation = 0.0
+
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = float(sample)
+        else:
+            self.deviation += self.alpha * (abs(sample - self.value) -
+                                            self.deviation)
+            self.value += self.alpha * (sample - self.value)
+
+
+
+class StreamWatchdog(object):
+    """
+    Watchdog that flags streams that stall or fall behind.
+
+    Every L{interval} seconds, the counters of the watched
+    L{twittytwister.streaming.TwitterStream} are sampled. The expected rate
+    of datagrams and the interval between keep-alives are learned as
+    moving averages, and carry over to the next stream watched. A stream is
+    flagged when:
+
+     - nothing, not even a keep-alive, was received for L{keepAliveFactor}
+       times the usual keep-alive interval;
+     - no datagrams were received for longer than a stream at the expected
+       rate is silent with probability L{stallProbability}, so that quiet
+       filters get more slack than busy ones;
+     - the short term rate stays below L{dropRatio} times the expected
+       rate, for L{dropPolls} samples in a row;
+     - the delay between the C{created_at} of the last status and its
+       receipt exceeds its usual value by more than L{lagFactor} times its
+       usual deviation, for L{lagPolls} samples in a row.
+
+    Except for the first, these checks start after L{warmup} seconds of a
+    stream. A flagged stream is no longer watched. Streams that were
+    paused, because their consumer falls behind, are not checked.
+
+    @ivar rate: Expected number of datagrams per second.
+    @type rate: L{EWMA}
+
+    @ivar keepAliveInterval: Usual number of seconds between keep-alives.
+    @type keepAliveInterval: L{EWMA}
+
+    @ivar lag: Usual delay of statuses, in seconds.
+    @type lag: L{EWMA}
+
+    @ivar stalls: Number of streams flagged.
+
+    @ivar lastReason: Description of why the last stream was flagged.
+    """
+
+    interval = 5
+    warmup = 60
+
+    keepAliveFactor = 2.5
+    defaultKeepAliveInterval = 30
+
+    stallProbability = 1e-6
+    minSilence = 30
+    maxSilence = 900
+
+    dropRatio = 0.1
+    dropPolls = 4
+    minExpected = 5
+
+    lagFactor = 6
+    minLagMargin = 30
+    lagPolls = 3
+
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.rate = EWMA(0.05)
+        self.keepAliveInterval = EWMA(0.2)
+        self.lag = EWMA(0.05)
+        self.stalls = 0
+        self.lastReason = None
+        self.protocol = None
+        self._call = None
+
+
+    def watch(self, protocol, onStall):
+        """
+        Start watching a stream, instead of the current one.
+
+        @param onStall: Called with a description when the stream is
+            flagged.
+        """
+        self.unwatch()
+        now = self.reactor.seconds()
+        self.protocol = protocol
+        self._onStall = onStall
+        self._started = now
+        self._lastPoll = now
+        self._lastData = now
+        self._lastActivity = now
+        self._lastKeepAlive = None
+        self._datagrams = getattr(protocol, 'datagrams', 0)
+        self._keepAlives = getattr(protocol, 'keepAlives', 0)
+        self._fastRate = EWMA(0.5)
+        self._dropping = 0
+        self._lagging = 0
+
+        self._call = task.LoopingCall(self.check)
+        self._call.clock = self.reactor
+        self._call.start(self.interval, now=False)
+
+
+    def unwatch(self):
+        """
+        Stop watching the current stream.
+        """
+        if self._call is not None and self._call.running:
+            self._call.stop()
+        self._call = None
+        self.protocol = None
+
+
+    def check(self):
+        """
+        Sample the counters of the stream and flag it if needed.
+        """
+        protocol = self.protocol
+        now = self.reactor.seconds()
+        elapsed = now - self._lastPoll
+        self._lastPoll = now
+        if elapsed <= 0:
+            return
+
+        datagrams = getattr(protocol, 'datagrams', 0) - self._datagrams
+        keepAlives = getattr(protocol, 'keepAlives', 0) - self._keepAlives
+        self._datagrams += datagrams
+        self._keepAlives += keepAlives
+
+        if keepAlives:
+            if self._lastKeepAlive is not None:
+                self.keepAliveInterval.update((now - self._lastKeepAlive) /
+                                              keepAlives)
+            self._lastKeepAlive = now
+        if datagrams:
+            self._lastData = now
+        if datagrams or keepAlives:
+            self._lastActivity = now
+        if getattr(protocol, 'paused', False):
+            # Not reading, on purpose.
+            self._lastData = self._lastActivity = now
+            return
+
+        rate = float(datagrams) / elapsed
+        reason = self._checkSilence(now)
+        if reason is not None:
+            pass
+        elif now - self._started >= self.warmup:
+            reason = (self._checkStall(now) or
+                      self._checkRate(rate) or
+                      self._checkLag(now, datagrams))
+        else:
+            self._learn(now, rate, datagrams)
+
+        if reason is not None:
+            self.stalls += 1
+            self.lastReason = reason
+            onStall = self._onStall
+            self.unwatch()
+            onStall(reason)
+
+
+    def _learn(self, now, rate, datagrams):
+        """
+        Update the averages during the warm-up.
+        """
+        self._fastRate.update(rate)
+        self.rate.update(rate)
+        if datagrams:
+            lag = self._currentLag(now)
+            if lag is not None:
+                self.lag.update(lag)
+
+
+    def _currentLag(self, now):
+        createdAt = parseCreatedAt(getattr(self.protocol, 'lastCreatedAt',
+                                           None))
+        if createdAt is None:
+            return None
+        return now - createdAt
+
+
+    def _checkSilence(self, now):
+        interval = self.keepAliveInterval.value
+        if interval is None:
+            interval = self.defaultKeepAliveInterval
+        timeout = self.keepAliveFactor * interval
+        if now - self._lastActivity > timeout:
+            return "Nothing received for %d seconds" % (now -
+                                                        self._lastActivity)
+
+
+    def silenceThreshold(self):
+        """
+        Return the number of seconds without datagrams after which the
+        stream is flagged.
+
+        For datagrams arriving at the expected rate M{r}, the chance of no
+        arrivals during M{t} seconds is M{exp(-rt)}.
+        """
+        if not self.rate.value:
+            return self.maxSilence
+        threshold = -math.log(self.stallProbability) / self.rate.value
+        return min(self.maxSilence, max(self.minSilence, threshold))
+
+
+    def _checkStall(self, now):
+        silence = now - self._lastData
+        if silence > self.silenceThreshold():
+            return ("No statuses for %d seconds, expected %0.2f per second" %
+                    (silence, self.rate.value))
+
+
+    def _checkRate(self, rate):
+        self._fastRate.update(rate)
+        expected = self.rate.value or 0
+        if (expected * self.interval >= self.minExpected and
+            self._fastRate.value < self.dropRatio * expected):
+            self._dropping += 1
+            if self._dropping >= self.dropPolls:
+                return ("Rate dropped to %0.2f per second, expected %0.2f" %
+                        (self._fastRate.value, expected))
+        else:
+            # Only learn from streams that are not degraded.
+            self._dropping = 0
+            self.rate.update(rate)
+
+
+    def lagThreshold(self):
+        """
+        Return the delay of statuses above which they are late.
+        """
+        if self.lag.value is None:
+            return None
+        return self.lag.value + max(self.minLagMargin,
+                                    self.lagFactor * self.lag.deviation)
+
+
+    def _checkLag(self, now, datagrams):
+        if not datagrams:
+            return
+        lag = self._currentLag(now)
+        if lag is None:
+            return
+        threshold = self.lagThreshold()
+        if threshold is not None and lag > threshold:
+            self._lagging += 1
+            if self._lagging >= self.lagPolls:
+                return ("Statuses delayed by %d seconds, expected %d" %
+                        (lag, self.lag.value))
+        else:
+            self._lagging = 0
+            self.lag.update(lag)
+
+
+    def stats(self):
+        """
+        Return a snapshot of the learned averages and flagged streams.
+        """
+        return {'rate': self.rate.value,
+                'keepAliveInterval': self.keepAliveInterval.value,
+                'lag': self.lag.value,
+                'lagDeviation': self.lag.deviation,
+                'silenceThreshold': self.silenceThreshold(),
+                'lagThreshold': self.lagThreshold(),
+                'stalls': self.stalls,
+                'lastReason': self.lastReason}